@@ -0,0 +1,382 @@
+# Benchmarks pyusps against a local benchmarks.server.FakeServer.
+#
+# Every mode verifies the same addresses and reports the addresses
+# verified per second, the p50 and p99 latency of a request in
+# milliseconds and how many addresses failed:
+#
+#     single: One verify call per address
+#     bulk: verify_many without workers
+#     threaded: verify_many with --workers threads
+#     async: pyusps.async_address_information.verify_many with
+#         --concurrency requests in flight
+#     processes: pyusps.multiprocess.verify_many with --processes
+#         processes of --workers threads. Request latencies aren't
+#         collected from other processes.
+#
+# Requests are sent with --method and, unless --no-compress is given,
+# ask for gzipped responses. The processes mode always does. bulk and
+# threaded also report the mean bytes sent and received per request.
+#
+# The micro benchmarks report the best time per call in microseconds
+# of serializing and parsing a request for address_max addresses.
+#
+# Save the results with --output and compare a later run against them
+# with --compare. The run fails if anything got more than --threshold
+# worse. Run it from the project's base directory:
+#
+#     python -m benchmarks.run --output baseline.json
+#     python -m benchmarks.run --compare baseline.json
+
+import argparse
+import json
+import platform
+import sys
+import time
+import timeit
+
+from collections import OrderedDict
+from io import BytesIO
+
+from lxml import etree
+
+from benchmarks.server import FakeServer, _verify
+from pyusps.metrics import MemoryMetrics
+from pyusps.address_information import (
+    USPSClient,
+    _create_xml,
+    _parse_response,
+    _render_xml,
+    address_max,
+    )
+from pyusps.retry import Retry
+from pyusps.transport import PooledTransport
+
+modes = ['single', 'bulk', 'threaded', 'async', 'processes']
+
+
+def _addresses(count):
+    return [
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ('zip_code', '20770'),
+                ])
+        for num in range(count)
+        ]
+
+def _percentile(values, percentile):
+    # Nearest rank
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(-(-percentile * len(values) // 100))
+    return values[max(rank, 1) - 1]
+
+def _summary(count, elapsed, latencies, errors, metrics=None):
+    def ms(seconds):
+        if seconds is None:
+            return None
+        return round(seconds * 1000, 3)
+
+    res = OrderedDict([
+            ('addresses_per_second', round(count / elapsed, 1)),
+            ('p50_ms', ms(_percentile(latencies, 50))),
+            ('p99_ms', ms(_percentile(latencies, 99))),
+            ('requests', len(latencies)),
+            ('errors', errors),
+            ])
+    if metrics is not None:
+        for name in ['bytes_sent', 'bytes_received']:
+            values = metrics.values[name]
+            if values:
+                res[name] = round(sum(values) / float(len(values)), 1)
+    return res
+
+
+class _TimedTransport(object):
+    # Records how long each request takes
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.latencies = []
+
+    def _timed(self, send, *args, **kwargs):
+        start = time.time()
+        try:
+            return send(*args, **kwargs)
+        finally:
+            self.latencies.append(time.time() - start)
+
+    def get(self, url, **kwargs):
+        return self._timed(self.transport.get, url, **kwargs)
+
+    def post(self, url, body, **kwargs):
+        return self._timed(self.transport.post, url, body, **kwargs)
+
+
+def _client(url, transport, method='GET', metrics=None):
+    # Retry quickly so that injected errors don't dominate the timings
+    return USPSClient(
+        'bench',
+        api_url=url,
+        transport=transport,
+        retry=Retry(attempts=3, backoff=0.01),
+        method=method,
+        metrics=metrics,
+        )
+
+def _count_errors(results, count):
+    # Addresses which didn't get a result, e.g., because verify_many
+    # raised, count as errors
+    errors = count - len(results)
+    return errors + sum(1 for res in results if isinstance(res, Exception))
+
+def bench_single(url, addresses, args):
+    transport = PooledTransport(compress=not args.no_compress)
+    client = _client(url, transport, args.method)
+    latencies = []
+    errors = 0
+    start = time.time()
+    for address in addresses:
+        call_start = time.time()
+        try:
+            client.verify(address)
+        except Exception:
+            errors += 1
+        latencies.append(time.time() - call_start)
+    elapsed = time.time() - start
+    transport.close()
+    return _summary(len(addresses), elapsed, latencies, errors)
+
+def _bench_many(url, addresses, workers, args):
+    pooled = PooledTransport(
+        pool_size=max(workers or 1, 10),
+        compress=not args.no_compress,
+        )
+    transport = _TimedTransport(pooled)
+    metrics = MemoryMetrics()
+    client = _client(url, transport, args.method, metrics)
+    results = []
+    start = time.time()
+    try:
+        for res in client.verify_many(addresses, workers=workers):
+            results.append(res)
+    except Exception:
+        pass
+    elapsed = time.time() - start
+    pooled.close()
+    return _summary(
+        len(addresses),
+        elapsed,
+        transport.latencies,
+        _count_errors(results, len(addresses)),
+        metrics,
+        )
+
+def bench_bulk(url, addresses, args):
+    return _bench_many(url, addresses, None, args)
+
+def bench_threaded(url, addresses, args):
+    return _bench_many(url, addresses, args.workers, args)
+
+def bench_async(url, addresses, args):
+    import asyncio
+
+    from pyusps import async_address_information
+
+    class TimedTransport(object):
+        def __init__(self, transport):
+            self.transport = transport
+            self.latencies = []
+
+        async def get(self, url):
+            start = time.time()
+            try:
+                return await self.transport.get(url)
+            finally:
+                self.latencies.append(time.time() - start)
+
+    transport = TimedTransport(async_address_information.StreamTransport())
+    results = []
+
+    async def run():
+        try:
+            async for res in async_address_information.verify_many(
+                'bench',
+                addresses,
+                concurrency=args.concurrency,
+                transport=transport,
+                api_url=url,
+                ):
+                results.append(res)
+        except Exception:
+            pass
+
+    start = time.time()
+    asyncio.run(run())
+    elapsed = time.time() - start
+    return _summary(
+        len(addresses),
+        elapsed,
+        transport.latencies,
+        _count_errors(results, len(addresses)),
+        )
+
+def bench_processes(url, addresses, args):
+    from pyusps import multiprocess
+
+    results = []
+    start = time.time()
+    try:
+        for res in multiprocess.verify_many(
+            'bench',
+            addresses,
+            processes=args.processes,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            api_url=url,
+            retry=Retry(attempts=3, backoff=0.01),
+            method=args.method,
+            ):
+            results.append(res)
+    except Exception:
+        pass
+    elapsed = time.time() - start
+    return _summary(
+        len(addresses),
+        elapsed,
+        [],
+        _count_errors(results, len(addresses)),
+        )
+
+def bench_micro(number):
+    addresses = _addresses(address_max)
+    req = _render_xml('bench', *addresses)
+    body = etree.tostring(_verify(etree.fromstring(req), False))
+    tree = etree.parse(BytesIO(body))
+    cases = OrderedDict([
+            ('create_xml', lambda: etree.tostring(
+                    _create_xml('bench', *addresses),
+                    )),
+            ('render_xml', lambda: _render_xml('bench', *addresses)),
+            ('parse_xml', lambda: etree.parse(BytesIO(body))),
+            ('parse_response', lambda: _parse_response(tree)),
+            ])
+    results = OrderedDict()
+    for (name, fn) in cases.items():
+        best = min(timeit.repeat(fn, number=number, repeat=5))
+        results[name] = OrderedDict([
+                ('us_per_call', round(best / number * 1e6, 3)),
+                ])
+    return results
+
+def compare(results, baseline, threshold):
+    # Return a message for everything which got more than threshold
+    # worse. Throughput should go up, everything else down.
+    regressions = []
+    for (mode, old_values) in baseline['results'].items():
+        new_values = results['results'].get(mode)
+        if new_values is None:
+            continue
+        for (name, old) in old_values.items():
+            new = new_values.get(name)
+            if name in ('requests', 'errors') or not old or new is None:
+                continue
+            change = (new - old) / float(old)
+            if name == 'addresses_per_second':
+                change = -change
+            if change > threshold:
+                regressions.append(
+                    '{mode} {name}: {old} -> {new} ({change:.0%} '
+                    'worse)'.format(
+                        mode=mode,
+                        name=name,
+                        old=old,
+                        new=new,
+                        change=change,
+                        ))
+    return regressions
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark pyusps against a local fake Verify API.',
+        )
+    parser.add_argument('--modes', nargs='+', default=modes, choices=modes)
+    parser.add_argument('--count', type=int, default=500,
+                        help='addresses to verify in each mode')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--processes', type=int,
+                        help='defaults to the number of CPUs')
+    parser.add_argument('--chunk-size', type=int, default=100,
+                        help='addresses per chunk sent to a process')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='seconds the server waits for each request')
+    parser.add_argument('--jitter', type=float, default=0.005)
+    parser.add_argument('--slow-rate', type=float, default=0)
+    parser.add_argument('--slow-latency', type=float, default=0.2)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--http-error-rate', type=float, default=0)
+    parser.add_argument('--shuffle', action='store_true',
+                        help='return the addresses in random order')
+    parser.add_argument('--method', choices=['GET', 'POST'], default='GET')
+    parser.add_argument('--no-compress', action='store_true',
+                        help="don't ask for gzipped responses")
+    parser.add_argument('--number', type=int, default=2000,
+                        help='calls per micro benchmark repetition')
+    parser.add_argument('--no-micro', action='store_true')
+    parser.add_argument('--output', help='save the results to this file')
+    parser.add_argument('--compare', help='results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = _parse_args(argv)
+    server = FakeServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+        error_rate=args.error_rate,
+        http_error_rate=args.http_error_rate,
+        shuffle=args.shuffle,
+        )
+    addresses = _addresses(args.count)
+    results = OrderedDict()
+    with server:
+        for mode in args.modes:
+            bench = globals()['bench_{mode}'.format(mode=mode)]
+            results[mode] = bench(server.url, addresses, args)
+            print('{mode}: {res}'.format(
+                    mode=mode,
+                    res=json.dumps(results[mode]),
+                    ))
+    if not args.no_micro:
+        for (name, res) in bench_micro(args.number).items():
+            results[name] = res
+            print('{name}: {res}'.format(name=name, res=json.dumps(res)))
+
+    output = OrderedDict([
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+            ('config', OrderedDict(sorted(vars(args).items()))),
+            ('results', results),
+            ])
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(output, fp, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        regressions = compare(output, baseline, args.threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# A local stand-in for ShippingAPI.dll which answers Verify requests
+# with every address upper cased and a fixed zip code. Latency, errors
+# and the order of the addresses in a response can be configured so
+# that clients can be benchmarked without a network or a USPS account.
+
+import random
+import threading
+import time
+import zlib
+
+from lxml import etree
+
+import pyusps.urlutil
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+try:
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from SocketServer import ThreadingMixIn
+
+
+def _general_error():
+    res = etree.Element('Error')
+    etree.SubElement(res, 'Number').text = '80040B19'
+    etree.SubElement(res, 'Description').text = (
+        'XML Syntax Error: Please check the XML request to see if it can '
+        'be parsed.'
+        )
+    return res
+
+def _verify(req, shuffle):
+    res = etree.Element('AddressValidateResponse')
+    addresses = req.findall('Address')
+    if shuffle:
+        random.shuffle(addresses)
+    for address in addresses:
+        address_el = etree.SubElement(
+            res,
+            'Address',
+            ID=address.get('ID'),
+            )
+        for tag in ['Address2', 'City', 'State']:
+            el = etree.SubElement(address_el, tag)
+            el.text = (address.findtext(tag) or '').upper()
+        etree.SubElement(address_el, 'Zip5').text = '20770'
+        etree.SubElement(address_el, 'Zip4').text = '1441'
+    return res
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # Many clients connect at once when benchmarking concurrency
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients which time out close the connection early
+        pass
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately. With Nagle's
+    # algorithm the body waits for the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        query = pyusps.urlutil.urlparse(self.path).query
+        self._verify(pyusps.urlutil.parse_qs(query))
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        body = self.rfile.read(length).decode('utf-8')
+        self._verify(pyusps.urlutil.parse_qs(body))
+
+    def _verify(self, query):
+        config = self.server.config
+        latency = config.latency
+        if config.jitter:
+            latency += random.uniform(0, config.jitter)
+        if config.slow_rate and random.random() < config.slow_rate:
+            latency = config.slow_latency
+        if latency:
+            time.sleep(latency)
+
+        if random.random() < config.http_error_rate:
+            self._respond(503, b'Service Unavailable')
+            return
+        req = etree.fromstring(query['XML'][0].encode('utf-8'))
+        if random.random() < config.error_rate:
+            res = _general_error()
+        else:
+            res = _verify(req, config.shuffle)
+        self._respond(200, etree.tostring(res, xml_declaration=True))
+
+    def _respond(self, status, body):
+        accepted = self.headers.get('Accept-Encoding') or ''
+        gzip = self.server.config.compress and 'gzip' in accepted
+        if gzip:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml')
+        if gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeServer(object):
+    # Each request waits latency seconds plus a random jitter of up to
+    # jitter seconds, or slow_latency seconds for a slow_rate fraction
+    # of the requests. An error_rate fraction gets a general error and
+    # an http_error_rate fraction an HTTP 503. If shuffle is set the
+    # addresses in a response are in random order. If compress is set
+    # responses are gzipped for clients which accept it. Requests can
+    # be sent with GET or POST.
+    #
+    # Use it as a context manager or call start and stop. url is the
+    # api_url to pass to a client.
+
+    def __init__(
+        self,
+        latency=0,
+        jitter=0,
+        slow_rate=0,
+        slow_latency=1,
+        error_rate=0,
+        http_error_rate=0,
+        shuffle=False,
+        compress=True,
+        port=0,
+        ):
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.http_error_rate = http_error_rate
+        self.shuffle = shuffle
+        self.compress = compress
+        self.port = port
+        self.url = None
+        self._server = None
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', self.port), _Handler)
+        # The handler reads the settings through the server
+        self._server.config = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:{port}/ShippingAPI.dll'.format(
+            port=self._server.server_address[1],
+            )
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
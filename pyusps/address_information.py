@@ -1,12 +1,36 @@
-from collections import OrderedDict
+import re
+import socket
+import threading
+import time
+
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
+from functools import partial
+from io import BytesIO, StringIO
+from itertools import islice
 
 from lxml import etree
 
+import pyusps.cache
+import pyusps.credentials
+import pyusps.transport
 import pyusps.urlutil
 
 
 api_url = 'https://production.shippingapis.com/ShippingAPI.dll'
 address_max = 5
+dedupe_window = 1024
+# How many results, e.g., of cached or duplicate addresses, verify_many
+# holds back behind a request which isn't full yet before sending it
+# anyway
+read_ahead = 1024
+# Either 'template' or 'etree'. Both build the same request.
+serializer = 'template'
+# General errors which will never go away by retrying, e.g., an
+# authorization failure
+permanent_errors = set(['80040B1A'])
 
 def _find_error(root):
     if root.tag == 'Error':
@@ -16,12 +40,15 @@ def _find_error(root):
 
 def _get_error(error):
     (num, desc) = error
-    return ValueError(
+    error = ValueError(
         '{num}: {desc}'.format(
             num=num.text,
             desc=desc.text,
             )
         )
+    error.number = num.text
+    error.description = desc.text
+    return error
 
 def _get_address_error(address):
     error = address.find('Error')
@@ -29,23 +56,92 @@ def _get_address_error(address):
         error = _find_error(error)
         return _get_error(error)
 
+# Response tags and their more user-friendly result names. Tags
+# which aren't listed are lower cased.
+_fields = OrderedDict([
+        ('FirmName', 'firm_name'),
+        ('Address1', 'address_extended'),
+        ('Address2', 'address'),
+        ('City', 'city'),
+        ('State', 'state'),
+        ('Urbanization', 'urbanization'),
+        ('Zip5', 'zip5'),
+        ('Zip4', 'zip4'),
+        ('ReturnText', 'returntext'),
+        ])
+_record_index = dict(
+    (tag, i) for (i, tag) in enumerate(_fields.keys())
+    )
+
+AddressRecord = namedtuple('AddressRecord', list(_fields.values()))
+
+
+class ResultColumns(object):
+    # Results stored by column instead of by row. columns maps each
+    # field of AddressRecord, error_number and error to a list with a
+    # value per row. A row with an error has None in every field,
+    # error_number has the number of a USPS error and error the
+    # message of any error. Fields without a value are None. Results
+    # can be records or dicts.
+
+    names = AddressRecord._fields + ('error_number', 'error')
+
+    def __init__(self):
+        self.columns = OrderedDict((name, []) for name in self.names)
+        self._appends = [column.append for column in self.columns.values()]
+        self._empty = (None,) * len(AddressRecord._fields)
+
+    def __len__(self):
+        return len(self.columns['error'])
+
+    def append(self, result):
+        if isinstance(result, Exception):
+            values = self._empty + (
+                getattr(result, 'number', None),
+                str(result),
+                )
+        elif isinstance(result, dict):
+            values = tuple(
+                result.get(name) for name in AddressRecord._fields
+                ) + (None, None)
+        else:
+            values = tuple(result) + (None, None)
+        for (append, value) in zip(self._appends, values):
+            append(value)
+
+    def to_pandas(self):
+        # pandas has to be installed
+        import pandas
+        return pandas.DataFrame(self.columns, columns=list(self.names))
+
+    def to_arrow(self):
+        # pyarrow has to be installed
+        import pyarrow
+        return pyarrow.table(self.columns)
+
+
 def _parse_address(address):
     result = OrderedDict()
+    fields = _fields
     for child in address.iterchildren():
         # elements are yielded in order
-        name = child.tag.lower()
-        # More user-friendly names for street
-        # attributes
-        if name == 'address2':
-            name = 'address'
-        elif name == 'address1':
-            name = 'address_extended'
-        elif name == 'firmname':
-            name = 'firm_name'
-        result[name] = child.text
+        tag = child.tag
+        result[fields.get(tag) or tag.lower()] = child.text
 
     return result
 
+def _parse_record(address):
+    # Unlike _parse_address, tags which aren't in _fields are
+    # dropped
+    values = [None] * len(_record_index)
+    index = _record_index
+    for child in address.iterchildren():
+        i = index.get(child.tag)
+        if i is not None:
+            values[i] = child.text
+
+    return AddressRecord._make(values)
+
 def _process_one(address):
     # Raise address error if there's only one item
     error = _get_address_error(address)
@@ -54,57 +150,110 @@ def _process_one(address):
 
     return _parse_address(address)
 
-def _process_multiple(addresses):
-    results = []
-    count = 0
+# Placeholders for request slots which didn't get exactly one address
+_missing = object()
+_duplicate = object()
+
+def _process_multiple(addresses, parse_address=_parse_address, count=None):
+    # Each address is put in the slot of the requested address its ID
+    # refers to, so they can be returned in any order. count is the
+    # number of addresses requested. A slot which gets no address or
+    # more than one gets an IndexError instead.
+    if count is None:
+        count = len(addresses)
+    results = [_missing] * count
     for address in addresses:
+        try:
+            slot = int(address.get('ID'))
+        except (TypeError, ValueError):
+            continue
+        if not 0 <= slot < count:
+            continue
+        if results[slot] is not _missing:
+            results[slot] = _duplicate
+            continue
         # Return error object if there are
         # multiple items
         error = _get_address_error(address)
         if error is not None:
-            result = error
+            results[slot] = error
         else:
-            result = _parse_address(address)
-            if str(count) != address.get('ID'):
-                msg = ('The addresses returned are not in the same '
-                       'order they were requested'
-                       )
-                raise IndexError(msg)
-        results.append(result)
-        count += 1
+            results[slot] = parse_address(address)
 
+    for (slot, result) in enumerate(results):
+        if result is _missing:
+            results[slot] = IndexError(
+                'No address was returned for ID {slot}'.format(slot=slot)
+                )
+        elif result is _duplicate:
+            results[slot] = IndexError(
+                'More than one address was returned for ID '
+                '{slot}'.format(slot=slot)
+                )
     return results
 
-def _parse_response(res):
+def _find_addresses(res):
     # General error, e.g., authorization
     error = _find_error(res.getroot())
     if error is not None:
         raise _get_error(error)
 
     results = res.findall('Address')
-    length = len(results)
-    if length == 0:
+    if len(results) == 0:
         raise TypeError(
             'Could not find any address or error information'
             )
-    if length == 1:
+    return results
+
+def _parse_response(res, count=None):
+    # count is the number of addresses requested
+    results = _find_addresses(res)
+    if len(results) == 1 and count in (None, 1):
         return _process_one(results.pop())
-    return _process_multiple(results)
+    return _process_multiple(results, count=count)
+
+def _parse_batch(res, record=False, count=None):
+    # Always return a list, even for a single address, so that
+    # address errors are returned in place instead of raised
+    results = _find_addresses(res)
+    parse_address = _parse_record if record else _parse_address
+    return _process_multiple(results, parse_address, count)
 
-def _get_response(xml):
+def _get_url(xml, base_url=None):
+    if base_url is None:
+        base_url = api_url
     params = OrderedDict([
             ('API', 'Verify'),
-            ('XML', etree.tostring(xml)),
+            ('XML', xml),
             ])
     url = '{api_url}?{params}'.format(
-        api_url=api_url,
+        api_url=base_url,
         params=pyusps.urlutil.urlencode(params),
         )
 
-    res = pyusps.urlutil.urlopen(url)
-    res = etree.parse(res)
+    return url
+
+# Only the characters which delimit or are decoded in a form value are
+# escaped. The serializers never output anything else which would
+# need it, e.g., control characters or anything outside of ASCII.
+_form_escapes = [
+    (b'%', b'%25'),
+    (b'&', b'%26'),
+    (b'+', b'%2B'),
+    (b'=', b'%3D'),
+    (b' ', b'+'),
+    ]
+_form_prefix = b'API=Verify&XML='
 
-    return res
+def _get_body(xml):
+    # The form encoded parameters of a POST request, as chunks which are
+    # sent in order
+    if not isinstance(xml, bytes):
+        xml = xml.encode('utf-8')
+    for (char, escape) in _form_escapes:
+        if char in xml:
+            xml = xml.replace(char, escape)
+    return [_form_prefix, xml]
 
 def _create_xml(
     user_id,
@@ -184,9 +333,994 @@ def _create_xml(
 
     return root
 
+# Tags are rendered from these strings instead of building elements.
+# An empty string renders as an open and a close tag, None renders as
+# an empty element, the same as etree.tostring does.
+_tags = dict(
+    (
+        tag,
+        (
+            '<{tag}>'.format(tag=tag),
+            '</{tag}>'.format(tag=tag),
+            '<{tag}/>'.format(tag=tag),
+            ),
+        )
+    for tag in [
+        'FirmName',
+        'Address1',
+        'Address2',
+        'City',
+        'State',
+        'Urbanization',
+        'Zip5',
+        'Zip4',
+        ]
+    )
+_text_type = type(u'')
+_invalid_chars = re.compile(
+    u'[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]'
+    )
+
+def _check_text(value):
+    if isinstance(value, bytes):
+        value = value.decode('ascii')
+    elif not isinstance(value, _text_type):
+        raise TypeError(
+            'Argument must be bytes or unicode, got {name!r}'.format(
+                name=type(value).__name__,
+                )
+            )
+    if _invalid_chars.search(value) is not None:
+        raise ValueError(
+            'All strings must be XML compatible: Unicode or ASCII, no '
+            'NULL bytes or control characters'
+            )
+    return value
+
+def _escape_text(value):
+    value = _check_text(value)
+    return (
+        value
+        .replace('&', '&amp;')
+        .replace('<', '&lt;')
+        .replace('>', '&gt;')
+        .replace('\r', '&#13;')
+        )
+
+def _escape_attr(value):
+    return (
+        _escape_text(value)
+        .replace('"', '&quot;')
+        .replace('\n', '&#10;')
+        .replace('\t', '&#9;')
+        )
+
+def _render(parts, tag, text):
+    (start, end, empty) = _tags[tag]
+    if text is None:
+        parts.append(empty)
+    else:
+        parts.append(start)
+        parts.append(_escape_text(text))
+        parts.append(end)
+
+def _render_xml(
+    user_id,
+    *args
+    ):
+    # Same as etree.tostring(_create_xml(user_id, *args)) without
+    # building the elements
+    parts = [
+        '<AddressValidateRequest USERID="',
+        _escape_attr(user_id),
+        '">',
+        ]
+
+    if len(args) > address_max:
+        # Raise here. The Verify API will not return an error. It will
+        # just return the first 5 results
+        raise ValueError(
+            'Only {address_max} addresses are allowed per '
+            'request'.format(
+                address_max=address_max,
+                )
+            )
+
+    for i,arg in enumerate(args):
+        address = arg['address']
+        city = arg['city']
+        state = arg.get('state', None)
+        zip_code = arg.get('zip_code', None)
+        address_extended = arg.get('address_extended', None)
+        firm_name = arg.get('firm_name', None)
+        urbanization = arg.get('urbanization', None)
+
+        parts.append('<Address ID="{i}">'.format(i=i))
+        if firm_name is not None:
+            _render(parts, 'FirmName', firm_name)
+        _render(parts, 'Address1', address_extended)
+        _render(parts, 'Address2', address)
+        _render(parts, 'City', city)
+        _render(parts, 'State', state)
+        if urbanization is not None:
+            _render(parts, 'Urbanization', urbanization)
+
+        zip5 = None
+        zip4 = None
+        if zip_code is not None:
+            zip5 = zip_code[:5]
+            zip4 = zip_code[5:]
+            if zip4.startswith('-'):
+                zip4 = zip4[1:]
+        _render(parts, 'Zip5', zip5)
+        _render(parts, 'Zip4', zip4)
+        parts.append('</Address>')
+
+    if args:
+        parts.append('</AddressValidateRequest>')
+    else:
+        # An empty element is written self-closing
+        parts[-1] = '"/>'
+    # etree.tostring escapes anything outside of ASCII as a character
+    # reference
+    return u''.join(parts).encode('ascii', 'xmlcharrefreplace')
+
+def _serialize(user_id, *args):
+    if serializer == 'template':
+        return _render_xml(user_id, *args)
+    if serializer == 'etree':
+        return etree.tostring(_create_xml(user_id, *args))
+    raise ValueError(
+        'Unknown serializer {serializer!r}'.format(serializer=serializer)
+        )
+
+_transient_errors = pyusps.transport.transient_errors + (
+    etree.XMLSyntaxError,
+    )
+
+def _is_permanent(error):
+    (num, desc) = error
+    return (num.text or '').upper() in permanent_errors
+
+def _is_permanent_error(error):
+    number = getattr(error, 'number', None)
+    return (number or '').upper() in permanent_errors
+
+# Errors which might only be caused by some of the addresses in a
+# request: general errors, errors building the request and responses
+# which don't match the request
+_row_errors = (KeyError, TypeError, ValueError, IndexError)
+
+def _chunk(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def _to_record(result):
+    return AddressRecord._make(
+        result.get(name) for name in AddressRecord._fields
+        )
+
+def _convert(result, record):
+    # Results might come from callers using the other result type, e.g.,
+    # through a shared cache
+    if record and isinstance(result, dict):
+        return _to_record(result)
+    if not record and isinstance(result, AddressRecord):
+        return _to_dict(result)
+    return result
+
+def _to_dict(result):
+    return OrderedDict(
+        (name, value)
+        for (name, value) in zip(AddressRecord._fields, result)
+        if value is not None
+        )
+
+class _Batch(object):
+
+    def __init__(self):
+        self.addresses = []
+        self.keys = []
+        self.futures = []
+
+
+class _ImmediateExecutor(object):
+    # Runs each batch as soon as it's submitted
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def _run_batch(verify_batch, batch):
+    try:
+        results = verify_batch(batch.addresses)
+    except Exception as e:
+        # A general error fails every address in the request
+        for future in batch.futures:
+            future.set_exception(e)
+        return
+    for (i, future) in enumerate(batch.futures):
+        if i < len(results):
+            future.set_result(results[i])
+        else:
+            future.set_exception(
+                TypeError('Could not find any address or error information')
+                )
+
+def _cancel_batch(batch, future):
+    # Release anyone waiting on a batch which will never be sent
+    if future.cancelled():
+        for address_future in batch.futures:
+            address_future.cancel()
+
+def _start_thread(fn, *args):
+    # Call fn in a new daemon thread and return a Future for its result
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = fn(*args)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+class _Expired(Exception):
+    pass
+
+
+def _verify_coalesced(
+    verify_batch,
+    iterable,
+    executor,
+    max_in_flight,
+    inflight,
+    deadline=None,
+    clock=time.time,
+    normalizer=None,
+    lookup=None,
+    records=False,
+    ):
+    # Every distinct address gets one future which is shared by all of
+    # its duplicates within the last dedupe_window distinct addresses,
+    # and by other callers through inflight while it's being requested.
+    # lookup is called with the key of every other address and returns
+    # its cached result or None. Only addresses which aren't cached take
+    # a slot in a request, so requests stay full. Results are returned
+    # as records if records is set and as dicts otherwise, whatever the
+    # caller who requested them asked for. A caller with a deadline
+    # joins the requests of others but doesn't share its own, which
+    # might be cut short by the deadline.
+    if deadline is None:
+        shared = inflight
+    else:
+        shared = None
+    rows = deque()
+    seen = OrderedDict()
+    submitted = deque()
+    batch = _Batch()
+    max_rows = max(max_in_flight * address_max * 2, read_ahead)
+
+    def submit(batch):
+        if shared is not None:
+            for (key, future) in zip(batch.keys, batch.futures):
+                shared.add(key, future)
+        future = executor.submit(_run_batch, verify_batch, batch)
+        future.add_done_callback(partial(_cancel_batch, batch))
+        submitted.append((future, batch))
+
+    def cancel():
+        # Batches which other callers joined are still sent
+        for (future, batch) in submitted:
+            if shared is not None:
+                withdrawn = [
+                    shared.withdraw(key, address_future)
+                    for (key, address_future) in zip(batch.keys, batch.futures)
+                    ]
+                if not all(withdrawn):
+                    continue
+            future.cancel()
+
+    def remaining():
+        if deadline is None:
+            return None
+        return max(0, deadline - clock())
+
+    def wait(future):
+        try:
+            future.exception(timeout=remaining())
+        except FutureTimeoutError:
+            raise _Expired()
+
+    def drain(final):
+        while rows:
+            (future, first) = rows[0]
+            if not (final or len(rows) >= max_rows or future.done()):
+                return
+            wait(future)
+            try:
+                result = future.result()
+            except _transient_errors:
+                # The request was cut short by the deadline
+                if deadline is not None and clock() >= deadline:
+                    raise _Expired()
+                raise
+            rows.popleft()
+            result = _convert(result, records)
+            # Duplicates get their own copy of the result
+            if not first and isinstance(result, dict):
+                result = OrderedDict(result)
+            yield result
+
+    iterable = iter(iterable)
+    try:
+        for address in iterable:
+            if normalizer is not None:
+                try:
+                    address = normalizer(address)
+                except ValueError as e:
+                    # Rejected without a request
+                    future = Future()
+                    future.set_result(e)
+                    rows.append((future, True))
+                    continue
+            key = pyusps.cache.cache_key(address)
+            future = seen.pop(key, None)
+            first = False
+            if future is None and inflight is not None:
+                future = inflight.get(key)
+            if future is None and lookup is not None:
+                result = lookup(key)
+                if result is not None:
+                    future = Future()
+                    future.set_result(result)
+                    first = True
+            if future is None:
+                future = Future()
+                first = True
+                batch.addresses.append(address)
+                batch.futures.append(future)
+                batch.keys.append(key)
+            seen[key] = future
+            if len(seen) > dedupe_window:
+                seen.popitem(last=False)
+            rows.append((future, first))
+
+            if len(batch.addresses) == address_max:
+                submit(batch)
+                batch = _Batch()
+            elif len(rows) >= max_rows and batch.addresses:
+                # Too many duplicates are waiting on a partial request
+                submit(batch)
+                batch = _Batch()
+
+            # Block on the oldest request once the limit is reached so
+            # that the input is never read too far ahead
+            while len(submitted) >= max_in_flight:
+                wait(submitted[0][0])
+                submitted.popleft()
+            for result in drain(final=False):
+                yield result
+            if deadline is not None and clock() >= deadline:
+                raise _Expired()
+
+        if batch.addresses:
+            submit(batch)
+        for result in drain(final=True):
+            yield result
+    except _Expired:
+        # Stop sending requests. Return what has finished and a timeout
+        # error in place of everything else.
+        cancel()
+        for (future, first) in rows:
+            if not future.done() or future.cancelled():
+                yield socket.timeout('Deadline exceeded')
+                continue
+            error = future.exception()
+            if error is None:
+                result = _convert(future.result(), records)
+                if not first and isinstance(result, dict):
+                    result = OrderedDict(result)
+                yield result
+            elif isinstance(error, _transient_errors):
+                yield error
+            else:
+                raise error
+        # Keep one result per address
+        for address in iterable:
+            yield socket.timeout('Deadline exceeded')
+    finally:
+        # The generator might be closed before it's exhausted
+        cancel()
+        executor.shutdown(wait=False)
+
+
+class USPSClient(object):
+    # Holds everything shared by the requests made with one user ID so
+    # that a long-running service can keep one client per credential
+    # and reuse its connections, cache and in-flight lookups. Safe to
+    # share between threads.
+    #
+    # user_id can also be a pyusps.credentials.CredentialPool. Each
+    # request is then sent with the next credential in the pool and
+    # waits on its rate_limiter, if it has one, instead of the
+    # client's. A credential which fails authorization is removed from
+    # the pool and the request is sent again with another one. Only
+    # connection errors and timeouts count as failures of a
+    # credential.
+    #
+    # hooks maps an event name to a list of callables:
+    #
+    #     request: Called with the URL before it's sent
+    #     response: Called with the URL and the parsed response
+    #
+    # rate_limiter is a pyusps.retry.TokenBucket which every request,
+    # including retries, waits on. retry is a pyusps.retry.Retry which
+    # resends requests which failed with a transient transport error or
+    # a general error which isn't in permanent_errors.
+    #
+    # timeout is the number of seconds to wait for each request.
+    #
+    # metrics is a pyusps.metrics.Metrics which is sent timings, sizes
+    # and counts. Nothing is measured without one.
+    #
+    # normalizer is called with every address before it's requested,
+    # e.g., pyusps.normalize.normalize. It returns the address to send
+    # or raises a ValueError, which is returned in place of the address
+    # without requesting it.
+    #
+    # hedge is a pyusps.retry.Hedge. If it's set, a request made by
+    # verify which is slower than most is sent again and the first
+    # response wins.
+    #
+    # method is either GET, which sends the request XML in the query
+    # string, or POST, which sends it as a form encoded body. POST
+    # requests are smaller and aren't limited by the length of a URL.
+    # The transport needs a post method.
+
+    def __init__(
+        self,
+        user_id,
+        api_url=None,
+        transport=None,
+        cache=None,
+        inflight=None,
+        hooks=None,
+        rate_limiter=None,
+        retry=None,
+        timeout=None,
+        hedge=None,
+        metrics=None,
+        normalizer=None,
+        method='GET',
+        clock=time.time,
+        ):
+        if method not in ('GET', 'POST'):
+            raise ValueError(
+                'Unknown method {method!r}'.format(method=method)
+                )
+        if transport is None:
+            transport = pyusps.transport.default_transport
+        if inflight is None:
+            inflight = pyusps.cache.SingleFlight()
+        if hooks is None:
+            hooks = {}
+        self.user_id = user_id
+        self.api_url = api_url
+        self.transport = transport
+        self.cache = cache
+        self.inflight = inflight
+        self.hooks = hooks
+        self.rate_limiter = rate_limiter
+        self.retry = retry
+        self.timeout = timeout
+        self.hedge = hedge
+        self.metrics = metrics
+        self.normalizer = normalizer
+        self.method = method
+        self._clock = clock
+        self._pool = None
+        if isinstance(user_id, pyusps.credentials.CredentialPool):
+            self._pool = user_id
+
+    def _dispatch(self, event, *args):
+        for hook in self.hooks.get(event, ()):
+            hook(*args)
+
+    def _timing(self, phase, start):
+        # Report the time since start and return the current time
+        now = self._clock()
+        self.metrics.timing(phase, start, now - start)
+        return now
+
+    def _get_response(self, xml, timeout=None):
+        if self.method == 'POST':
+            url = self.api_url or api_url
+            body = _get_body(xml)
+            send = partial(self.transport.post, url, body)
+            sent = sum(len(chunk) for chunk in body)
+        else:
+            url = _get_url(xml, self.api_url)
+            send = partial(self.transport.get, url)
+            sent = len(url)
+        self._dispatch('request', url)
+        metrics = self.metrics
+        if metrics is not None:
+            start = self._clock()
+        if timeout is None:
+            res = send()
+        else:
+            res = send(timeout=timeout)
+        if metrics is not None:
+            # Read the whole body so that the network isn't timed as
+            # part of parsing
+            data = res.read()
+            start = self._timing('send', start)
+            # Transports which count bytes on the wire know better
+            metrics.observe('bytes_sent', getattr(res, 'bytes_sent', sent))
+            metrics.observe(
+                'bytes_received',
+                getattr(res, 'bytes_received', len(data)),
+                )
+            metrics.observe('bytes_decompressed', len(data))
+            if isinstance(data, bytes):
+                res = BytesIO(data)
+            else:
+                res = StringIO(data)
+        res = etree.parse(res)
+        if metrics is not None:
+            self._timing('parse', start)
+        self._dispatch('response', url, res)
+
+        return res
+
+    def _build(self, batch, user_id=None):
+        if user_id is None:
+            user_id = self.user_id
+        metrics = self.metrics
+        if metrics is None:
+            return _serialize(user_id, *batch)
+        start = self._clock()
+        xml = _serialize(user_id, *batch)
+        self._timing('build', start)
+        metrics.observe('batch_size', len(batch))
+        return xml
+
+    def _count_error(self, error):
+        number = getattr(error, 'number', None)
+        if number is not None:
+            self.metrics.increment('errors', number=number)
+
+    def _process(self, parse, res, *args):
+        # Call parse with the response and count the errors in it
+        if self.metrics is None:
+            return parse(res, *args)
+        start = self._clock()
+        try:
+            results = parse(res, *args)
+        except ValueError as e:
+            self._count_error(e)
+            raise
+        finally:
+            self._timing('process', start)
+        if isinstance(results, list):
+            for result in results:
+                if isinstance(result, ValueError):
+                    self._count_error(result)
+        return results
+
+    def _get_timed(self, xml, timeout):
+        start = self._clock()
+        res = self._get_response(xml, timeout)
+        self.hedge.observe(self._clock() - start)
+        return res
+
+    def _get_hedge(self, xml, timeout, rate_limiter):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        return self._get_timed(xml, timeout)
+
+    def _get_hedged(self, xml, timeout, rate_limiter=None):
+        # Send a second copy of the request if the first one is slow and
+        # return whichever response arrives first. The slower one is
+        # left to finish in the background. The copy waits on
+        # rate_limiter, the one the request was sent with.
+        delay = self.hedge.start()
+        if delay is None:
+            return self._get_timed(xml, timeout)
+        futures = [_start_thread(self._get_timed, xml, timeout)]
+        (done, _) = wait(futures, timeout=delay)
+        if not done and self.hedge.allow():
+            if self.metrics is not None:
+                self.metrics.increment('hedges')
+            futures.append(_start_thread(
+                    self._get_hedge,
+                    xml,
+                    timeout,
+                    rate_limiter,
+                    ))
+        pending = futures
+        while pending:
+            (done, pending) = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+        # Both failed
+        return futures[0].result()
+
+    def _get_timeout(self, deadline):
+        # A request never outlives the deadline
+        if deadline is None:
+            return self.timeout
+        remaining = deadline - self._clock()
+        if remaining <= 0:
+            raise socket.timeout('Deadline exceeded')
+        if self.timeout is None:
+            return remaining
+        return min(self.timeout, remaining)
+
+    def _get_delay(self, attempt, deadline):
+        # Return how long to wait before retrying or None if there are
+        # no retries left
+        retry = self.retry
+        if retry is None or attempt + 1 >= retry.attempts:
+            return None
+        delay = retry.delay(attempt)
+        if deadline is not None and self._clock() + delay >= deadline:
+            return None
+        return delay
+
+    def _send(
+        self,
+        xml,
+        deadline=None,
+        hedge=False,
+        rate_limiter=None,
+        retry_general=True,
+        ):
+        # General errors are only retried if retry_general is set
+        if rate_limiter is None:
+            rate_limiter = self.rate_limiter
+        get_response = self._get_response
+        if hedge and self.hedge is not None:
+            get_response = partial(self._get_hedged, rate_limiter=rate_limiter)
+        attempt = 0
+        while True:
+            timeout = self._get_timeout(deadline)
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            try:
+                res = get_response(xml, timeout)
+            except _transient_errors:
+                delay = self._get_delay(attempt, deadline)
+                if delay is None:
+                    raise
+                reason = 'transport'
+            else:
+                error = _find_error(res.getroot())
+                if error is None or _is_permanent(error):
+                    if rate_limiter is not None and error is None:
+                        rate_limiter.recover()
+                    return res
+                if not retry_general:
+                    return res
+                delay = self._get_delay(attempt, deadline)
+                if delay is None:
+                    return res
+                reason = 'general_error'
+            if self.metrics is not None:
+                self.metrics.increment('retries', reason=reason)
+            # Slow down while the USPS is failing
+            if rate_limiter is not None:
+                rate_limiter.backoff()
+            self.retry.sleep(delay)
+            attempt += 1
+
+    def _send_pooled(
+        self,
+        batch,
+        deadline=None,
+        hedge=False,
+        retry_general=True,
+        ):
+        pool = self._pool
+        while True:
+            credential = pool.acquire()
+            if credential is None:
+                # Every credential failed authorization
+                error = ValueError(*pool.error.args)
+                error.number = pool.error.number
+                error.description = pool.error.description
+                raise error
+            xml = self._build(batch, credential.user_id)
+            try:
+                res = self._send(
+                    xml,
+                    deadline,
+                    hedge,
+                    credential.rate_limiter,
+                    retry_general,
+                    )
+            except _transient_errors:
+                pool.failure(credential)
+                raise
+            error = _find_error(res.getroot())
+            if error is None:
+                pool.success(credential)
+                return res
+            if not _is_permanent(error):
+                # Other general errors, e.g., a request which doesn't
+                # parse, are caused by its addresses. They say nothing
+                # about the credential.
+                return res
+            pool.remove(credential, _get_error(error))
+            if not len(pool):
+                return res
+
+    def _verify_batch(
+        self,
+        batch,
+        record=False,
+        deadline=None,
+        hedge=False,
+        retry_general=True,
+        ):
+        if self._pool is not None:
+            res = self._send_pooled(batch, deadline, hedge, retry_general)
+        else:
+            xml = self._build(batch)
+            res = self._send(xml, deadline, hedge, retry_general=retry_general)
+        return self._process(_parse_batch, res, record, len(batch))
+
+    def _verify_isolated(
+        self,
+        batch,
+        record=False,
+        deadline=None,
+        retry_general=True,
+        ):
+        # Like _verify_batch, but an error which fails the whole
+        # request, e.g., a general error or a malformed address, is
+        # narrowed down by splitting the request in halves until it's
+        # returned in place of the addresses which caused it. A general
+        # error which survived the retries of the whole request is
+        # likely caused by an address, so the halves aren't retried.
+        try:
+            return self._verify_batch(
+                batch,
+                record,
+                deadline,
+                retry_general=retry_general,
+                )
+        except _row_errors as e:
+            if _is_permanent_error(e):
+                raise
+            if len(batch) == 1:
+                return [e]
+        middle = len(batch) // 2
+        return (
+            self._verify_isolated(batch[:middle], record, deadline, False)
+            + self._verify_isolated(batch[middle:], record, deadline, False)
+            )
+
+    def _lookup(self, key, record=False):
+        # The cached result for key or None
+        result = self.cache.get(key)
+        if self.metrics is not None:
+            hit = int(result is not None)
+            self.metrics.increment('cache_hits', hit)
+            self.metrics.increment('cache_misses', 1 - hit)
+        if result is None:
+            return None
+        return _convert(result, record)
+
+    def _verify_cached(
+        self,
+        batch,
+        record=False,
+        isolate=False,
+        deadline=None,
+        hedge=False,
+        lookup=True,
+        ):
+        # lookup is False if the batch's addresses have already been
+        # looked up in the cache
+        verify_batch = partial(self._verify_batch, hedge=hedge)
+        if isolate:
+            verify_batch = self._verify_isolated
+        cache = self.cache
+        if cache is None:
+            return verify_batch(batch, record, deadline)
+
+        keys = [pyusps.cache.cache_key(address) for address in batch]
+        if lookup:
+            results = [self._lookup(key, record) for key in keys]
+        else:
+            results = [None] * len(batch)
+        misses = [i for (i, result) in enumerate(results) if result is None]
+        if not misses:
+            return results
+
+        # Only request the addresses which weren't cached
+        fetched = verify_batch([batch[i] for i in misses], record, deadline)
+        for (i, result) in zip(misses, fetched):
+            results[i] = result
+            # Errors are not cached
+            if not isinstance(result, Exception):
+                cache.set(keys[i], result)
+        return results
+
+    def _verify_normalized(self, addresses):
+        # Rejected addresses get their error in place without being sent
+        results = []
+        valid = []
+        for address in addresses:
+            try:
+                valid.append(self.normalizer(address))
+            except ValueError as e:
+                results.append(e)
+            else:
+                results.append(None)
+        if not valid:
+            return results
+        verified = iter(self._verify_cached(valid, hedge=True))
+        return [
+            next(verified) if result is None else result
+            for result in results
+            ]
+
+    def verify(self, *args):
+        if self.normalizer is not None:
+            results = self._verify_normalized(args)
+        elif self.cache is None and self._pool is None:
+            xml = self._build(args)
+            res = self._send(xml, hedge=True)
+            return self._process(_parse_response, res, len(args))
+        else:
+            results = self._verify_cached(list(args), hedge=True)
+        if len(results) == 1:
+            # Raise address error if there's only one item
+            if isinstance(results[0], Exception):
+                raise results[0]
+            return results[0]
+        return results
+
+    def verify_many(
+        self,
+        iterable,
+        workers=None,
+        max_in_flight=None,
+        records=False,
+        deadline=None,
+        ):
+        # Lazily split the addresses into requests of at most
+        # address_max items so that any number of addresses can be
+        # verified without holding them all in memory
+        if workers is None:
+            executor = _ImmediateExecutor()
+            max_in_flight = 1
+        else:
+            if max_in_flight is None:
+                max_in_flight = workers * 2
+            if max_in_flight < 1:
+                raise ValueError('max_in_flight must be at least 1')
+            executor = ThreadPoolExecutor(max_workers=workers)
+        # deadline is in seconds from now
+        if deadline is not None:
+            deadline = self._clock() + deadline
+        # The engine looks addresses up before they take a slot in a
+        # request
+        verify_batch = partial(
+            self._verify_cached,
+            record=records,
+            isolate=True,
+            deadline=deadline,
+            lookup=False,
+            )
+        lookup = None
+        if self.cache is not None:
+            lookup = partial(self._lookup, record=records)
+        for result in _verify_coalesced(
+            verify_batch,
+            iterable,
+            executor,
+            max_in_flight,
+            self.inflight,
+            deadline,
+            self._clock,
+            self.normalizer,
+            lookup,
+            records,
+            ):
+            yield result
+
+
+    def verify_columns(
+        self,
+        iterable,
+        size=None,
+        workers=None,
+        max_in_flight=None,
+        deadline=None,
+        ):
+        # Like verify_many, but yields ResultColumns of up to size rows
+        # each, or a single one for everything if size is None
+        if size is not None and size < 1:
+            raise ValueError('size must be at least 1')
+        columns = ResultColumns()
+        results = self.verify_many(
+            iterable,
+            workers=workers,
+            max_in_flight=max_in_flight,
+            records=True,
+            deadline=deadline,
+            )
+        for result in results:
+            columns.append(result)
+            if len(columns) == size:
+                yield columns
+                columns = ResultColumns()
+        if len(columns) or size is None:
+            yield columns
+
+
 def verify(user_id, *args):
-    xml = _create_xml(user_id, *args)
-    res = _get_response(xml)
-    res = _parse_response(res)
+    return USPSClient(user_id).verify(*args)
+
+def verify_many(
+    user_id,
+    iterable,
+    workers=None,
+    max_in_flight=None,
+    records=False,
+    deadline=None,
+    **kwargs
+    ):
+    # Any other keyword arguments are passed to USPSClient
+    client = USPSClient(user_id, **kwargs)
+    return client.verify_many(
+        iterable,
+        workers=workers,
+        max_in_flight=max_in_flight,
+        records=records,
+        deadline=deadline,
+        )
 
-    return res
+def verify_columns(
+    user_id,
+    iterable,
+    size=None,
+    workers=None,
+    max_in_flight=None,
+    deadline=None,
+    **kwargs
+    ):
+    # Any other keyword arguments are passed to USPSClient
+    client = USPSClient(user_id, **kwargs)
+    return client.verify_columns(
+        iterable,
+        size=size,
+        workers=workers,
+        max_in_flight=max_in_flight,
+        deadline=deadline,
+        )
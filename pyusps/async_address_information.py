@@ -0,0 +1,184 @@
+# asyncio bindings for the Address Information API. Requests are built
+# and responses are parsed by pyusps.address_information; only the
+# network round trip is asynchronous.
+
+import asyncio
+import socket
+
+from collections import deque
+from io import BytesIO
+
+from lxml import etree
+
+import pyusps.urlutil
+from pyusps.address_information import (
+    _chunk,
+    _get_url,
+    _parse_batch,
+    _parse_response,
+    _serialize,
+    address_max,
+    )
+
+
+class StreamTransport(object):
+    # Minimal HTTP/1.1 client built on asyncio streams. At most limit
+    # requests are open at any time, no matter how many coroutines
+    # share the transport. A request which takes longer than timeout
+    # seconds, from connecting to reading the whole response, raises
+    # socket.timeout.
+
+    def __init__(self, limit=100):
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def get(self, url, timeout=None):
+        async with self._semaphore:
+            if timeout is None:
+                return await self._get(url)
+            try:
+                return await asyncio.wait_for(self._get(url), timeout)
+            except asyncio.TimeoutError:
+                raise socket.timeout('timed out')
+
+    async def _get(self, url):
+        parts = pyusps.urlutil.urlparse(url)
+        ssl = parts.scheme == 'https'
+        port = parts.port
+        if port is None:
+            port = 443 if ssl else 80
+        path = parts.path or '/'
+        if parts.query:
+            path = '{path}?{query}'.format(path=path, query=parts.query)
+
+        reader, writer = await asyncio.open_connection(
+            parts.hostname,
+            port,
+            ssl=ssl or None,
+            )
+        try:
+            req = (
+                'GET {path} HTTP/1.1\r\n'
+                'Host: {host}\r\n'
+                'Connection: close\r\n'
+                '\r\n'
+                ).format(path=path, host=parts.netloc)
+            writer.write(req.encode('latin-1'))
+            await writer.drain()
+            return await self._read_response(reader)
+        finally:
+            writer.close()
+
+    async def _read_response(self, reader):
+        line = await reader.readline()
+        status = line.decode('latin-1').split(None, 2)
+        if len(status) < 2:
+            raise IOError('Malformed HTTP status line')
+        code = int(status[1])
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await self._read_chunked(reader)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+
+        if code != 200:
+            reason = status[2].strip() if len(status) > 2 else ''
+            raise IOError(
+                'HTTP Error {code}: {reason}'.format(
+                    code=code,
+                    reason=reason,
+                    )
+                )
+        return body
+
+    async def _read_chunked(self, reader):
+        chunks = []
+        while True:
+            line = await reader.readline()
+            size = int(line.split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                # Skip trailers
+                while line not in (b'\r\n', b'\n', b''):
+                    line = await reader.readline()
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        return b''.join(chunks)
+
+
+async def _get_response(xml, transport, base_url, timeout):
+    url = _get_url(xml, base_url)
+    if timeout is None:
+        res = await transport.get(url)
+    else:
+        res = await transport.get(url, timeout=timeout)
+    return etree.parse(BytesIO(res))
+
+async def _verify_batch(user_id, batch, transport, base_url, record, timeout):
+    xml = _serialize(user_id, *batch)
+    res = await _get_response(xml, transport, base_url, timeout)
+    return _parse_batch(res, record, len(batch))
+
+async def verify(
+    user_id,
+    *args,
+    transport=None,
+    api_url=None,
+    timeout=None,
+    ):
+    if transport is None:
+        transport = StreamTransport()
+    xml = _serialize(user_id, *args)
+    res = await _get_response(xml, transport, api_url, timeout)
+    return _parse_response(res, len(args))
+
+async def verify_many(
+    user_id,
+    iterable,
+    concurrency=10,
+    transport=None,
+    api_url=None,
+    records=False,
+    timeout=None,
+    ):
+    # Like pyusps.address_information.verify_many, but at most
+    # concurrency requests are in flight at any time. Each request
+    # raises socket.timeout after timeout seconds.
+    if concurrency < 1:
+        raise ValueError('concurrency must be at least 1')
+    if transport is None:
+        transport = StreamTransport(limit=concurrency)
+
+    pending = deque()
+    try:
+        for batch in _chunk(iterable, address_max):
+            if len(pending) >= concurrency:
+                for result in await pending.popleft():
+                    yield result
+            pending.append(
+                asyncio.ensure_future(
+                    _verify_batch(
+                        user_id,
+                        batch,
+                        transport,
+                        api_url,
+                        records,
+                        timeout,
+                        ),
+                    )
+                )
+        while pending:
+            for result in await pending.popleft():
+                yield result
+    finally:
+        for task in pending:
+            task.cancel()
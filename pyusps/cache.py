@@ -0,0 +1,269 @@
+# Result caches for the Address Information API. A cache maps the key
+# returned by cache_key to the result of verifying an address. Any
+# object with the following methods can be used as a cache:
+#
+#     get(key): Return the result for key or None if it's missing
+#     set(key, value): Store the result for key
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+from functools import partial
+
+
+_key_fields = [
+    'address',
+    'city',
+    'state',
+    'zip_code',
+    'address_extended',
+    'firm_name',
+    'urbanization',
+    ]
+
+def _normalize(value):
+    if value is None:
+        return ''
+    # Case and whitespace don't change the address
+    return ' '.join(value.split()).upper()
+
+def cache_key(address):
+    key = [_normalize(address.get(field)) for field in _key_fields]
+    # 20770-1441, 20770 1441 and 207701441 are the same zip code
+    key[3] = key[3].replace('-', '').replace(' ', '')
+    return tuple(key)
+
+def _copy(value):
+    # Results are either dicts or immutable records
+    if isinstance(value, dict):
+        return OrderedDict(value)
+    return value
+
+
+class LRUCache(object):
+    # Keeps at most maxsize results, evicting the least recently used
+    # one first. Results older than ttl seconds are treated as missing.
+    # Safe to share between threads.
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Each copy, e.g., in another process, gets a lock of its own
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is not None:
+                (value, expires) = item
+                if expires is None or self._clock() < expires:
+                    # Re-insert as the most recently used
+                    self._data[key] = item
+                    self.hits += 1
+                    return _copy(value)
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        expires = None
+        if self.ttl is not None:
+            expires = self._clock() + self.ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (_copy(value), expires)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SingleFlight(object):
+    # Tracks the addresses which are being requested so that callers
+    # asking for the same address share one request instead of sending
+    # another. Safe to share between threads.
+
+    def __init__(self):
+        self._futures = {}
+        # Keys whose future another caller has joined
+        self._joined = set()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Futures can't be copied. A copy starts out empty.
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def __len__(self):
+        return len(self._futures)
+
+    def get(self, key):
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                self._joined.add(key)
+            return future
+
+    def withdraw(self, key, future):
+        # Stop sharing a future which won't be needed by the caller who
+        # added it, unless another caller has joined it. Returns whether
+        # nobody else is waiting on it.
+        with self._lock:
+            if self._futures.get(key) is not future:
+                return True
+            if key in self._joined:
+                return False
+            del self._futures[key]
+            return True
+
+    def add(self, key, future):
+        with self._lock:
+            self._futures.setdefault(key, future)
+        # Called right away if the future is already done
+        future.add_done_callback(partial(self._discard, key))
+
+    def _discard(self, key, future):
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+                self._joined.discard(key)
+
+
+class SQLiteCache(object):
+    # Stores results in an SQLite database so that they survive
+    # restarts and are shared by every process using the same path.
+    # The database is in WAL mode, so readers don't block each other or
+    # the writer. Results older than ttl seconds are treated as missing
+    # and removed by purge.
+
+    def __init__(self, path, ttl=None, timeout=30, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key TEXT PRIMARY KEY, '
+            'value TEXT NOT NULL, '
+            'expires REAL'
+            ') WITHOUT ROWID'
+            )
+
+    def __getstate__(self):
+        # A copy, e.g., in another process, opens its own connections
+        state = self.__dict__.copy()
+        del state['_local']
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads or
+        # forked processes
+        pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != pid:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                isolation_level=None,
+                )
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = pid
+        return conn
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT value, expires FROM results WHERE key = ?',
+            (_dump_key(key),),
+            ).fetchone()
+        if row is None or (row[1] is not None and self._clock() >= row[1]):
+            self._count('misses')
+            return None
+        self._count('hits')
+        return _load_value(row[0])
+
+    def set(self, key, value):
+        expires = None
+        if self.ttl is not None:
+            expires = self._clock() + self.ttl
+        self._connect().execute(
+            'INSERT OR REPLACE INTO results (key, value, expires) '
+            'VALUES (?, ?, ?)',
+            (_dump_key(key), _dump_value(value), expires),
+            )
+
+    def purge(self):
+        self._connect().execute(
+            'DELETE FROM results WHERE expires <= ?',
+            (self._clock(),),
+            )
+
+    def clear(self):
+        self._connect().execute('DELETE FROM results')
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+def _dump_key(key):
+    # Normalized fields never contain control characters
+    return '\x1f'.join(key)
+
+def _dump_value(value):
+    # A flat [name, value, name, value, ...] list keeps the order of
+    # the result without repeating any structure
+    if not isinstance(value, dict):
+        value = OrderedDict(
+            (name, field)
+            for (name, field) in zip(value._fields, value)
+            if field is not None
+            )
+    items = []
+    for (name, field) in value.items():
+        items.append(name)
+        items.append(field)
+    return json.dumps(items, separators=(',', ':'))
+
+def _load_value(value):
+    items = json.loads(value)
+    return OrderedDict(zip(items[::2], items[1::2]))
@@ -0,0 +1,300 @@
+# The pyusps command. Verifies the addresses in a CSV or JSONL file and
+# writes each verified row, with the USPS fields added as usps_*
+# columns, to an output file in the same format. Rows which the USPS
+# can't verify are written to an error file, one JSON object per line.
+#
+# The input is streamed, so memory use doesn't grow with its size, and
+# the progress is checkpointed every so often. If a run is interrupted,
+# running it again with --resume continues from the last checkpoint.
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+
+from collections import OrderedDict, deque
+
+import pyusps.normalize
+import pyusps.transport
+from pyusps.address_information import AddressRecord, USPSClient
+from pyusps.retry import Retry, TokenBucket
+
+address_keys = [
+    'firm_name',
+    'address',
+    'address_extended',
+    'city',
+    'state',
+    'zip_code',
+    'urbanization',
+    ]
+result_columns = ['usps_' + field for field in AddressRecord._fields]
+
+
+def _parse_mapping(values):
+    # Each value is key=column
+    mapping = OrderedDict()
+    for value in values:
+        (key, sep, column) = value.partition('=')
+        if not sep or key not in address_keys:
+            raise ValueError(
+                'Invalid mapping {value!r}. Use key=column, where key is '
+                'one of {keys}'.format(
+                    value=value,
+                    keys=', '.join(address_keys),
+                    ))
+        mapping[key] = column
+    return mapping
+
+def _get_format(args):
+    if args.format is not None:
+        return args.format
+    if args.input.endswith('.csv'):
+        return 'csv'
+    if args.input.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    raise ValueError(
+        'Unknown format for {input}. Use --format'.format(input=args.input)
+        )
+
+def _read_csv(fp):
+    return (OrderedDict(row) for row in csv.DictReader(fp))
+
+def _read_jsonl(fp):
+    for line in fp:
+        if line.strip():
+            yield json.loads(line, object_pairs_hook=OrderedDict)
+
+def _to_address(row, mapping):
+    # Empty columns are left out as if they weren't there. Other JSON
+    # values than strings, e.g., a numeric ZIP code, are sent as they're
+    # written in JSON.
+    address = OrderedDict()
+    for key in address_keys:
+        value = row.get(mapping.get(key, key))
+        if value is None or value == '':
+            continue
+        if not isinstance(value, type(u'')):
+            value = json.dumps(value)
+        address[key] = value
+    return address
+
+def _to_error(line, row, error):
+    res = OrderedDict([
+            ('line', line),
+            ('row', row),
+            ('error', str(error)),
+            ])
+    # USPS errors have a number and rejected addresses a field and a
+    # reason
+    for attr in ['number', 'field', 'reason']:
+        value = getattr(error, attr, None)
+        if value is not None:
+            res[attr] = value
+    return json.dumps(res)
+
+
+class _CSVWriter(object):
+
+    def __init__(self, fp, columns):
+        self._writer = csv.DictWriter(fp, columns, extrasaction='ignore')
+
+    def header(self):
+        self._writer.writeheader()
+
+    def write(self, row):
+        self._writer.writerow(row)
+
+
+class _JSONLWriter(object):
+
+    def __init__(self, fp):
+        self._fp = fp
+
+    def header(self):
+        pass
+
+    def write(self, row):
+        self._fp.write(json.dumps(row) + '\n')
+
+
+def _load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with io.open(path, encoding='utf-8') as fp:
+        return json.load(fp)
+
+def _save_checkpoint(path, checkpoint, files):
+    # Everything counted in the checkpoint must be on disk before it is
+    for fp in files:
+        fp.flush()
+        os.fsync(fp.fileno())
+    tmp = path + '.tmp'
+    with io.open(tmp, 'w', encoding='utf-8') as fp:
+        fp.write(json.dumps(checkpoint))
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.rename(tmp, path)
+
+def _open_output(path, offset):
+    # Start over, or drop whatever was written after the checkpoint
+    if offset is None:
+        return io.open(path, 'w', encoding='utf-8', newline='')
+    fp = io.open(path, 'a', encoding='utf-8', newline='')
+    fp.truncate(offset)
+    return fp
+
+def _create_client(args):
+    rate_limiter = None
+    if args.rate is not None:
+        rate_limiter = TokenBucket(args.rate, burst=max(args.workers, 1))
+    return USPSClient(
+        args.user_id,
+        api_url=args.api_url,
+        transport=pyusps.transport.PooledTransport(
+            pool_size=max(args.workers, 1),
+            ),
+        rate_limiter=rate_limiter,
+        retry=Retry(attempts=args.attempts),
+        timeout=args.timeout,
+        method=args.method,
+        normalizer=pyusps.normalize.normalize if args.normalize else None,
+        )
+
+def run(args, stderr=sys.stderr):
+    mapping = _parse_mapping(args.map)
+    input_format = _get_format(args)
+    errors_path = args.errors or args.output + '.errors.jsonl'
+    checkpoint_path = args.output + '.checkpoint'
+    checkpoint = None
+    if args.resume:
+        checkpoint = _load_checkpoint(checkpoint_path)
+    if checkpoint is None:
+        checkpoint = dict(rows=0, output=None, errors=None)
+    done = checkpoint['rows']
+    resumed = checkpoint['output'] is not None
+
+    client = _create_client(args)
+    # Rows which have been sent to the client but haven't come back
+    pending = deque()
+    counts = dict(verified=0, errors=0)
+
+    with io.open(args.input, encoding='utf-8', newline='') as input_fp:
+        if input_format == 'csv':
+            rows = _read_csv(input_fp)
+        else:
+            rows = _read_jsonl(input_fp)
+        output = _open_output(args.output, checkpoint['output'])
+        errors = _open_output(errors_path, checkpoint['errors'])
+        try:
+            writer = None
+            if input_format == 'jsonl':
+                writer = _JSONLWriter(output)
+
+            def addresses():
+                for (line, row) in enumerate(rows, 1):
+                    if line <= done:
+                        continue
+                    pending.append((line, row))
+                    yield _to_address(row, mapping)
+
+            results = client.verify_many(
+                addresses(),
+                workers=args.workers or None,
+                records=True,
+                )
+            for res in results:
+                (line, row) = pending.popleft()
+                if writer is None:
+                    # The CSV columns are only known once a row is read
+                    writer = _CSVWriter(output, list(row) + result_columns)
+                    if not resumed:
+                        writer.header()
+                if isinstance(res, Exception):
+                    errors.write(_to_error(line, row, res) + '\n')
+                    counts['errors'] += 1
+                else:
+                    for (field, value) in zip(result_columns, res):
+                        row[field] = value
+                    writer.write(row)
+                    counts['verified'] += 1
+                if line % args.checkpoint_every == 0:
+                    _save_checkpoint(
+                        checkpoint_path,
+                        dict(
+                            rows=line,
+                            output=output.tell(),
+                            errors=errors.tell(),
+                            ),
+                        [output, errors],
+                        )
+        finally:
+            output.close()
+            errors.close()
+            client.transport.close()
+
+    # Finished, there's nothing to resume
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    stderr.write('{verified} verified, {errors} errors\n'.format(**counts))
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='pyusps',
+        description='Verify the addresses in a CSV or JSONL file.',
+        )
+    parser.add_argument('input', help='a .csv or .jsonl file')
+    parser.add_argument('output', help='where to write the verified rows')
+    parser.add_argument(
+        '--user-id',
+        default=os.environ.get('PYUSPS_USER_ID'),
+        help='USPS user ID, defaults to $PYUSPS_USER_ID',
+        )
+    parser.add_argument('--format', choices=['csv', 'jsonl'])
+    parser.add_argument(
+        '--map',
+        action='append',
+        default=[],
+        metavar='KEY=COLUMN',
+        help='read an address key, e.g., zip_code, from another column',
+        )
+    parser.add_argument(
+        '--errors',
+        help='where to write the rows which failed, defaults to '
+        'OUTPUT.errors.jsonl',
+        )
+    parser.add_argument('--workers', type=int, default=4,
+                        help='requests in flight, 0 to send one at a time')
+    parser.add_argument('--rate', type=float,
+                        help='at most this many requests per second')
+    parser.add_argument('--attempts', type=int, default=3,
+                        help='tries per request')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--normalize', action='store_true',
+                        help='normalize addresses and reject invalid ones '
+                        'without sending them')
+    parser.add_argument('--api-url')
+    parser.add_argument('--method', choices=['GET', 'POST'], default='GET',
+                        help='how requests are sent to the API')
+    parser.add_argument('--checkpoint-every', type=int, default=1000,
+                        metavar='ROWS')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from the last checkpoint')
+    args = parser.parse_args(argv)
+    if not args.user_id:
+        parser.error('--user-id or $PYUSPS_USER_ID is required')
+    return args
+
+def main(argv=None, stderr=sys.stderr):
+    args = _parse_args(argv)
+    try:
+        run(args, stderr)
+    except (IOError, ValueError) as e:
+        stderr.write('pyusps: {error}\n'.format(error=e))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
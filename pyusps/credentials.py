@@ -0,0 +1,111 @@
+# Pools of USPS user IDs. The USPS limits the throughput of each user
+# ID, so a client given a CredentialPool instead of a user ID spreads
+# its requests across all of them.
+
+import threading
+import time
+
+
+class Credential(object):
+    # A user ID with an optional pyusps.retry.TokenBucket of its own.
+    # requests counts the requests it was used for, failures its
+    # consecutive failures and error is why it was removed from its
+    # pool, if it was.
+
+    def __init__(self, user_id, rate_limiter=None):
+        self.user_id = user_id
+        self.rate_limiter = rate_limiter
+        self.requests = 0
+        self.failures = 0
+        self.error = None
+        self._resting_until = 0
+
+    def __repr__(self):
+        return 'Credential({user_id!r})'.format(user_id=self.user_id)
+
+
+class CredentialPool(object):
+    # Hands out credentials in turn. A credential which fails
+    # max_failures times in a row rests for cooldown seconds, unless
+    # all of them are resting. A removed credential, e.g., one which
+    # failed authorization, is never handed out again; error is the
+    # last reason a credential was removed. Safe to share between
+    # threads.
+
+    def __init__(
+        self,
+        credentials,
+        max_failures=3,
+        cooldown=30,
+        clock=time.time,
+        ):
+        self.credentials = [
+            credential if isinstance(credential, Credential)
+            else Credential(credential)
+            for credential in credentials
+            ]
+        if not self.credentials:
+            raise ValueError('At least one credential is required')
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.error = None
+        self._clock = clock
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Each copy, e.g., in another process, gets a lock of its own
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.credentials)
+
+    def acquire(self):
+        # Return the next credential or None if all were removed
+        with self._lock:
+            credentials = self.credentials
+            if not credentials:
+                return None
+            now = self._clock()
+            # Everything might be resting. Then use what recovers first.
+            order = [
+                (self._next + i) % len(credentials)
+                for i in range(len(credentials))
+                ]
+            i = min(
+                order,
+                key=lambda i: max(credentials[i]._resting_until, now),
+                )
+            self._next = i + 1
+            chosen = credentials[i]
+            chosen.requests += 1
+            return chosen
+
+    def success(self, credential):
+        with self._lock:
+            credential.failures = 0
+            credential._resting_until = 0
+
+    def failure(self, credential):
+        with self._lock:
+            credential.failures += 1
+            if credential.failures >= self.max_failures:
+                credential._resting_until = self._clock() + self.cooldown
+
+    def remove(self, credential, error):
+        with self._lock:
+            credential.error = error
+            self.error = error
+            if credential not in self.credentials:
+                return
+            i = self.credentials.index(credential)
+            del self.credentials[i]
+            # Keep the turn of the credential after it
+            if i < self._next:
+                self._next -= 1
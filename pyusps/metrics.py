@@ -0,0 +1,190 @@
+# Measurements reported by a USPSClient which is given a metrics
+# object. A client without one measures nothing.
+#
+# timing is called with the name of a phase, when it started (seconds
+# since the epoch, from the client's clock) and how long it took:
+#
+#     build: Serializing the request
+#     send: Sending the request and reading the response body
+#     parse: Parsing the response body into a tree
+#     process: Turning the tree into results
+#
+# observe is called with a name and a value:
+#
+#     batch_size: Addresses in a request
+#     bytes_sent: Size of a request. The transport's count if it
+#         returns a pyusps.transport.Response, otherwise the length of
+#         the URL or body.
+#     bytes_received: Size of a response as it was received, i.e.,
+#         compressed. The transport's count if it returns a Response,
+#         otherwise the length of the body.
+#     bytes_decompressed: Length of a response body after decompression
+#
+# increment is called with a name, an amount and labels:
+#
+#     cache_hits, cache_misses: Addresses looked up in the cache
+#     retries: Requests sent again, labeled with the reason, transport
+#         or general_error
+#     hedges: Hedged requests
+#     errors: Errors returned by the USPS, labeled with their number
+
+import threading
+import weakref
+
+from collections import defaultdict
+
+# Histogram buckets of the values passed to observe. The default
+# buckets of prometheus_client are for latencies in seconds.
+_batch_buckets = (1, 2, 3, 4, 5)
+_byte_buckets = (
+    128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072,
+    )
+
+def _get_buckets(name):
+    if name == 'batch_size':
+        return _batch_buckets
+    if name.startswith('bytes_'):
+        return _byte_buckets
+    return None
+
+
+class Metrics(object):
+    # Does nothing. Subclass it and override the methods you need.
+
+    def timing(self, phase, start, seconds):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+    def increment(self, name, value=1, **labels):
+        pass
+
+
+class MemoryMetrics(Metrics):
+    # Keeps everything in memory. timings maps a phase and values a
+    # name to a list of measurements. counts maps a tuple of the name
+    # and the label values, sorted by label name, to a total.
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.values = defaultdict(list)
+        self.counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def timing(self, phase, start, seconds):
+        with self._lock:
+            self.timings[phase].append(seconds)
+
+    def observe(self, name, value):
+        with self._lock:
+            self.values[name].append(value)
+
+    def increment(self, name, value=1, **labels):
+        key = (name,) + tuple(labels[label] for label in sorted(labels))
+        with self._lock:
+            self.counts[key] += value
+
+
+# The collectors of each registry. prometheus_client refuses to
+# register a second collector with the same name, so every
+# PrometheusMetrics on a registry shares them.
+_prometheus_collectors = weakref.WeakKeyDictionary()
+_prometheus_lock = threading.Lock()
+
+
+class PrometheusMetrics(Metrics):
+    # Reports to prometheus_client, which has to be installed, as
+    # {namespace}_phase_seconds, a histogram labeled by phase,
+    # {namespace}_{name} histograms for observe and
+    # {namespace}_{name}_total counters for increment. Byte counts and
+    # batch sizes have buckets of their own. Any number of instances
+    # can report to the same registry, e.g., one per client.
+
+    def __init__(self, registry=None, namespace='pyusps'):
+        import prometheus_client
+        if registry is None:
+            registry = prometheus_client.REGISTRY
+        self._prometheus = prometheus_client
+        self._registry = registry
+        self._namespace = namespace
+        with _prometheus_lock:
+            self._metrics = _prometheus_collectors.setdefault(registry, {})
+        self._phases = self._get(
+            prometheus_client.Histogram,
+            'phase_seconds',
+            ('phase',),
+            )
+
+    def _get(self, cls, name, labels=(), **kwargs):
+        key = (self._namespace, name, labels)
+        with _prometheus_lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = cls(
+                    '{namespace}_{name}'.format(
+                        namespace=self._namespace,
+                        name=name,
+                        ),
+                    'pyusps {name}'.format(name=name),
+                    labels,
+                    registry=self._registry,
+                    **kwargs
+                    )
+                self._metrics[key] = metric
+        return metric
+
+    def timing(self, phase, start, seconds):
+        self._phases.labels(phase).observe(seconds)
+
+    def observe(self, name, value):
+        kwargs = {}
+        buckets = _get_buckets(name)
+        if buckets is not None:
+            kwargs['buckets'] = buckets
+        self._get(self._prometheus.Histogram, name, **kwargs).observe(value)
+
+    def increment(self, name, value=1, **labels):
+        names = tuple(sorted(labels))
+        counter = self._get(self._prometheus.Counter, name, names)
+        if names:
+            counter = counter.labels(*[labels[label] for label in names])
+        counter.inc(value)
+
+
+class OpenTelemetryMetrics(Metrics):
+    # Reports each phase as a span named pyusps.{phase} to an
+    # OpenTelemetry tracer and, if a meter is given, everything else to
+    # pyusps.{name} histograms and counters.
+
+    def __init__(self, tracer, meter=None):
+        self._tracer = tracer
+        self._meter = meter
+        self._instruments = {}
+        self._lock = threading.Lock()
+
+    def _get(self, create, name):
+        with self._lock:
+            instrument = self._instruments.get(name)
+            if instrument is None:
+                instrument = create('pyusps.{name}'.format(name=name))
+                self._instruments[name] = instrument
+        return instrument
+
+    def timing(self, phase, start, seconds):
+        # OpenTelemetry times are in nanoseconds
+        start = int(start * 1e9)
+        span = self._tracer.start_span(
+            'pyusps.{phase}'.format(phase=phase),
+            start_time=start,
+            )
+        span.end(end_time=start + int(seconds * 1e9))
+
+    def observe(self, name, value):
+        if self._meter is not None:
+            self._get(self._meter.create_histogram, name).record(value)
+
+    def increment(self, name, value=1, **labels):
+        if self._meter is not None:
+            counter = self._get(self._meter.create_counter, name)
+            counter.add(value, attributes=labels)
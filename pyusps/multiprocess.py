@@ -0,0 +1,128 @@
+# A bulk engine which spreads verification across processes, for
+# volumes where building and parsing the XML keeps one process busy.
+# The input is split into chunks which are verified by
+# USPSClient.verify_many in a pool of processes, each with its own
+# client and connection pool, and the results are returned in order.
+#
+# Addresses and results cross process boundaries as plain tuples of
+# strings, which pickle much smaller than dicts.
+
+import multiprocessing
+
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pyusps.transport
+from pyusps.address_information import (
+    AddressRecord,
+    USPSClient,
+    _chunk,
+    _to_dict,
+    )
+
+_address_keys = [
+    'address',
+    'city',
+    'state',
+    'zip_code',
+    'address_extended',
+    'firm_name',
+    'urbanization',
+    ]
+
+# The client of a worker process, created by its first chunk
+_client = None
+
+
+def _pack_address(address):
+    return tuple(address.get(key) for key in _address_keys)
+
+def _unpack_address(row):
+    # Keys which were missing stay missing
+    return OrderedDict(
+        (key, value)
+        for (key, value) in zip(_address_keys, row)
+        if value is not None
+        )
+
+def _pack_result(result):
+    if isinstance(result, Exception):
+        return result
+    return tuple(result)
+
+def _unpack_result(result, records):
+    if isinstance(result, Exception):
+        return result
+    record = AddressRecord._make(result)
+    if records:
+        return record
+    return _to_dict(record)
+
+def _verify_chunk(user_id, kwargs, rows, workers):
+    # Runs in a worker process
+    global _client
+    if _client is None:
+        kwargs = dict(kwargs)
+        if kwargs.get('transport') is None:
+            kwargs['transport'] = pyusps.transport.PooledTransport(
+                pool_size=max(workers or 1, 1),
+                )
+        _client = USPSClient(user_id, **kwargs)
+    addresses = [_unpack_address(row) for row in rows]
+    return [
+        _pack_result(result)
+        for result in _client.verify_many(
+            addresses,
+            workers=workers,
+            records=True,
+            )
+        ]
+
+def verify_many(
+    user_id,
+    iterable,
+    processes=None,
+    workers=4,
+    chunk_size=500,
+    records=False,
+    **kwargs
+    ):
+    # Like pyusps.address_information.verify_many, but chunks of
+    # chunk_size addresses are verified in processes processes, which
+    # defaults to the number of CPUs, each with workers threads. Any
+    # other keyword arguments are passed to the USPSClient of each
+    # process and have to be picklable. Each process gets its own copy
+    # of them, e.g., of a rate limiter, a CredentialPool or an
+    # LRUCache, so their limits apply to each process separately. An
+    # SQLiteCache is still shared through its file. Only the address
+    # keys listed under Requests are sent and, as with records, only the
+    # documented response keys are returned.
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be at least 1')
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    executor = ProcessPoolExecutor(max_workers=processes)
+    # Keep every process busy while the oldest chunk is returned
+    max_in_flight = processes * 2
+    submitted = deque()
+    try:
+        for chunk in _chunk(iterable, chunk_size):
+            rows = [_pack_address(address) for address in chunk]
+            submitted.append(executor.submit(
+                    _verify_chunk,
+                    user_id,
+                    kwargs,
+                    rows,
+                    workers,
+                    ))
+            while len(submitted) >= max_in_flight:
+                for result in submitted.popleft().result():
+                    yield _unpack_result(result, records)
+        while submitted:
+            for result in submitted.popleft().result():
+                yield _unpack_result(result, records)
+    finally:
+        # The generator might be closed before it's exhausted
+        for future in submitted:
+            future.cancel()
+        executor.shutdown(wait=False)
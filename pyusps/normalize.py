@@ -0,0 +1,172 @@
+# Local normalization and validation of addresses before they're sent
+# to the USPS. normalize returns a copy of an address with its
+# whitespace collapsed, upper cased, the state as a two letter code,
+# the zip code as xxxxx or xxxxx-xxxx and a common street suffix in
+# its USPS abbreviation. An address which the USPS would certainly
+# reject raises a ValueError with two extra attributes:
+#
+#     field: The key of the address which is wrong
+#     reason: missing or invalid
+#
+# Normalized addresses which only differ in those ways are the same
+# address, so they share a cache key and are only requested once.
+
+import re
+
+from collections import OrderedDict
+
+_fields = [
+    'firm_name',
+    'address',
+    'address_extended',
+    'city',
+    'state',
+    'zip_code',
+    'urbanization',
+    ]
+
+states = frozenset([
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', 'HI',
+    'ID', 'IL', 'IN', 'IA', 'KS', 'KY', 'LA', 'ME', 'MD', 'MA', 'MI', 'MN',
+    'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND', 'OH',
+    'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA',
+    'WV', 'WI', 'WY',
+    # Territories and freely associated states
+    'AS', 'FM', 'GU', 'MH', 'MP', 'PR', 'PW', 'VI',
+    # Military
+    'AA', 'AE', 'AP',
+    ])
+
+state_names = {
+    'ALABAMA': 'AL', 'ALASKA': 'AK', 'ARIZONA': 'AZ', 'ARKANSAS': 'AR',
+    'CALIFORNIA': 'CA', 'COLORADO': 'CO', 'CONNECTICUT': 'CT',
+    'DELAWARE': 'DE', 'DISTRICT OF COLUMBIA': 'DC', 'FLORIDA': 'FL',
+    'GEORGIA': 'GA', 'HAWAII': 'HI', 'IDAHO': 'ID', 'ILLINOIS': 'IL',
+    'INDIANA': 'IN', 'IOWA': 'IA', 'KANSAS': 'KS', 'KENTUCKY': 'KY',
+    'LOUISIANA': 'LA', 'MAINE': 'ME', 'MARYLAND': 'MD',
+    'MASSACHUSETTS': 'MA', 'MICHIGAN': 'MI', 'MINNESOTA': 'MN',
+    'MISSISSIPPI': 'MS', 'MISSOURI': 'MO', 'MONTANA': 'MT',
+    'NEBRASKA': 'NE', 'NEVADA': 'NV', 'NEW HAMPSHIRE': 'NH',
+    'NEW JERSEY': 'NJ', 'NEW MEXICO': 'NM', 'NEW YORK': 'NY',
+    'NORTH CAROLINA': 'NC', 'NORTH DAKOTA': 'ND', 'OHIO': 'OH',
+    'OKLAHOMA': 'OK', 'OREGON': 'OR', 'PENNSYLVANIA': 'PA',
+    'RHODE ISLAND': 'RI', 'SOUTH CAROLINA': 'SC', 'SOUTH DAKOTA': 'SD',
+    'TENNESSEE': 'TN', 'TEXAS': 'TX', 'UTAH': 'UT', 'VERMONT': 'VT',
+    'VIRGINIA': 'VA', 'WASHINGTON': 'WA', 'WEST VIRGINIA': 'WV',
+    'WISCONSIN': 'WI', 'WYOMING': 'WY', 'AMERICAN SAMOA': 'AS',
+    'GUAM': 'GU', 'NORTHERN MARIANA ISLANDS': 'MP', 'PUERTO RICO': 'PR',
+    'VIRGIN ISLANDS': 'VI',
+    }
+
+# Common street suffixes and their USPS abbreviations from Publication
+# 28, Appendix C1
+suffixes = {
+    'ALLEY': 'ALY', 'ANNEX': 'ANX', 'ARCADE': 'ARC', 'AV': 'AVE',
+    'AVEN': 'AVE', 'AVENU': 'AVE', 'AVENUE': 'AVE', 'AVN': 'AVE',
+    'BEACH': 'BCH', 'BEND': 'BND', 'BLUFF': 'BLF', 'BOUL': 'BLVD',
+    'BOULEVARD': 'BLVD', 'BOULV': 'BLVD', 'BRANCH': 'BR', 'BRIDGE': 'BRG',
+    'BROOK': 'BRK', 'BYPASS': 'BYP', 'CAUSEWAY': 'CSWY', 'CENTER': 'CTR',
+    'CENTRE': 'CTR', 'CIRC': 'CIR', 'CIRCL': 'CIR', 'CIRCLE': 'CIR',
+    'CRCL': 'CIR', 'CLIFF': 'CLF', 'COURT': 'CT', 'CRT': 'CT',
+    'COVE': 'CV', 'CREEK': 'CRK', 'CRESCENT': 'CRES', 'CROSSING': 'XING',
+    'DRIV': 'DR', 'DRIVE': 'DR', 'DRV': 'DR', 'EXPRESSWAY': 'EXPY',
+    'EXTENSION': 'EXT', 'FREEWAY': 'FWY', 'GARDENS': 'GDNS',
+    'GROVE': 'GRV', 'HARBOR': 'HBR', 'HEIGHTS': 'HTS', 'HIGHWAY': 'HWY',
+    'HIWAY': 'HWY', 'HILL': 'HL', 'HOLLOW': 'HOLW', 'ISLAND': 'IS',
+    'JUNCTION': 'JCT', 'LAKE': 'LK', 'LANDING': 'LNDG', 'LANE': 'LN',
+    'MANOR': 'MNR', 'MEADOWS': 'MDWS', 'MOUNT': 'MT', 'MOUNTAIN': 'MTN',
+    'PARKWAY': 'PKWY', 'PARKWY': 'PKWY', 'PKY': 'PKWY', 'PLACE': 'PL',
+    'PLAZA': 'PLZ', 'POINT': 'PT', 'RIDGE': 'RDG', 'ROAD': 'RD',
+    'ROUTE': 'RTE', 'SQUARE': 'SQ', 'STR': 'ST', 'STREET': 'ST',
+    'STRT': 'ST', 'TERRACE': 'TER', 'TRAIL': 'TRL', 'TURNPIKE': 'TPKE',
+    'VALLEY': 'VLY', 'VIEW': 'VW', 'VILLAGE': 'VLG', 'VISTA': 'VIS',
+    }
+
+_zip_re = re.compile(r'^(\d{5})(?:[- ]?(\d{4}))?$')
+
+
+def _invalid(field, reason, message):
+    error = ValueError('{field}: {message}'.format(
+            field=field,
+            message=message,
+            ))
+    error.field = field
+    error.reason = reason
+    return error
+
+def _clean(value):
+    if value is None:
+        return None
+    if isinstance(value, int):
+        value = str(value)
+    value = ' '.join(value.split()).upper()
+    return value or None
+
+def parse_zip(zip_code):
+    # Return the five and four digit parts of a zip code. zip4 is None
+    # if there isn't one.
+    match = _zip_re.match(zip_code)
+    if match is None:
+        raise _invalid(
+            'zip_code',
+            'invalid',
+            '{zip_code!r} is not a ZIP or ZIP+4 code'.format(
+                zip_code=zip_code,
+                ),
+            )
+    return match.groups()
+
+def _remove_periods(street):
+    # Periods never change an address, e.g., "ST." is "ST"
+    return ' '.join(street.replace('.', ' ').split()) or None
+
+def _normalize_suffix(street):
+    words = street.split()
+    if len(words) > 1:
+        words[-1] = suffixes.get(words[-1], words[-1])
+    return ' '.join(words)
+
+def normalize(address):
+    res = OrderedDict()
+    for field in _fields:
+        value = _clean(address.get(field))
+        if value is not None:
+            res[field] = value
+    # Keep any keys this module doesn't know about
+    for (field, value) in address.items():
+        if field not in res and field not in _fields:
+            res[field] = value
+
+    for field in ['address', 'address_extended']:
+        if field in res:
+            res[field] = _remove_periods(res[field])
+            if res[field] is None:
+                del res[field]
+    if 'address' in res:
+        res['address'] = _normalize_suffix(res['address'])
+
+    for field in ['address', 'city']:
+        if field not in res:
+            raise _invalid(field, 'missing', 'required')
+    if 'state' not in res and 'zip_code' not in res:
+        raise _invalid('state', 'missing', 'state or zip_code is required')
+
+    state = res.get('state')
+    if state is not None:
+        state = state_names.get(state, state)
+        if state not in states:
+            raise _invalid(
+                'state',
+                'invalid',
+                '{state!r} is not a state'.format(state=address['state']),
+                )
+        res['state'] = state
+
+    zip_code = res.get('zip_code')
+    if zip_code is not None:
+        (zip5, zip4) = parse_zip(zip_code)
+        res['zip_code'] = zip5
+        if zip4 is not None:
+            res['zip_code'] = '{zip5}-{zip4}'.format(zip5=zip5, zip4=zip4)
+
+    return res
@@ -0,0 +1,248 @@
+# Transports which record real traffic to an archive and answer
+# requests from it without a network, e.g., to load test a pipeline
+# offline or to warm a result cache from past requests.
+#
+# An archive is a gzipped file with one JSON object per line, the
+# request and the response of a single address:
+#
+#     {"request": "<Address>...</Address>", "response": "<Address>...</Address>"}
+#
+# Addresses are stored without their IDs and without the user ID of the
+# request, so archives can be shared and an address is replayed in
+# whichever batch it's requested. Each address is recorded once.
+
+import gzip
+import json
+import random
+import socket
+import threading
+import time
+
+from collections import OrderedDict
+from io import BytesIO
+
+from lxml import etree
+
+import pyusps.cache
+import pyusps.transport
+import pyusps.urlutil
+from pyusps.address_information import _find_error, _parse_address
+
+# Request tags and the address keys they come from
+_address_keys = OrderedDict([
+        ('FirmName', 'firm_name'),
+        ('Address1', 'address_extended'),
+        ('Address2', 'address'),
+        ('City', 'city'),
+        ('State', 'state'),
+        ('Urbanization', 'urbanization'),
+        ])
+
+
+def _get_xml(url, body):
+    # The request XML of a GET URL or a POST body
+    if body is None:
+        query = pyusps.urlutil.urlparse(url).query
+    else:
+        query = b''.join(body).decode('utf-8')
+    xml = pyusps.urlutil.parse_qs(query)['XML'][0]
+    return xml.encode('utf-8')
+
+def _without_id(element):
+    element.attrib.pop('ID', None)
+    # tostring escapes anything outside of ASCII
+    return etree.tostring(element).decode('ascii')
+
+def _request_addresses(xml):
+    # The ID and the archive key of each requested address
+    root = etree.fromstring(xml)
+    return [
+        (address.get('ID'), _without_id(address))
+        for address in root.iterchildren('Address')
+        ]
+
+def _response_addresses(data):
+    # Map the ID of each address in a response to the address without
+    # it. General errors aren't about any one address, so nothing is
+    # recorded for them.
+    try:
+        root = etree.fromstring(data)
+    except etree.XMLSyntaxError:
+        return {}
+    if _find_error(root) is not None:
+        return {}
+    return dict(
+        (address.get('ID'), _without_id(address))
+        for address in root.iterchildren('Address')
+        )
+
+def read(path):
+    # Yield the request and response of every address in an archive
+    with gzip.open(path, 'rb') as fp:
+        for line in fp:
+            if line.strip():
+                entry = json.loads(line.decode('utf-8'))
+                yield (entry['request'], entry['response'])
+
+def _to_address(request):
+    # The address a request was serialized from, as far as its cache
+    # key goes
+    root = etree.fromstring(request)
+    address = OrderedDict()
+    for child in root.iterchildren():
+        key = _address_keys.get(child.tag)
+        if key is not None and child.text is not None:
+            address[key] = child.text
+    zip5 = root.findtext('Zip5')
+    zip4 = root.findtext('Zip4')
+    if zip5:
+        address['zip_code'] = zip5
+        if zip4:
+            address['zip_code'] = '{zip5}-{zip4}'.format(zip5=zip5, zip4=zip4)
+    return address
+
+def warm_cache(cache, path):
+    # Store the result of every address in an archive which the USPS
+    # verified in cache. Return the number of results stored.
+    count = 0
+    for (request, response) in read(path):
+        response = etree.fromstring(response)
+        if response.find('Error') is not None:
+            continue
+        key = pyusps.cache.cache_key(_to_address(request))
+        cache.set(key, _parse_address(response))
+        count += 1
+    return count
+
+
+class RecordingTransport(object):
+    # Sends requests with transport, a PooledTransport by default, and
+    # records every address it's answered for to the archive at path,
+    # which is overwritten. Call close to finish the archive. Safe to
+    # share between threads.
+
+    def __init__(self, path, transport=None):
+        if transport is None:
+            transport = pyusps.transport.PooledTransport()
+        self.transport = transport
+        self.path = path
+        self.recorded = 0
+        self._fp = gzip.open(path, 'wb')
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def _record(self, url, body, res):
+        data = res.read()
+        responses = _response_addresses(data)
+        entries = []
+        if responses:
+            for (address_id, request) in _request_addresses(
+                _get_xml(url, body),
+                ):
+                response = responses.get(address_id)
+                if response is not None:
+                    entries.append((request, response))
+
+        with self._lock:
+            for (request, response) in entries:
+                if request in self._seen:
+                    continue
+                self._seen.add(request)
+                line = json.dumps(
+                    OrderedDict([
+                            ('request', request),
+                            ('response', response),
+                            ]),
+                    separators=(',', ':'),
+                    )
+                self._fp.write(line.encode('utf-8') + b'\n')
+                self.recorded += 1
+
+        if not hasattr(res, 'bytes_sent'):
+            return BytesIO(data)
+        # Keep the counts of the response which was read
+        return pyusps.transport.Response(
+            BytesIO(data),
+            bytes_sent=res.bytes_sent,
+            bytes_received=res.bytes_received - len(data),
+            )
+
+    def get(self, url, timeout=None):
+        if timeout is None:
+            res = self.transport.get(url)
+        else:
+            res = self.transport.get(url, timeout=timeout)
+        return self._record(url, None, res)
+
+    def post(self, url, body, timeout=None):
+        if timeout is None:
+            res = self.transport.post(url, body)
+        else:
+            res = self.transport.post(url, body, timeout=timeout)
+        return self._record(url, body, res)
+
+    def close(self):
+        with self._lock:
+            self._fp.close()
+        close = getattr(self.transport, 'close', None)
+        if close is not None:
+            close()
+
+
+class ReplayTransport(object):
+    # Answers requests from the archive at path. Each request waits
+    # latency seconds plus a random jitter of up to jitter seconds. A
+    # request which would wait longer than its timeout raises
+    # socket.timeout once the timeout has passed. A request for an
+    # address which isn't in the archive raises an IOError. Safe to
+    # share between threads.
+
+    def __init__(self, path, latency=0, jitter=0, sleep=time.sleep):
+        self.latency = latency
+        self.jitter = jitter
+        self._sleep = sleep
+        self._responses = {}
+        for (request, response) in read(path):
+            self._responses[request] = response.encode('ascii')
+
+    def __len__(self):
+        return len(self._responses)
+
+    def _wait(self, timeout):
+        delay = self.latency
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        if timeout is not None and delay > timeout:
+            self._sleep(timeout)
+            raise socket.timeout('timed out')
+        if delay:
+            self._sleep(delay)
+
+    def _respond(self, url, body, timeout):
+        self._wait(timeout)
+        parts = [b'<?xml version="1.0"?>\n<AddressValidateResponse>']
+        for (address_id, request) in _request_addresses(_get_xml(url, body)):
+            response = self._responses.get(request)
+            if response is None:
+                raise IOError(
+                    'No recorded response for {request}'.format(
+                        request=request,
+                        )
+                    )
+            start = '<Address ID="{address_id}"'.format(address_id=address_id)
+            parts.append(response.replace(
+                    b'<Address',
+                    start.encode('ascii'),
+                    1,
+                    ))
+        parts.append(b'</AddressValidateResponse>')
+        return BytesIO(b''.join(parts))
+
+    def get(self, url, timeout=None):
+        return self._respond(url, None, timeout)
+
+    def post(self, url, body, timeout=None):
+        return self._respond(url, body, timeout)
+
+    def close(self):
+        pass
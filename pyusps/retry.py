@@ -0,0 +1,175 @@
+# Rate limiting, retry and hedging policies for requests to the USPS.
+# TokenBucket and Retry take clock and sleep functions so that they
+# can be driven by a fake clock.
+
+import math
+import random
+import threading
+import time
+
+from collections import deque
+
+
+class TokenBucket(object):
+    # Allows rate requests per second on average and bursts of up to
+    # burst requests. The rate is adaptive: backoff halves it, down to
+    # min_rate, when the USPS is struggling, and recover raises it back
+    # towards the configured rate a step at a time. Safe to share
+    # between threads.
+
+    def __init__(
+        self,
+        rate,
+        burst=1,
+        min_rate=None,
+        clock=time.time,
+        sleep=time.sleep,
+        ):
+        if rate <= 0:
+            raise ValueError('rate must be greater than 0')
+        if min_rate is None:
+            min_rate = rate / 10.0
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Each copy, e.g., in another process, gets a lock of its own
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self.burst,
+                self._tokens + (now - self._updated) * self.rate,
+                )
+            self._updated = now
+            # Reserve a token even if it isn't there yet, so that
+            # waiting callers are served in order
+            self._tokens -= 1
+            wait = 0
+            if self._tokens < 0:
+                wait = -self._tokens / self.rate
+        if wait > 0:
+            self._sleep(wait)
+
+    def backoff(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2.0)
+
+    def recover(self):
+        with self._lock:
+            self.rate = min(
+                self.max_rate,
+                self.rate + self.max_rate / 20.0,
+                )
+
+
+class Retry(object):
+    # Retries a request up to attempts times in total. Before retry n,
+    # counting from 0, it waits a random time between 0 and
+    # min(max_backoff, backoff * 2 ** n) seconds ("full jitter"), which
+    # spreads out retries from many threads.
+
+    def __init__(
+        self,
+        attempts=3,
+        backoff=0.5,
+        max_backoff=30,
+        sleep=time.sleep,
+        random=random.random,
+        ):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._sleep = sleep
+        self._random = random
+
+    def delay(self, retry):
+        ceiling = min(self.max_backoff, self.backoff * 2 ** retry)
+        return ceiling * self._random()
+
+    def sleep(self, seconds):
+        self._sleep(seconds)
+
+    def wait(self, retry):
+        self.sleep(self.delay(retry))
+
+
+class Hedge(object):
+    # Decides when to send a second copy of a slow request. A request
+    # which hasn't answered after the percentile-th latency of the last
+    # window requests is hedged, but only once min_samples latencies
+    # have been observed. Each request adds max_rate to a budget of at
+    # most burst hedges and each hedge spends one, so no more than
+    # max_rate hedges are sent per request over time. Safe to share
+    # between threads.
+
+    def __init__(
+        self,
+        percentile=95,
+        max_rate=0.05,
+        window=1000,
+        min_samples=20,
+        burst=10,
+        ):
+        if not 0 < percentile <= 100:
+            raise ValueError('percentile must be between 0 and 100')
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.burst = burst
+        self.hedges = 0
+        self._latencies = deque(maxlen=window)
+        self._budget = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def delay(self):
+        # Nearest-rank percentile of the observed latencies
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        rank = int(math.ceil(self.percentile / 100.0 * len(latencies)))
+        return latencies[max(rank, 1) - 1]
+
+    def start(self):
+        # Called for every request. Returns how long to wait before
+        # hedging it or None if it shouldn't be hedged.
+        with self._lock:
+            self._budget = min(self.burst, self._budget + self.max_rate)
+        return self.delay()
+
+    def allow(self):
+        with self._lock:
+            if self._budget < 1:
+                return False
+            self._budget -= 1
+            self.hedges += 1
+            return True
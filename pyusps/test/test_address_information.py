@@ -1,11 +1,38 @@
 import fudge
+import socket
+import threading
+import time
 
 from collections import OrderedDict
+from concurrent.futures import Future
 from nose.tools import eq_ as eq
-from io import StringIO
+from io import BytesIO, StringIO
+from lxml import etree
 
-from pyusps.address_information import verify
-from pyusps.test.util import assert_raises, assert_errors_equal
+from pyusps import address_information
+from pyusps.address_information import (
+    AddressRecord,
+    ResultColumns,
+    USPSClient,
+    _create_xml,
+    _render_xml,
+    verify,
+    verify_many,
+    )
+from pyusps.cache import LRUCache, SingleFlight, cache_key
+from pyusps.credentials import Credential, CredentialPool
+from pyusps.metrics import MemoryMetrics
+from pyusps.normalize import normalize
+from pyusps.retry import Hedge, Retry, TokenBucket
+from pyusps.urlutil import parse_qs, urlparse
+from pyusps.test.util import (
+    FakeClock,
+    assert_raises,
+    assert_errors_equal,
+    compress,
+    echo_response,
+    )
+from pyusps.transport import Response
 
 @fudge.patch('pyusps.urlutil.urlopen')
 def test_verify_simple(fake_urlopen):
@@ -454,7 +481,7 @@ def test_verify_api_empty_error(fake_urlopen):
     eq(str(msg), expected)
 
 @fudge.patch('pyusps.urlutil.urlopen')
-def test_verify_api_order_error(fake_urlopen):
+def test_verify_api_missing_id(fake_urlopen):
     fake_urlopen = fake_urlopen.expects_call()
     req = """https://production.shippingapis.com/ShippingAPI.dll?API=Verify&XML=%3CAddressValidateRequest+USERID%3D%22foo_id%22%3E%3CAddress+ID%3D%220%22%3E%3CAddress1%2F%3E%3CAddress2%3E6406+Ivy+Lane%3C%2FAddress2%3E%3CCity%3EGreenbelt%3C%2FCity%3E%3CState%3EMD%3C%2FState%3E%3CZip5%2F%3E%3CZip4%2F%3E%3C%2FAddress%3E%3CAddress+ID%3D%221%22%3E%3CAddress1%2F%3E%3CAddress2%3E8+Wildwood+Drive%3C%2FAddress2%3E%3CCity%3EOld+Lyme%3C%2FCity%3E%3CState%3ECT%3C%2FState%3E%3CZip5%2F%3E%3CZip4%2F%3E%3C%2FAddress%3E%3C%2FAddressValidateRequest%3E"""
     fake_urlopen = fake_urlopen.with_args(req)
@@ -474,14 +501,1412 @@ def test_verify_api_order_error(fake_urlopen):
                 ('state', 'CT'),
                 ]),
         ]
+    res = verify('foo_id', *addresses)
+
+    eq(len(res), 2)
+    eq(res[0]['address'], '6406 IVY LN')
+    assert_errors_equal(
+        res[1],
+        IndexError('No address was returned for ID 1'),
+        )
+    eq(str(res[1]), 'No address was returned for ID 1')
+
+@fudge.patch('pyusps.urlutil.urlopen')
+def test_verify_many_chunks(fake_urlopen):
+    fake_urlopen = fake_urlopen.expects_call()
+    req = """https://production.shippingapis.com/ShippingAPI.dll?API=Verify&XML=%3CAddressValidateRequest+USERID%3D%22foo_id%22%3E%3CAddress+ID%3D%220%22%3E%3CAddress1%2F%3E%3CAddress2%3E0+Main+St%3C%2FAddress2%3E%3CCity%3EGreenbelt%3C%2FCity%3E%3CState%3EMD%3C%2FState%3E%3CZip5%2F%3E%3CZip4%2F%3E%3C%2FAddress%3E%3CAddress+ID%3D%221%22%3E%3CAddress1%2F%3E%3CAddress2%3E1+Main+St%3C%2FAddress2%3E%3CCity%3EGreenbelt%3C%2FCity%3E%3CState%3EMD%3C%2FState%3E%3CZip5%2F%3E%3CZip4%2F%3E%3C%2FAddress%3E%3CAddress+ID%3D%222%22%3E%3CAddress1%2F%3E%3CAddress2%3E2+Main+St%3C%2FAddress2%3E%3CCity%3EGreenbelt%3C%2FCity%3E%3CState%3EMD%3C%2FState%3E%3CZip5%2F%3E%3CZip4%2F%3E%3C%2FAddress%3E%3CAddress+ID%3D%223%22%3E%3CAddress1%2F%3E%3CAddress2%3E3+Main+St%3C%2FAddress2%3E%3CCity%3EGreenbelt%3C%2FCity%3E%3CState%3EMD%3C%2FState%3E%3CZip5%2F%3E%3CZip4%2F%3E%3C%2FAddress%3E%3CAddress+ID%3D%224%22%3E%3CAddress1%2F%3E%3CAddress2%3E4+Main+St%3C%2FAddress2%3E%3CCity%3EGreenbelt%3C%2FCity%3E%3CState%3EMD%3C%2FState%3E%3CZip5%2F%3E%3CZip4%2F%3E%3C%2FAddress%3E%3C%2FAddressValidateRequest%3E"""
+    fake_urlopen = fake_urlopen.with_args(req)
+    res = StringIO(u"""<?xml version="1.0"?>
+<AddressValidateResponse><Address ID="0"><Address2>0 MAIN ST</Address2><City>GREENBELT</City><State>MD</State><Zip5>20770</Zip5><Zip4>0001</Zip4></Address><Address ID="1"><Address2>1 MAIN ST</Address2><City>GREENBELT</City><State>MD</State><Zip5>20770</Zip5><Zip4>0002</Zip4></Address><Address ID="2"><Error><Number>-2147219401</Number><Description>Address Not Found.</Description></Error></Address><Address ID="3"><Address2>3 MAIN ST</Address2><City>GREENBELT</City><State>MD</State><Zip5>20770</Zip5><Zip4>0004</Zip4></Address><Address ID="4"><Address2>4 MAIN ST</Address2><City>GREENBELT</City><State>MD</State><Zip5>20770</Zip5><Zip4>0005</Zip4></Address></AddressValidateResponse>""")
+    fake_urlopen = fake_urlopen.returns(res)
+    fake_urlopen = fake_urlopen.next_call()
+    req = """https://production.shippingapis.com/ShippingAPI.dll?API=Verify&XML=%3CAddressValidateRequest+USERID%3D%22foo_id%22%3E%3CAddress+ID%3D%220%22%3E%3CAddress1%2F%3E%3CAddress2%3E5+Main+St%3C%2FAddress2%3E%3CCity%3EGreenbelt%3C%2FCity%3E%3CState%3EMD%3C%2FState%3E%3CZip5%2F%3E%3CZip4%2F%3E%3C%2FAddress%3E%3C%2FAddressValidateRequest%3E"""
+    fake_urlopen = fake_urlopen.with_args(req)
+    res = StringIO(u"""<?xml version="1.0"?>
+<AddressValidateResponse><Address ID="0"><Address2>5 MAIN ST</Address2><City>GREENBELT</City><State>MD</State><Zip5>20770</Zip5><Zip4>0006</Zip4></Address></AddressValidateResponse>""")
+    fake_urlopen.returns(res)
+
+    addresses = (
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ])
+        for num in range(6)
+        )
+    res = list(verify_many('foo_id', addresses))
+
+    # eq does not work with exceptions. Process each item manually.
+    eq(len(res), 6)
+    for num in [0, 1, 3, 4, 5]:
+        eq(
+            res[num],
+            OrderedDict([
+                    ('address', '{num} MAIN ST'.format(num=num)),
+                    ('city', 'GREENBELT'),
+                    ('state', 'MD'),
+                    ('zip5', '20770'),
+                    ('zip4', '000{num}'.format(num=num + 1)),
+                    ]),
+            )
+    assert_errors_equal(
+        res[2],
+        ValueError('-2147219401: Address Not Found.'),
+        )
+
+@fudge.patch('pyusps.urlutil.urlopen')
+def test_verify_many_address_error_single(fake_urlopen):
+    fake_urlopen = fake_urlopen.expects_call()
+    req = """https://production.shippingapis.com/ShippingAPI.dll?API=Verify&XML=%3CAddressValidateRequest+USERID%3D%22foo_id%22%3E%3CAddress+ID%3D%220%22%3E%3CAddress1%2F%3E%3CAddress2%3E6406+Ivy+Lane%3C%2FAddress2%3E%3CCity%3EGreenbelt%3C%2FCity%3E%3CState%3ENJ%3C%2FState%3E%3CZip5%2F%3E%3CZip4%2F%3E%3C%2FAddress%3E%3C%2FAddressValidateRequest%3E"""
+    fake_urlopen = fake_urlopen.with_args(req)
+    res = StringIO(u"""<?xml version="1.0"?>
+<AddressValidateResponse><Address ID="0"><Error><Number>-2147219401</Number><Source>API_AddressCleancAddressClean.CleanAddress2;SOLServer.CallAddressDll</Source><Description>Address Not Found.</Description><HelpFile></HelpFile><HelpContext>1000440</HelpContext></Error></Address></AddressValidateResponse>""")
+    fake_urlopen.returns(res)
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'NJ'),
+            ])
+    res = list(verify_many('foo_id', [address]))
+
+    # A single address error is returned in place instead of raised
+    eq(len(res), 1)
+    assert_errors_equal(
+        res[0],
+        ValueError('-2147219401: Address Not Found.'),
+        )
+
+@fudge.patch('pyusps.urlutil.urlopen')
+def test_verify_many_empty(fake_urlopen):
+    res = list(verify_many('foo_id', []))
+
+    eq(res, [])
+
+@fudge.patch('pyusps.urlutil.urlopen')
+def test_verify_many_workers(fake_urlopen):
+    fake_urlopen.expects_call().calls(echo_response)
+
+    addresses = (
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ])
+        for num in range(23)
+        )
+    res = list(
+        verify_many(
+            'foo_id',
+            addresses,
+            workers=4,
+            max_in_flight=3,
+            )
+        )
+
+    expected = [
+        OrderedDict([
+                ('address', '{num} MAIN ST'.format(num=num)),
+                ('city', 'GREENBELT'),
+                ('state', 'MD'),
+                ('zip5', '20770'),
+                ('zip4', '1441'),
+                ])
+        for num in range(23)
+        ]
+    eq(res, expected)
+
+@fudge.patch('pyusps.urlutil.urlopen')
+def test_verify_many_max_in_flight_error(fake_urlopen):
+    msg = assert_raises(
+        ValueError,
+        list,
+        verify_many('foo_id', [], workers=2, max_in_flight=0),
+        )
+
+    eq(str(msg), 'max_in_flight must be at least 1')
+
+def test_verify_many_transport():
+    urls = []
+    def get(url):
+        urls.append(url)
+        return echo_response(url)
+    transport = fudge.Fake('transport').provides('get').calls(get)
+
+    res = list(
+        verify_many(
+            'foo_id',
+            [OrderedDict([
+                        ('address', '6406 Ivy Lane'),
+                        ('city', 'Greenbelt'),
+                        ('state', 'MD'),
+                        ])],
+            transport=transport,
+            api_url='http://localhost/ShippingAPI.dll',
+            )
+        )
+
+    eq(len(urls), 1)
+    assert urls[0].startswith('http://localhost/ShippingAPI.dll?API=Verify&')
+    eq(res[0]['address'], '6406 IVY LANE')
+
+@fudge.patch('pyusps.urlutil.urlopen')
+def test_verify_many_cache(fake_urlopen):
+    fake_urlopen = fake_urlopen.expects_call()
+    req = """https://production.shippingapis.com/ShippingAPI.dll?API=Verify&XML=%3CAddressValidateRequest+USERID%3D%22foo_id%22%3E%3CAddress+ID%3D%220%22%3E%3CAddress1%2F%3E%3CAddress2%3E8+Wildwood+Drive%3C%2FAddress2%3E%3CCity%3EOld+Lyme%3C%2FCity%3E%3CState%3ECT%3C%2FState%3E%3CZip5%2F%3E%3CZip4%2F%3E%3C%2FAddress%3E%3C%2FAddressValidateRequest%3E"""
+    fake_urlopen = fake_urlopen.with_args(req)
+    res = StringIO(u"""<?xml version="1.0"?>
+<AddressValidateResponse><Address ID="0"><Address2>8 WILDWOOD DR</Address2><City>OLD LYME</City><State>CT</State><Zip5>06371</Zip5><Zip4>1844</Zip4></Address></AddressValidateResponse>""")
+    fake_urlopen.returns(res)
+
+    cached = OrderedDict([
+            ('address', '6406 IVY LN'),
+            ('city', 'GREENBELT'),
+            ('state', 'MD'),
+            ('zip5', '20770'),
+            ('zip4', '1441'),
+            ])
+    cache = LRUCache()
+    cache.set(
+        cache_key(OrderedDict([
+                    ('address', '6406 Ivy Lane'),
+                    ('city', 'Greenbelt'),
+                    ('state', 'MD'),
+                    ])),
+        cached,
+        )
+
+    addresses = [
+        OrderedDict([
+                ('address', '6406 ivy lane'),
+                ('city', 'Greenbelt '),
+                ('state', 'MD'),
+                ]),
+        OrderedDict([
+                ('address', '8 Wildwood Drive'),
+                ('city', 'Old Lyme'),
+                ('state', 'CT'),
+                ]),
+        ]
+    res = list(verify_many('foo_id', addresses, cache=cache))
+
+    expected = [
+        cached,
+        OrderedDict([
+                ('address', '8 WILDWOOD DR'),
+                ('city', 'OLD LYME'),
+                ('state', 'CT'),
+                ('zip5', '06371'),
+                ('zip4', '1844'),
+                ]),
+        ]
+    eq(res, expected)
+    eq(cache.hits, 1)
+    eq(cache.misses, 1)
+
+    # The second address is now cached as well
+    res = list(verify_many('foo_id', addresses, cache=cache))
+
+    eq(res, expected)
+    eq(cache.hits, 3)
+
+def test_verify_many_cache_full_requests():
+    urls = []
+    def get(url):
+        urls.append(url)
+        return echo_response(url)
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    addresses = [
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ])
+        for num in range(50)
+        ]
+    # Every fifth address isn't cached
+    cache = LRUCache()
+    for (num, address) in enumerate(addresses):
+        if num % 5:
+            cache.set(cache_key(address), OrderedDict([('num', num)]))
+
+    client = USPSClient('foo_id', transport=transport, cache=cache)
+    res = list(client.verify_many(addresses))
+
+    # The misses fill whole requests
+    eq(len(urls), 2)
+    eq(len(res), 50)
+    eq(res[1], OrderedDict([('num', 1)]))
+    eq(res[45]['address'], '45 MAIN ST')
+    eq(cache.hits, 40)
+
+@fudge.patch('pyusps.urlutil.urlopen')
+def test_verify_many_dedupe(fake_urlopen):
+    urls = []
+    def urlopen(url):
+        urls.append(url)
+        return echo_response(url)
+    fake_urlopen.expects_call().calls(urlopen)
+
+    addresses = [
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num % 3)),
+                ('city', 'Greenbelt' if num % 2 else 'GREENBELT'),
+                ('state', 'MD'),
+                ])
+        for num in range(12)
+        ]
+    res = list(verify_many('foo_id', addresses))
+
+    expected = [
+        OrderedDict([
+                ('address', '{num} MAIN ST'.format(num=num % 3)),
+                ('city', 'GREENBELT'),
+                ('state', 'MD'),
+                ('zip5', '20770'),
+                ('zip4', '1441'),
+                ])
+        for num in range(12)
+        ]
+    eq(res, expected)
+    # Only the three distinct addresses are requested
+    eq(len(urls), 1)
+    # Duplicates don't share the same result object
+    assert res[0] is not res[3]
+
+@fudge.patch('pyusps.urlutil.urlopen')
+def test_verify_many_single_flight(fake_urlopen):
+    fake_urlopen.expects_call().calls(echo_response)
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+    inflight = SingleFlight()
+    future = Future()
+    inflight.add(cache_key(address), future)
+    expected = OrderedDict([
+            ('address', '6406 IVY LN'),
+            ('city', 'GREENBELT'),
+            ('state', 'MD'),
+            ('zip5', '20770'),
+            ('zip4', '1441'),
+            ])
+    timer = threading.Timer(0.05, future.set_result, [expected])
+    timer.start()
+
+    other = OrderedDict([
+            ('address', '8 Wildwood Drive'),
+            ('city', 'Old Lyme'),
+            ('state', 'CT'),
+            ])
+    res = list(
+        verify_many(
+            'foo_id',
+            [address, other],
+            workers=2,
+            inflight=inflight,
+            )
+        )
+    timer.join()
+
+    # The address in flight is not requested again
+    eq(res[0], expected)
+    eq(res[1]['address'], '8 WILDWOOD DRIVE')
+    eq(len(inflight), 0)
+
+class _JoinedFlight(SingleFlight):
+    # Sets joined once count futures have been joined
+
+    def __init__(self, count):
+        SingleFlight.__init__(self)
+        self.count = count
+        self.joined = threading.Event()
+
+    def get(self, key):
+        future = SingleFlight.get(self, key)
+        if future is not None:
+            self.count -= 1
+            if not self.count:
+                self.joined.set()
+        return future
+
+def _main_st(start, stop):
+    return [
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ])
+        for num in range(start, stop)
+        ]
+
+def _run_thread(fn, *args):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(fn(*args)))
+    thread.daemon = True
+    thread.start()
+    return (thread, results)
+
+def test_verify_many_close_keeps_joined_batches():
+    inflight = _JoinedFlight(5)
+    release = threading.Event()
+    urls = []
+    def get(url):
+        urls.append(url)
+        if len(urls) == 1:
+            # Answer once the third request has been queued
+            while len(inflight) < 15:
+                release.wait(0.01)
+        elif len(urls) == 2:
+            release.wait()
+        return echo_response(url)
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    client = USPSClient('foo_id', transport=transport, inflight=inflight)
+
+    results = client.verify_many(_main_st(0, 15), workers=1, max_in_flight=3)
+    eq(next(results)['address'], '0 MAIN ST')
+    # Another caller joins the third request, which is still queued
+    (thread, joined) = _run_thread(
+        lambda: list(client.verify_many(_main_st(10, 15))),
+        )
+    inflight.joined.wait()
+    results.close()
+    release.set()
+    thread.join()
+
+    eq([row['address'] for row in joined[0]], [
+            '{num} MAIN ST'.format(num=num) for num in range(10, 15)
+            ])
+    eq(len(urls), 3)
+
+def test_verify_many_deadline_not_shared():
+    # A request which can be cut short by one caller's deadline isn't
+    # joined by another caller without one
+    urls = []
+    def get(url, timeout=None):
+        urls.append(url)
+        if timeout is not None:
+            time.sleep(timeout)
+            raise socket.timeout('timed out')
+        return echo_response(url)
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    client = USPSClient('foo_id', transport=transport)
+    addresses = _main_st(0, 1)
+
+    (thread, expired) = _run_thread(
+        lambda: list(client.verify_many(addresses, workers=1, deadline=0.2)),
+        )
+    while not urls:
+        time.sleep(0.01)
+    res = list(client.verify_many(addresses, workers=1))
+    thread.join()
+
+    eq(res[0]['address'], '0 MAIN ST')
+    assert_errors_equal(expired[0][0], socket.timeout('timed out'))
+    eq(len(urls), 2)
+
+def _verify_joined(first, second):
+    # Run first and, once it has requested every address, second, which
+    # joins its requests. Return both results.
+    inflight = _JoinedFlight(5)
+    release = threading.Event()
+    urls = []
+    def get(url):
+        urls.append(url)
+        release.wait()
+        return echo_response(url)
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    client = USPSClient('foo_id', transport=transport, inflight=inflight)
+
+    (first_thread, first_res) = _run_thread(first, client)
+    while len(inflight) < 5:
+        release.wait(0.01)
+    (second_thread, second_res) = _run_thread(second, client)
+    inflight.joined.wait()
+    release.set()
+    first_thread.join()
+    second_thread.join()
+
+    eq(len(urls), 1)
+    return (first_res[0], second_res[0])
+
+def test_verify_many_joined_result_types():
+    addresses = _main_st(0, 5)
+    (records, dicts) = _verify_joined(
+        lambda client: list(client.verify_many(addresses, records=True)),
+        lambda client: list(client.verify_many(addresses)),
+        )
+
+    for (num, (record, row)) in enumerate(zip(records, dicts)):
+        assert isinstance(record, AddressRecord)
+        assert isinstance(row, OrderedDict)
+        eq(record.address, '{num} MAIN ST'.format(num=num))
+        eq(row['address'], '{num} MAIN ST'.format(num=num))
+
+    (dicts, columns) = _verify_joined(
+        lambda client: list(client.verify_many(addresses)),
+        lambda client: list(client.verify_columns(addresses)),
+        )
+
+    eq(dicts[0]['address'], '0 MAIN ST')
+    eq(len(columns), 1)
+    eq(columns[0].columns['address'], [
+            '{num} MAIN ST'.format(num=num) for num in range(5)
+            ])
+    eq(columns[0].columns['firm_name'], [None] * 5)
+    eq(len(columns[0]), 5)
+
+def test_result_columns_dicts():
+    columns = ResultColumns()
+    columns.append(OrderedDict([
+                ('address', '6406 IVY LN'),
+                ('zip5', '20770'),
+                ('deliverypoint', '06'),
+                ]))
+
+    eq(columns.columns['address'], ['6406 IVY LN'])
+    eq(columns.columns['zip5'], ['20770'])
+    eq(columns.columns['city'], [None])
+    eq(columns.columns['error'], [None])
+
+def test_verify_many_records():
+    res = StringIO(u"""<?xml version="1.0"?>
+<AddressValidateResponse><Address ID="0"><FirmName>XYZ CORP</FirmName><Address2>6406 IVY LN</Address2><City>GREENBELT</City><State>MD</State><Zip5>20770</Zip5><Zip4>1441</Zip4><DeliveryPoint>06</DeliveryPoint></Address><Address ID="1"><Error><Number>-2147219400</Number><Description>Invalid City.</Description></Error></Address></AddressValidateResponse>""")
+    transport = fudge.Fake('transport').provides('get').returns(res)
+
+    addresses = [
+        OrderedDict([
+                ('firm_name', 'XYZ Corp'),
+                ('address', '6406 Ivy Lane'),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ]),
+        OrderedDict([
+                ('address', '8 Wildwood Drive'),
+                ('city', 'Old Lyme'),
+                ('state', 'NJ'),
+                ]),
+        ]
+    res = list(
+        verify_many(
+            'foo_id',
+            addresses,
+            transport=transport,
+            records=True,
+            )
+        )
+
+    eq(len(res), 2)
+    # Tags which aren't fields of the record are dropped
+    eq(
+        res[0],
+        AddressRecord(
+            firm_name='XYZ CORP',
+            address_extended=None,
+            address='6406 IVY LN',
+            city='GREENBELT',
+            state='MD',
+            urbanization=None,
+            zip5='20770',
+            zip4='1441',
+            returntext=None,
+            ),
+        )
+    assert_errors_equal(
+        res[1],
+        ValueError('-2147219400: Invalid City.'),
+        )
+
+def test_verify_many_unknown_tags():
+    res = StringIO(u"""<?xml version="1.0"?>
+<AddressValidateResponse><Address ID="0"><Address2>6406 IVY LN</Address2><City>GREENBELT</City><State>MD</State><Zip5>20770</Zip5><Zip4>1441</Zip4><DeliveryPoint>06</DeliveryPoint><ReturnText>Default address</ReturnText></Address></AddressValidateResponse>""")
+    transport = fudge.Fake('transport').provides('get').returns(res)
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+    res = list(verify_many('foo_id', [address], transport=transport))
+
+    expected = OrderedDict([
+            ('address', '6406 IVY LN'),
+            ('city', 'GREENBELT'),
+            ('state', 'MD'),
+            ('zip5', '20770'),
+            ('zip4', '1441'),
+            ('deliverypoint', '06'),
+            ('returntext', 'Default address'),
+            ])
+    eq(res, [expected])
+
+def test_serializers_identical():
+    addresses = [
+        OrderedDict([
+                ('firm_name', 'Smith & Sons <"LLC">'),
+                ('address', u'6406 Ivy Lane \xe9\U0001F600'),
+                ('address_extended', 'Apt\r\n2\t'),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ('zip_code', '20770-1441'),
+                ]),
+        OrderedDict([
+                ('address', '8 Wildwood Drive'),
+                ('city', ''),
+                ('urbanization', 'Urb ]]>'),
+                ('zip_code', '06371'),
+                ]),
+        OrderedDict([
+                ('address', None),
+                ('city', b'Old Lyme'),
+                ('state', ''),
+                ('zip_code', ''),
+                ]),
+        ]
+    user_ids = ['foo_id', 'foo&"<id>"\n\t']
+
+    for user_id in user_ids:
+        eq(
+            _render_xml(user_id, *addresses),
+            etree.tostring(_create_xml(user_id, *addresses)),
+            )
+        eq(
+            _render_xml(user_id),
+            etree.tostring(_create_xml(user_id)),
+            )
+
+def test_serializers_invalid_text():
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane\x00'),
+            ('city', 'Greenbelt'),
+            ])
+    expected = assert_raises(ValueError, _create_xml, 'foo_id', address)
+
+    msg = assert_raises(ValueError, _render_xml, 'foo_id', address)
+
+    eq(str(msg), str(expected))
+
+@fudge.patch('pyusps.urlutil.urlopen')
+def test_verify_etree_serializer(fake_urlopen):
+    fake_urlopen = fake_urlopen.expects_call()
+    req = """https://production.shippingapis.com/ShippingAPI.dll?API=Verify&XML=%3CAddressValidateRequest+USERID%3D%22foo_id%22%3E%3CAddress+ID%3D%220%22%3E%3CAddress1%2F%3E%3CAddress2%3E6406+Ivy+Lane%3C%2FAddress2%3E%3CCity%3EGreenbelt%3C%2FCity%3E%3CState%3EMD%3C%2FState%3E%3CZip5%3E20770%3C%2FZip5%3E%3CZip4%3E%3C%2FZip4%3E%3C%2FAddress%3E%3C%2FAddressValidateRequest%3E"""
+    fake_urlopen = fake_urlopen.with_args(req)
+    res = StringIO(u"""<?xml version="1.0"?>
+<AddressValidateResponse><Address ID="0"><Address2>6406 IVY LN</Address2><City>GREENBELT</City><State>MD</State><Zip5>20770</Zip5><Zip4>1441</Zip4></Address></AddressValidateResponse>""")
+    fake_urlopen.returns(res)
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ('zip_code', '20770'),
+            ])
+    address_information.serializer = 'etree'
+    try:
+        res = verify('foo_id', address)
+    finally:
+        address_information.serializer = 'template'
+
+    eq(res['zip4'], '1441')
+
+def test_client_verify():
+    urls = []
+    responses = []
+    transport = fudge.Fake('transport').provides('get').calls(echo_response)
+    client = USPSClient(
+        'foo_id',
+        api_url='http://localhost/ShippingAPI.dll',
+        transport=transport,
+        cache=LRUCache(),
+        hooks=dict(
+            request=[urls.append],
+            response=[lambda url, res: responses.append(res)],
+            ),
+        )
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+    res = client.verify(address)
+    cached = client.verify(address)
+
+    expected = OrderedDict([
+            ('address', '6406 IVY LANE'),
+            ('city', 'GREENBELT'),
+            ('state', 'MD'),
+            ('zip5', '20770'),
+            ('zip4', '1441'),
+            ])
+    eq(res, expected)
+    eq(cached, expected)
+    # The second call is answered by the cache
+    eq(len(urls), 1)
+    eq(len(responses), 1)
+    assert urls[0].startswith('http://localhost/ShippingAPI.dll?')
+
+def test_client_verify_cached_error():
+    res = StringIO(u"""<?xml version="1.0"?>
+<AddressValidateResponse><Address ID="0"><Error><Number>-2147219401</Number><Description>Address Not Found.</Description></Error></Address></AddressValidateResponse>""")
+    transport = fudge.Fake('transport').provides('get').returns(res)
+    client = USPSClient('foo_id', transport=transport, cache=LRUCache())
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'NJ'),
+            ])
+    msg = assert_raises(ValueError, client.verify, address)
+
+    eq(str(msg), '-2147219401: Address Not Found.')
+
+def test_client_verify_many():
+    transport = fudge.Fake('transport').provides('get').calls(echo_response)
+    client = USPSClient('foo_id', transport=transport)
+
+    addresses = [
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ])
+        for num in range(7)
+        ]
+    res = list(client.verify_many(addresses, workers=2, records=True))
+
+    eq([record.address for record in res], [
+            '{num} MAIN ST'.format(num=num) for num in range(7)
+            ])
+
+def test_client_retry_transient_error():
+    clock = FakeClock()
+    transport = fudge.Fake('transport')
+    transport = transport.expects('get').raises(IOError('timed out'))
+    transport = transport.next_call().raises(IOError('timed out'))
+    transport.next_call().calls(echo_response)
+    client = USPSClient(
+        'foo_id',
+        transport=transport,
+        retry=Retry(attempts=3, sleep=clock.sleep, random=lambda: 1),
+        rate_limiter=TokenBucket(
+            100,
+            clock=clock,
+            sleep=clock.sleep,
+            ),
+        )
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+    res = client.verify(address)
+
+    eq(res['address'], '6406 IVY LANE')
+    # The backoffs refill the rate limiter, which halves its rate after
+    # each failure and raises it again after the success
+    eq(clock.sleeps, [0.5, 1])
+    eq(client.rate_limiter.rate, 30)
+
+def test_client_retry_exhausted():
+    clock = FakeClock()
+    transport = fudge.Fake('transport')
+    transport = transport.expects('get').raises(IOError('timed out'))
+    transport.next_call().raises(IOError('timed out'))
+    client = USPSClient(
+        'foo_id',
+        transport=transport,
+        retry=Retry(attempts=2, sleep=clock.sleep),
+        )
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+    msg = assert_raises(IOError, client.verify, address)
+
+    eq(str(msg), 'timed out')
+
+def test_client_retry_general_error():
+    clock = FakeClock()
+    transport = fudge.Fake('transport')
+    transport = transport.expects('get').returns(StringIO(u"""<Error>
+        <Number>80040b19</Number>
+        <Description>XML Syntax Error</Description>
+</Error>"""))
+    transport.next_call().calls(echo_response)
+    client = USPSClient(
+        'foo_id',
+        transport=transport,
+        retry=Retry(sleep=clock.sleep),
+        )
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+    res = list(client.verify_many([address]))
+
+    eq(res[0]['address'], '6406 IVY LANE')
+    eq(len(clock.sleeps), 1)
+
+def test_client_retry_permanent_error():
+    clock = FakeClock()
+    transport = fudge.Fake('transport')
+    transport.expects('get').returns(StringIO(u"""<Error>
+        <Number>80040b1a</Number>
+        <Description>Authorization failure.  Perhaps username and/or password is incorrect.</Description>
+        <Source>UspsCom::DoAuth</Source>
+</Error>"""))
+    client = USPSClient(
+        'foo_id',
+        transport=transport,
+        retry=Retry(sleep=clock.sleep),
+        )
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+    msg = assert_raises(ValueError, client.verify, address)
+
+    assert str(msg).startswith('80040b1a: Authorization failure.')
+    eq(clock.sleeps, [])
+
+def test_verify_many_isolates_general_error():
+    urls = []
+    def get(url):
+        urls.append(url)
+        # The whole request fails if any address is bad
+        if 'Bad' in url:
+            return StringIO(u"""<Error>
+        <Number>80040b19</Number>
+        <Description>XML Syntax Error</Description>
+</Error>""")
+        return echo_response(url)
+    transport = fudge.Fake('transport').provides('get').calls(get)
+
+    addresses = [
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ])
+        for num in range(5)
+        ]
+    addresses[3]['address'] = 'Bad'
+    # A malformed address fails before it's sent
+    del addresses[1]['city']
+    res = list(verify_many('foo_id', addresses, transport=transport))
+
+    eq(len(res), 5)
+    for num in [0, 2, 4]:
+        eq(res[num]['address'], '{num} MAIN ST'.format(num=num))
+    assert isinstance(res[1], KeyError)
+    assert_errors_equal(
+        res[3],
+        ValueError('80040b19: XML Syntax Error'),
+        )
+    eq(res[3].number, '80040b19')
+    eq(res[3].description, 'XML Syntax Error')
+    # [0, 1, 2, 3, 4], [0, 1] and [1] fail to build. [0], [2, 3, 4],
+    # [2], [3, 4], [3] and [4] are sent.
+    eq(len(urls), 6)
+
+def test_verify_many_isolates_without_retries():
+    urls = []
+    def get(url):
+        urls.append(url)
+        if 'Bad' in url:
+            return StringIO(u"""<Error>
+        <Number>80040b19</Number>
+        <Description>XML Syntax Error</Description>
+</Error>""")
+        return echo_response(url)
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    clock = FakeClock()
+    client = USPSClient(
+        'foo_id',
+        transport=transport,
+        retry=Retry(attempts=3, sleep=clock.sleep),
+        )
+
+    addresses = _main_st(0, 5)
+    addresses[2]['address'] = 'Bad'
+    res = list(client.verify_many(addresses))
+
+    eq(res[2].number, '80040b19')
+    eq(res[4]['address'], '4 MAIN ST')
+    # Only the whole request is retried. Then [0, 1], [2, 3, 4], [2]
+    # and [3, 4] are sent once each.
+    eq(len(urls), 7)
+    eq(len(clock.sleeps), 2)
+
+def test_verify_many_permanent_error():
+    res = StringIO(u"""<Error>
+        <Number>80040b1a</Number>
+        <Description>Authorization failure.  Perhaps username and/or password is incorrect.</Description>
+        <Source>UspsCom::DoAuth</Source>
+</Error>""")
+    transport = fudge.Fake('transport').expects('get').returns(res)
+
+    addresses = [
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ])
+        for num in range(5)
+        ]
     msg = assert_raises(
-        IndexError,
-        verify,
+        ValueError,
+        list,
+        verify_many('foo_id', addresses, transport=transport),
+        )
+
+    assert str(msg).startswith('80040b1a: Authorization failure.')
+
+def test_client_timeout():
+    timeouts = []
+    def get(url, timeout=None):
+        timeouts.append(timeout)
+        return echo_response(url)
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    client = USPSClient('foo_id', transport=transport, timeout=5)
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+    res = client.verify(address)
+
+    eq(res['address'], '6406 IVY LANE')
+    eq(timeouts, [5])
+
+def test_verify_many_deadline():
+    clock = FakeClock()
+    timeouts = []
+    def get(url, timeout=None):
+        timeouts.append(timeout)
+        if len(timeouts) == 1:
+            clock.now += 1.5
+            return echo_response(url)
+        # The second request runs until the deadline
+        clock.now += timeout
+        raise socket.timeout('timed out')
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    client = USPSClient('foo_id', transport=transport, clock=clock)
+
+    addresses = [
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ])
+        for num in range(12)
+        ]
+    res = list(client.verify_many(addresses, deadline=2.5))
+
+    eq(timeouts, [2.5, 1.0])
+    eq(len(res), 12)
+    eq([row['address'] for row in res[:5]], [
+            '{num} MAIN ST'.format(num=num) for num in range(5)
+            ])
+    for error in res[5:10]:
+        assert_errors_equal(error, socket.timeout('timed out'))
+    for error in res[10:]:
+        assert_errors_equal(error, socket.timeout('Deadline exceeded'))
+
+def test_client_post():
+    requests = []
+    def post(url, body):
+        requests.append((url, body))
+        data = b''.join(body).decode('utf-8')
+        return echo_response('{url}?{data}'.format(url=url, data=data))
+    transport = fudge.Fake('transport').provides('post').calls(post)
+    metrics = MemoryMetrics()
+    client = USPSClient(
         'foo_id',
-        *addresses
+        transport=transport,
+        metrics=metrics,
+        method='POST',
         )
 
-    expected = ('The addresses returned are not in the same order '
-                'they were requested'
-                )
-    eq(str(msg), expected)
+    # Everything which means something in a form has to be escaped
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane & 100% A+B=C'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+    res = client.verify(address)
+
+    eq(res['address'], '6406 IVY LANE & 100% A+B=C')
+    (url, body) = requests[0]
+    eq(url, 'https://production.shippingapis.com/ShippingAPI.dll')
+    params = parse_qs(b''.join(body).decode('utf-8'))
+    eq(params['API'], ['Verify'])
+    eq(params['XML'], [_render_xml('foo_id', address).decode('utf-8')])
+    eq(metrics.values['bytes_sent'], [len(b''.join(body))])
+
+def test_client_post_api_url():
+    requests = []
+    def post(url, body, timeout=None):
+        requests.append((url, timeout))
+        data = b''.join(body).decode('utf-8')
+        return echo_response('{url}?{data}'.format(url=url, data=data))
+    transport = fudge.Fake('transport').provides('post').calls(post)
+    client = USPSClient(
+        'foo_id',
+        api_url='http://localhost/ShippingAPI.dll',
+        transport=transport,
+        timeout=5,
+        method='POST',
+        )
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+    client.verify(address)
+
+    eq(requests, [('http://localhost/ShippingAPI.dll', 5)])
+
+def test_client_unknown_method():
+    msg = assert_raises(
+        ValueError,
+        USPSClient,
+        'foo_id',
+        method='PUT',
+        )
+
+    eq(str(msg), "Unknown method 'PUT'")
+
+def test_client_compressed_response():
+    bodies = []
+    def get(url):
+        body = echo_response(url).read()
+        bodies.append(body)
+        return Response(
+            BytesIO(compress(body, 'gzip')),
+            encoding='gzip',
+            bytes_sent=500,
+            bytes_received=100,
+            )
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    metrics = MemoryMetrics()
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+
+    res = USPSClient('foo_id', transport=transport).verify(address)
+    eq(res['address'], '6406 IVY LANE')
+
+    client = USPSClient('foo_id', transport=transport, metrics=metrics)
+    res = client.verify(address)
+    eq(res['address'], '6406 IVY LANE')
+
+    eq(metrics.values['bytes_sent'], [500])
+    eq(metrics.values['bytes_received'], [
+            100 + len(compress(bodies[1], 'gzip')),
+            ])
+    eq(metrics.values['bytes_decompressed'], [len(bodies[1])])
+
+def test_client_hedge():
+    slow = threading.Event()
+    calls = []
+    def get(url):
+        calls.append(url)
+        # The first request doesn't answer until the test is done
+        if len(calls) == 1:
+            slow.wait()
+        return echo_response(url)
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    hedge = Hedge(min_samples=1, max_rate=1)
+    hedge.observe(0.01)
+    client = USPSClient('foo_id', transport=transport, hedge=hedge)
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+    try:
+        res = client.verify(address)
+    finally:
+        slow.set()
+
+    eq(res['address'], '6406 IVY LANE')
+    eq(len(calls), 2)
+    eq(calls[0], calls[1])
+    eq(hedge.hedges, 1)
+
+class _CountingLimiter(object):
+
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+    def backoff(self):
+        pass
+
+    def recover(self):
+        pass
+
+def test_client_hedge_credential_rate_limiter():
+    slow = threading.Event()
+    calls = []
+    def get(url):
+        calls.append(url)
+        if len(calls) == 1:
+            slow.wait()
+        return echo_response(url)
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    hedge = Hedge(min_samples=1, max_rate=1)
+    hedge.observe(0.01)
+    limiter = _CountingLimiter()
+    client_limiter = _CountingLimiter()
+    pool = CredentialPool([Credential('foo_id', rate_limiter=limiter)])
+    client = USPSClient(
+        pool,
+        transport=transport,
+        hedge=hedge,
+        rate_limiter=client_limiter,
+        )
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+    try:
+        client.verify(address)
+    finally:
+        slow.set()
+
+    # The hedged copy waits on the credential's limiter too
+    eq(len(calls), 2)
+    eq(limiter.acquired, 2)
+    eq(client_limiter.acquired, 0)
+
+def test_client_hedge_error():
+    hedged = threading.Event()
+    calls = []
+    def get(url):
+        calls.append(url)
+        # The first request fails after the hedge is sent
+        if len(calls) == 1:
+            hedged.wait()
+            raise IOError('connection reset')
+        hedged.set()
+        return echo_response(url)
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    hedge = Hedge(min_samples=1, max_rate=1)
+    hedge.observe(0)
+    client = USPSClient('foo_id', transport=transport, hedge=hedge)
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+    res = client.verify(address)
+
+    # The hedge answers even though the first request failed
+    eq(res['address'], '6406 IVY LANE')
+
+def test_client_metrics():
+    clock = FakeClock()
+    urls = []
+    transport = fudge.Fake('transport')
+    transport = transport.expects('get').raises(IOError('timed out'))
+    transport.next_call().calls(echo_response)
+    metrics = MemoryMetrics()
+    client = USPSClient(
+        'foo_id',
+        transport=transport,
+        cache=LRUCache(),
+        retry=Retry(sleep=clock.sleep),
+        metrics=metrics,
+        hooks=dict(request=[urls.append]),
+        )
+
+    addresses = [
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ])
+        for num in range(2)
+        ]
+    res = list(client.verify_many(addresses))
+
+    eq(len(res), 2)
+    eq(sorted(metrics.timings), ['build', 'parse', 'process', 'send'])
+    eq(metrics.values['batch_size'], [2])
+    eq(metrics.values['bytes_sent'], [len(urls[1])])
+    eq(len(metrics.values['bytes_received']), 1)
+    eq(dict(metrics.counts), {
+            ('cache_hits',): 0,
+            ('cache_misses',): 2,
+            ('retries', 'transport'): 1,
+            })
+
+@fudge.patch('pyusps.urlutil.urlopen')
+def test_client_metrics_errors(fake_urlopen):
+    fake_urlopen = fake_urlopen.expects_call()
+    res = StringIO(u"""<?xml version="1.0"?>
+<AddressValidateResponse><Address ID="0"><Error><Number>-2147219401</Number><Description>Address Not Found.</Description></Error></Address></AddressValidateResponse>""")
+    fake_urlopen.returns(res)
+    metrics = MemoryMetrics()
+    client = USPSClient('foo_id', metrics=metrics)
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'NJ'),
+            ])
+    assert_raises(ValueError, client.verify, address)
+
+    eq(metrics.counts[('errors', '-2147219401')], 1)
+    eq(metrics.values['bytes_received'], [len(res.getvalue())])
+
+def test_client_normalizer():
+    urls = []
+    transport = fudge.Fake('transport').provides('get').calls(echo_response)
+    client = USPSClient(
+        'foo_id',
+        transport=transport,
+        normalizer=normalize,
+        hooks=dict(request=[urls.append]),
+        )
+
+    addresses = [
+        OrderedDict([
+                ('address', '6406 Ivy Lane'),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ]),
+        OrderedDict([
+                ('address', '6406 Ivy Ln.'),
+                ('city', 'Greenbelt'),
+                ('state', 'md'),
+                ]),
+        OrderedDict([
+                ('address', '6406 Ivy Lane'),
+                ('city', 'Greenbelt'),
+                ('zip_code', '2077'),
+                ]),
+        ]
+    res = list(client.verify_many(addresses))
+
+    eq(res[0]['address'], '6406 IVY LN')
+    eq(res[1], res[0])
+    eq(str(res[2]), "zip_code: '2077' is not a ZIP or ZIP+4 code")
+    # Both spellings are the same address and the invalid zip code is
+    # never sent
+    eq(len(urls), 1)
+    eq(urls[0].count('IVY+LN'), 1)
+
+def test_client_normalizer_verify():
+    transport = fudge.Fake('transport')
+    client = USPSClient('foo_id', transport=transport, normalizer=normalize)
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'XX'),
+            ])
+    msg = assert_raises(ValueError, client.verify, address)
+
+    eq(msg.field, 'state')
+
+_auth_error = u"""<?xml version="1.0"?>
+<Error><Number>80040B1A</Number><Description>Authorization failure.  Perhaps username and/or password is incorrect.</Description></Error>"""
+
+def test_client_credential_pool():
+    clock = FakeClock()
+    user_ids = []
+    def get(url):
+        xml = parse_qs(urlparse(url).query)['XML'][0]
+        user_id = etree.fromstring(xml).get('USERID')
+        user_ids.append(user_id)
+        if user_id == 'bad_id':
+            return StringIO(_auth_error)
+        return echo_response(url)
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    pool = CredentialPool([
+            Credential(
+                'foo_id',
+                rate_limiter=TokenBucket(1, clock=clock, sleep=clock.sleep),
+                ),
+            'bad_id',
+            'bar_id',
+            ])
+    client = USPSClient(pool, transport=transport)
+
+    addresses = [
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ])
+        for num in range(20)
+        ]
+    res = list(client.verify_many(addresses))
+
+    eq(len(res), 20)
+    eq(res[19]['address'], '19 MAIN ST')
+    # The failed request is sent again with the next credential and the
+    # bad one is never used again
+    eq(user_ids, ['foo_id', 'bad_id', 'bar_id', 'foo_id', 'bar_id'])
+    eq([credential.user_id for credential in pool.credentials], [
+            'foo_id',
+            'bar_id',
+            ])
+    # Only foo_id's requests wait on its rate limiter
+    eq(clock.sleeps, [1])
+
+def test_client_credential_pool_exhausted():
+    transport = fudge.Fake('transport').provides('get').calls(
+        lambda url: StringIO(_auth_error),
+        )
+    pool = CredentialPool(['foo_id', 'bar_id'])
+    client = USPSClient(pool, transport=transport)
+
+    address = OrderedDict([
+            ('address', '6406 Ivy Lane'),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+    msg = assert_raises(ValueError, client.verify, address)
+
+    eq(msg.number, '80040B1A')
+    eq(len(pool), 0)
+
+    msg = assert_raises(ValueError, client.verify, address)
+
+    eq(msg.number, '80040B1A')
+
+def test_client_credential_pool_row_errors():
+    # General errors caused by an address aren't failures of the
+    # credential which sent it
+    def get(url):
+        if 'Bad' in url:
+            return StringIO(u"""<Error>
+        <Number>80040b19</Number>
+        <Description>XML Syntax Error</Description>
+</Error>""")
+        return echo_response(url)
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    clock = FakeClock()
+    pool = CredentialPool(['foo_id', 'bar_id'], clock=clock)
+    client = USPSClient(
+        pool,
+        transport=transport,
+        retry=Retry(attempts=3, sleep=clock.sleep),
+        )
+
+    addresses = _main_st(0, 5)
+    addresses[2]['address'] = 'Bad'
+    res = list(client.verify_many(addresses))
+
+    eq(res[2].number, '80040b19')
+    eq([credential.failures for credential in pool.credentials], [0, 0])
+
+def test_verify_out_of_order():
+    res = StringIO(u"""<?xml version="1.0"?>
+<AddressValidateResponse><Address ID="2"><Address2>2 MAIN ST</Address2></Address><Address ID="0"><Address2>0 MAIN ST</Address2></Address><Address ID="1"><Error><Number>-2147219401</Number><Description>Address Not Found.</Description></Error></Address></AddressValidateResponse>""")
+    transport = fudge.Fake('transport').provides('get').returns(res)
+    client = USPSClient('foo_id', transport=transport)
+
+    addresses = [
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ])
+        for num in range(3)
+        ]
+    res = list(client.verify_many(addresses))
+
+    eq(res[0]['address'], '0 MAIN ST')
+    eq(str(res[1]), '-2147219401: Address Not Found.')
+    eq(res[2]['address'], '2 MAIN ST')
+
+def test_verify_duplicate_id():
+    res = StringIO(u"""<?xml version="1.0"?>
+<AddressValidateResponse><Address ID="0"><Address2>0 MAIN ST</Address2></Address><Address ID="0"><Address2>1 MAIN ST</Address2></Address></AddressValidateResponse>""")
+    transport = fudge.Fake('transport').provides('get').returns(res)
+    client = USPSClient('foo_id', transport=transport)
+
+    addresses = [
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ])
+        for num in range(2)
+        ]
+    res = list(client.verify_many(addresses, records=True))
+
+    eq(str(res[0]), 'More than one address was returned for ID 0')
+    eq(str(res[1]), 'No address was returned for ID 1')
+
+def test_verify_columns():
+    def get(url):
+        # The USPS can't find addresses in Nowhere
+        res = etree.parse(echo_response(url)).getroot()
+        for address in res.findall('Address'):
+            if address.findtext('City') == 'NOWHERE':
+                for child in list(address):
+                    address.remove(child)
+                error = etree.SubElement(address, 'Error')
+                etree.SubElement(error, 'Number').text = '-2147219401'
+                etree.SubElement(error, 'Description').text = (
+                    'Address Not Found.'
+                    )
+        return StringIO(etree.tostring(res).decode('utf-8'))
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    client = USPSClient('foo_id', transport=transport)
+
+    addresses = [
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ])
+        for num in range(5)
+        ]
+    addresses[3]['city'] = 'Nowhere'
+    res = list(client.verify_columns(addresses, size=3, workers=2))
+
+    eq([len(columns) for columns in res], [3, 2])
+    eq(list(res[0].columns), list(ResultColumns.names))
+    eq(res[0].columns['address'], ['0 MAIN ST', '1 MAIN ST', '2 MAIN ST'])
+    eq(res[1].columns['address'], [None, '4 MAIN ST'])
+    eq(res[1].columns['zip5'], [None, '20770'])
+    eq(res[1].columns['firm_name'], [None, None])
+    eq(res[1].columns['error_number'], ['-2147219401', None])
+    eq(res[1].columns['error'], ['-2147219401: Address Not Found.', None])
+
+def test_verify_columns_empty():
+    transport = fudge.Fake('transport')
+    client = USPSClient('foo_id', transport=transport)
+
+    res = list(client.verify_columns([]))
+
+    # Without a size there's always exactly one
+    eq(len(res), 1)
+    eq(len(res[0]), 0)
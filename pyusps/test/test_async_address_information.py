@@ -0,0 +1,165 @@
+import asyncio
+import socket
+
+from collections import OrderedDict
+from nose.tools import eq_ as eq
+
+from pyusps.async_address_information import verify, verify_many
+from pyusps.test.util import (
+    assert_raises,
+    assert_errors_equal,
+    echo_response,
+    )
+
+def _run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+class FakeServer(object):
+    # In-process stand-in for the Verify API which echoes the
+    # requested addresses back
+
+    def __init__(self, status='200 OK', body=None, stall=False):
+        self.status = status
+        self.body = body
+        self.stall = stall
+        self.requests = 0
+
+    async def handle(self, reader, writer):
+        line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        self.requests += 1
+        if self.stall:
+            # Never answer, until the client hangs up
+            await reader.read()
+            writer.close()
+            return
+        path = line.decode('latin-1').split()[1]
+        body = self.body
+        if body is None:
+            body = echo_response('http://localhost' + path).read()
+        writer.write(
+            'HTTP/1.1 {status}\r\nContent-Length: {length}\r\n\r\n'.format(
+                status=self.status,
+                length=len(body),
+                ).encode('latin-1')
+            )
+        writer.write(body)
+        await writer.drain()
+        writer.close()
+
+    async def run(self, coro_func):
+        server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        api_url = 'http://127.0.0.1:{port}/ShippingAPI.dll'.format(port=port)
+        try:
+            return await coro_func(api_url)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+def _address(num):
+    return OrderedDict([
+            ('address', '{num} Main St'.format(num=num)),
+            ('city', 'Greenbelt'),
+            ('state', 'MD'),
+            ])
+
+def _expected(num):
+    return OrderedDict([
+            ('address', '{num} MAIN ST'.format(num=num)),
+            ('city', 'GREENBELT'),
+            ('state', 'MD'),
+            ('zip5', '20770'),
+            ('zip4', '1441'),
+            ])
+
+def test_verify_simple():
+    server = FakeServer()
+
+    async def run(api_url):
+        return await verify('foo_id', _address(1), api_url=api_url)
+    res = _run(server.run(run))
+
+    eq(res, _expected(1))
+    eq(server.requests, 1)
+
+def test_verify_address_error():
+    body = b"""<?xml version="1.0"?>
+<AddressValidateResponse><Address ID="0"><Error><Number>-2147219401</Number><Description>Address Not Found.</Description></Error></Address></AddressValidateResponse>"""
+    server = FakeServer(body=body)
+
+    async def run(api_url):
+        return await verify('foo_id', _address(1), api_url=api_url)
+    msg = assert_raises(ValueError, _run, server.run(run))
+
+    eq(str(msg), '-2147219401: Address Not Found.')
+
+def test_verify_http_error():
+    server = FakeServer(status='503 Service Unavailable', body=b'')
+
+    async def run(api_url):
+        return await verify('foo_id', _address(1), api_url=api_url)
+    msg = assert_raises(IOError, _run, server.run(run))
+
+    eq(str(msg), 'HTTP Error 503: Service Unavailable')
+
+def test_verify_timeout():
+    server = FakeServer(stall=True)
+
+    async def run(api_url):
+        return await verify(
+            'foo_id',
+            _address(1),
+            api_url=api_url,
+            timeout=0.1,
+            )
+    msg = assert_raises(socket.timeout, _run, server.run(run))
+
+    assert_errors_equal(msg, socket.timeout('timed out'))
+    eq(server.requests, 1)
+
+def test_verify_many():
+    server = FakeServer()
+
+    async def run(api_url):
+        addresses = (_address(num) for num in range(52))
+        return [
+            result
+            async for result in verify_many(
+                'foo_id',
+                addresses,
+                concurrency=4,
+                api_url=api_url,
+                )
+            ]
+    res = _run(server.run(run))
+
+    eq(res, [_expected(num) for num in range(52)])
+    eq(server.requests, 11)
+
+def test_verify_many_address_error_single():
+    body = b"""<?xml version="1.0"?>
+<AddressValidateResponse><Address ID="0"><Error><Number>-2147219401</Number><Description>Address Not Found.</Description></Error></Address></AddressValidateResponse>"""
+    server = FakeServer(body=body)
+
+    async def run(api_url):
+        return [
+            result
+            async for result in verify_many(
+                'foo_id',
+                [_address(1)],
+                api_url=api_url,
+                )
+            ]
+    res = _run(server.run(run))
+
+    eq(len(res), 1)
+    assert_errors_equal(
+        res[0],
+        ValueError('-2147219401: Address Not Found.'),
+        )
@@ -0,0 +1,161 @@
+import os
+import shutil
+import tempfile
+import threading
+
+from collections import OrderedDict
+from nose.tools import eq_ as eq
+
+from pyusps.cache import LRUCache, SQLiteCache, cache_key
+from pyusps.test.util import FakeClock
+
+def test_cache_key_normalized():
+    key_1 = cache_key(OrderedDict([
+                ('address', ' 6406  Ivy Lane'),
+                ('city', 'greenbelt '),
+                ('state', 'md'),
+                ('zip_code', '20770-1441'),
+                ]))
+    key_2 = cache_key(OrderedDict([
+                ('address', '6406 IVY LANE'),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ('zip_code', '207701441'),
+                ]))
+
+    eq(key_1, key_2)
+
+def test_cache_key_fields():
+    key_1 = cache_key(OrderedDict([
+                ('address', '6406 Ivy Lane'),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ]))
+    key_2 = cache_key(OrderedDict([
+                ('address', '6406 Ivy Lane'),
+                ('address_extended', 'Apt 2'),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ]))
+
+    assert key_1 != key_2
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', OrderedDict([('zip5', '1')]))
+    cache.set('b', OrderedDict([('zip5', '2')]))
+    cache.get('a')
+    cache.set('c', OrderedDict([('zip5', '3')]))
+
+    eq(len(cache), 2)
+    eq(cache.get('b'), None)
+    eq(cache.get('a'), OrderedDict([('zip5', '1')]))
+    eq(cache.get('c'), OrderedDict([('zip5', '3')]))
+    eq(cache.hits, 3)
+    eq(cache.misses, 1)
+
+def test_lru_cache_ttl():
+    clock = FakeClock()
+    cache = LRUCache(ttl=10, clock=clock)
+    cache.set('a', OrderedDict([('zip5', '1')]))
+    clock.now = 9
+
+    eq(cache.get('a'), OrderedDict([('zip5', '1')]))
+
+    clock.now = 10
+
+    eq(cache.get('a'), None)
+    eq(len(cache), 0)
+    eq(cache.hits, 1)
+    eq(cache.misses, 1)
+
+def test_lru_cache_returns_copy():
+    cache = LRUCache()
+    cache.set('a', OrderedDict([('zip5', '1')]))
+    cache.get('a')['zip5'] = '2'
+
+    eq(cache.get('a'), OrderedDict([('zip5', '1')]))
+
+def _sqlite_cache(**kwargs):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'cache.db')
+    return (SQLiteCache(path, **kwargs), directory)
+
+def test_sqlite_cache_get_set():
+    (cache, directory) = _sqlite_cache()
+    try:
+        value = OrderedDict([
+                ('address', '6406 IVY LN'),
+                ('city', 'GREENBELT'),
+                ('state', 'MD'),
+                ('zip5', '20770'),
+                ('zip4', '1441'),
+                ('returntext', None),
+                ])
+        key = cache_key(OrderedDict([
+                    ('address', '6406 Ivy Lane'),
+                    ('city', 'Greenbelt'),
+                    ('state', 'MD'),
+                    ]))
+
+        eq(cache.get(key), None)
+
+        cache.set(key, value)
+        res = cache.get(key)
+
+        eq(res, value)
+        eq(list(res.keys()), list(value.keys()))
+        eq(cache.hits, 1)
+        eq(cache.misses, 1)
+    finally:
+        cache.close()
+        shutil.rmtree(directory)
+
+def test_sqlite_cache_shared():
+    (cache, directory) = _sqlite_cache()
+    other = SQLiteCache(cache.path)
+    try:
+        cache.set(('a',), OrderedDict([('zip5', '1')]))
+
+        eq(other.get(('a',)), OrderedDict([('zip5', '1')]))
+    finally:
+        cache.close()
+        other.close()
+        shutil.rmtree(directory)
+
+def test_sqlite_cache_threads():
+    (cache, directory) = _sqlite_cache()
+    try:
+        cache.set(('a',), OrderedDict([('zip5', '1')]))
+        res = []
+        thread = threading.Thread(target=lambda: res.append(cache.get(('a',))))
+        thread.start()
+        thread.join()
+
+        eq(res, [OrderedDict([('zip5', '1')])])
+    finally:
+        cache.close()
+        shutil.rmtree(directory)
+
+def test_sqlite_cache_ttl():
+    clock = FakeClock()
+    (cache, directory) = _sqlite_cache(ttl=10, clock=clock)
+    try:
+        cache.set(('a',), OrderedDict([('zip5', '1')]))
+        cache.set(('b',), OrderedDict([('zip5', '2')]))
+        clock.now = 5
+        cache.set(('b',), OrderedDict([('zip5', '2')]))
+        clock.now = 10
+
+        eq(cache.get(('a',)), None)
+        eq(cache.get(('b',)), OrderedDict([('zip5', '2')]))
+
+        cache.purge()
+        count = cache._connect().execute(
+            'SELECT COUNT(*) FROM results',
+            ).fetchone()[0]
+
+        eq(count, 1)
+    finally:
+        cache.close()
+        shutil.rmtree(directory)
@@ -0,0 +1,214 @@
+import fudge
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_ as eq
+
+from pyusps import cli
+from pyusps.test.util import echo_response
+
+_error = b"""<?xml version="1.0"?>
+<Error><Number>80040B19</Number><Description>XML Syntax Error: Please check the XML request to see if it can be parsed.</Description></Error>"""
+
+def _write(path, text):
+    with io.open(path, 'w', encoding='utf-8') as fp:
+        fp.write(text)
+
+def _read(path):
+    with io.open(path, encoding='utf-8') as fp:
+        return fp.read()
+
+def _get(url, timeout=None):
+    # The USPS can't parse addresses in Nowhere
+    from io import BytesIO
+    if 'Nowhere' in url:
+        return BytesIO(_error)
+    return echo_response(url)
+
+def _fake_transport(get=_get):
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    return transport.provides('close')
+
+class TestCLI(object):
+
+    def setup(self):
+        self.tmp = tempfile.mkdtemp()
+        self.input = os.path.join(self.tmp, 'in.csv')
+        self.output = os.path.join(self.tmp, 'out.csv')
+        self.stderr = io.StringIO()
+
+    def teardown(self):
+        shutil.rmtree(self.tmp)
+
+    @fudge.patch('pyusps.transport.PooledTransport')
+    def test_csv(self, fake_pooled):
+        fake_pooled.expects_call().returns(_fake_transport())
+        _write(self.input, u'id,street,city,state\n'
+               u'1,6406 Ivy Lane,Greenbelt,MD\n'
+               u'2,1 Main St,Nowhere,MD\n'
+               u'3,2 Main St,Greenbelt,MD\n')
+
+        code = cli.main([
+                self.input,
+                self.output,
+                '--user-id', 'foo_id',
+                '--map', 'address=street',
+                '--attempts', '1',
+                ],
+            self.stderr,
+            )
+
+        eq(code, 0)
+        eq(_read(self.output).splitlines(), [
+                'id,street,city,state,usps_firm_name,usps_address_extended,'
+                'usps_address,usps_city,usps_state,usps_urbanization,'
+                'usps_zip5,usps_zip4,usps_returntext',
+                '1,6406 Ivy Lane,Greenbelt,MD,,,6406 IVY LANE,GREENBELT,MD,,'
+                '20770,1441,',
+                '3,2 Main St,Greenbelt,MD,,,2 MAIN ST,GREENBELT,MD,,20770,'
+                '1441,',
+                ])
+        errors = [
+            json.loads(line)
+            for line in _read(self.output + '.errors.jsonl').splitlines()
+            ]
+        eq(len(errors), 1)
+        eq(errors[0]['line'], 2)
+        eq(errors[0]['row']['id'], '2')
+        eq(errors[0]['number'], '80040B19')
+        assert not os.path.exists(self.output + '.checkpoint')
+        eq(self.stderr.getvalue(), '2 verified, 1 errors\n')
+
+    @fudge.patch('pyusps.transport.PooledTransport')
+    def test_jsonl(self, fake_pooled):
+        fake_pooled.expects_call().returns(_fake_transport())
+        self.input = os.path.join(self.tmp, 'in.jsonl')
+        _write(self.input, u'{"address": "6406 Ivy Lane", '
+               u'"city": "Greenbelt", "state": "MD"}\n')
+        self.output = os.path.join(self.tmp, 'out.jsonl')
+
+        code = cli.main(
+            [self.input, self.output, '--user-id', 'foo_id'],
+            self.stderr,
+            )
+
+        eq(code, 0)
+        row = json.loads(_read(self.output))
+        eq(row['address'], '6406 Ivy Lane')
+        eq(row['usps_address'], '6406 IVY LANE')
+        eq(row['usps_zip5'], '20770')
+
+    @fudge.patch('pyusps.transport.PooledTransport')
+    def test_jsonl_numbers(self, fake_pooled):
+        fake_pooled.expects_call().returns(_fake_transport())
+        self.input = os.path.join(self.tmp, 'in.jsonl')
+        _write(self.input, u'{"address": "6406 Ivy Lane", '
+               u'"city": "Greenbelt", "state": "MD", "zip_code": 20770}\n')
+        self.output = os.path.join(self.tmp, 'out.jsonl')
+
+        code = cli.main(
+            [self.input, self.output, '--user-id', 'foo_id'],
+            self.stderr,
+            )
+
+        eq(code, 0)
+        row = json.loads(_read(self.output))
+        eq(row['zip_code'], 20770)
+        eq(row['usps_zip5'], '20770')
+
+    @fudge.patch('pyusps.transport.PooledTransport')
+    def test_resume(self, fake_pooled):
+        calls = []
+        def get(url, timeout=None):
+            calls.append(url)
+            # The third request fails until the transport is replaced
+            if len(calls) == 3:
+                raise IOError('connection refused')
+            return _get(url)
+        fake_pooled = fake_pooled.expects_call()
+        fake_pooled = fake_pooled.returns(_fake_transport(get))
+        fake_pooled.next_call().returns(_fake_transport())
+        lines = [u'address,city,state']
+        lines.extend(
+            u'{num} Main St,Greenbelt,MD'.format(num=num)
+            for num in range(14)
+            )
+        _write(self.input, u'\n'.join(lines) + u'\n')
+        argv = [
+            self.input,
+            self.output,
+            '--user-id', 'foo_id',
+            '--workers', '0',
+            '--attempts', '1',
+            '--checkpoint-every', '4',
+            ]
+
+        code = cli.main(argv, self.stderr)
+
+        eq(code, 1)
+        eq(self.stderr.getvalue(), 'pyusps: connection refused\n')
+        checkpoint = json.loads(_read(self.output + '.checkpoint'))
+        eq(checkpoint['rows'], 8)
+        # Rows 9 and 10 were written after the checkpoint
+        eq(len(_read(self.output).splitlines()), 11)
+
+        code = cli.main(argv + ['--resume'], self.stderr)
+
+        eq(code, 0)
+        rows = _read(self.output).splitlines()
+        eq(len(rows), 15)
+        eq([row.split(',')[0] for row in rows[1:]], [
+                '{num} Main St'.format(num=num) for num in range(14)
+                ])
+
+    @fudge.patch('pyusps.transport.PooledTransport')
+    def test_normalize(self, fake_pooled):
+        fake_pooled.expects_call().returns(_fake_transport())
+        _write(self.input, u'address,city,state\n'
+               u'6406 Ivy Lane,Greenbelt,Maryland\n'
+               u'6406 Ivy Lane,Greenbelt,XX\n')
+
+        code = cli.main([
+                self.input,
+                self.output,
+                '--user-id', 'foo_id',
+                '--normalize',
+                ],
+            self.stderr,
+            )
+
+        eq(code, 0)
+        rows = _read(self.output).splitlines()
+        eq(len(rows), 2)
+        assert rows[1].startswith('6406 Ivy Lane,Greenbelt,Maryland,,,')
+        errors = _read(self.output + '.errors.jsonl').splitlines()
+        error = json.loads(errors[0])
+        eq(error['line'], 2)
+        eq(error['field'], 'state')
+        eq(error['reason'], 'invalid')
+
+    @fudge.patch('pyusps.transport.PooledTransport')
+    def test_post(self, fake_pooled):
+        def post(url, body, timeout=None):
+            data = b''.join(body).decode('utf-8')
+            return echo_response('{url}?{data}'.format(url=url, data=data))
+        transport = fudge.Fake('transport').provides('post').calls(post)
+        fake_pooled.expects_call().returns(transport.provides('close'))
+        _write(self.input, u'address,city,state\n'
+               u'6406 Ivy Lane,Greenbelt,MD\n')
+
+        code = cli.main([
+                self.input,
+                self.output,
+                '--user-id', 'foo_id',
+                '--method', 'POST',
+                ],
+            self.stderr,
+            )
+
+        eq(code, 0)
+        rows = _read(self.output).splitlines()
+        assert rows[1].startswith('6406 Ivy Lane,Greenbelt,MD,,,6406 IVY LANE')
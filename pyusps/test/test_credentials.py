@@ -0,0 +1,59 @@
+from nose.tools import eq_ as eq
+
+from pyusps.credentials import Credential, CredentialPool
+from pyusps.test.util import FakeClock, assert_raises
+
+def test_pool_round_robin():
+    pool = CredentialPool(['foo_id', 'bar_id', 'baz_id'])
+    user_ids = [pool.acquire().user_id for _ in range(4)]
+
+    eq(user_ids, ['foo_id', 'bar_id', 'baz_id', 'foo_id'])
+    eq(pool.credentials[0].requests, 2)
+
+def test_pool_cooldown():
+    clock = FakeClock()
+    foo = Credential('foo_id')
+    bar = Credential('bar_id')
+    pool = CredentialPool(
+        [foo, bar],
+        max_failures=2,
+        cooldown=10,
+        clock=clock,
+        )
+    pool.failure(foo)
+    pool.failure(foo)
+
+    # foo rests after two failures in a row
+    eq([pool.acquire() for _ in range(3)], [bar, bar, bar])
+
+    pool.failure(bar)
+    pool.failure(bar)
+    clock.now = 5
+
+    # When everything rests, what rests the least is used
+    eq(pool.acquire(), foo)
+
+    clock.now = 10
+    pool.success(bar)
+
+    eq([pool.acquire() for _ in range(2)], [bar, foo])
+
+def test_pool_remove():
+    pool = CredentialPool(['foo_id', 'bar_id'])
+    foo = pool.acquire()
+    error = ValueError('80040B1A: Authorization failure.')
+    pool.remove(foo, error)
+
+    eq(len(pool), 1)
+    eq(foo.error, error)
+    eq([pool.acquire().user_id for _ in range(2)], ['bar_id', 'bar_id'])
+
+    pool.remove(pool.acquire(), error)
+
+    eq(pool.acquire(), None)
+    eq(pool.error, error)
+
+def test_pool_empty():
+    msg = assert_raises(ValueError, CredentialPool, [])
+
+    eq(str(msg), 'At least one credential is required')
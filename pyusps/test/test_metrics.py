@@ -0,0 +1,84 @@
+import fudge
+
+from nose import SkipTest
+from nose.tools import eq_ as eq
+
+from pyusps.metrics import (
+    MemoryMetrics,
+    OpenTelemetryMetrics,
+    PrometheusMetrics,
+    )
+
+def _import_prometheus():
+    try:
+        import prometheus_client
+    except ImportError:
+        raise SkipTest('prometheus_client is not installed')
+    return prometheus_client
+
+def test_memory_metrics():
+    metrics = MemoryMetrics()
+    metrics.timing('send', 100, 0.25)
+    metrics.timing('send', 101, 0.5)
+    metrics.observe('batch_size', 5)
+    metrics.increment('cache_hits', 3)
+    metrics.increment('errors', number='80040B1A')
+    metrics.increment('errors', number='80040B1A')
+
+    eq(metrics.timings['send'], [0.25, 0.5])
+    eq(metrics.values['batch_size'], [5])
+    eq(metrics.counts[('cache_hits',)], 3)
+    eq(metrics.counts[('errors', '80040B1A')], 2)
+
+@fudge.test
+def test_opentelemetry_metrics():
+    span = fudge.Fake('span').expects('end').with_args(
+        end_time=1500000000,
+        )
+    tracer = fudge.Fake('tracer').expects('start_span').with_args(
+        'pyusps.send',
+        start_time=1000000000,
+        ).returns(span)
+    counter = fudge.Fake('counter').expects('add').with_args(
+        1,
+        attributes={'reason': 'transport'},
+        )
+    meter = fudge.Fake('meter').expects('create_counter').with_args(
+        'pyusps.retries',
+        ).returns(counter)
+    metrics = OpenTelemetryMetrics(tracer, meter)
+
+    metrics.timing('send', 1, 0.5)
+    metrics.increment('retries', reason='transport')
+
+def test_prometheus_metrics():
+    prometheus_client = _import_prometheus()
+    registry = prometheus_client.CollectorRegistry()
+    metrics = PrometheusMetrics(registry)
+    metrics.timing('send', 100, 0.25)
+    metrics.observe('bytes_sent', 1000)
+    metrics.observe('batch_size', 5)
+    metrics.increment('errors', number='80040B1A')
+
+    def value(name, **labels):
+        return registry.get_sample_value(name, labels)
+
+    eq(value('pyusps_phase_seconds_count', phase='send'), 1)
+    # Sizes aren't bucketed as seconds
+    eq(value('pyusps_bytes_sent_bucket', le='512.0'), 0)
+    eq(value('pyusps_bytes_sent_bucket', le='1024.0'), 1)
+    eq(value('pyusps_batch_size_bucket', le='4.0'), 0)
+    eq(value('pyusps_batch_size_bucket', le='5.0'), 1)
+    eq(value('pyusps_errors_total', number='80040B1A'), 1)
+
+def test_prometheus_metrics_shared_registry():
+    prometheus_client = _import_prometheus()
+    registry = prometheus_client.CollectorRegistry()
+    metrics_1 = PrometheusMetrics(registry)
+    metrics_2 = PrometheusMetrics(registry)
+    metrics_1.increment('hedges')
+    metrics_2.increment('hedges')
+    metrics_2.observe('bytes_received', 300)
+
+    eq(registry.get_sample_value('pyusps_hedges_total'), 2)
+    eq(registry.get_sample_value('pyusps_bytes_received_count'), 1)
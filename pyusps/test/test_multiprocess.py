@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+
+from collections import OrderedDict
+from nose.tools import eq_ as eq
+
+from pyusps import multiprocess
+from pyusps.address_information import AddressRecord
+from pyusps.cache import (
+    LRUCache,
+    SingleFlight,
+    SQLiteCache,
+    cache_key,
+    )
+from pyusps.credentials import Credential, CredentialPool
+from pyusps.retry import Hedge, TokenBucket
+from pyusps.test.util import start_echo_server
+
+def _start_server():
+    (server, url) = start_echo_server()
+    return (server, url + '/ShippingAPI.dll')
+
+def _addresses(count):
+    return [
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ])
+        for num in range(count)
+        ]
+
+def test_verify_many_processes():
+    (server, url) = _start_server()
+    try:
+        res = list(multiprocess.verify_many(
+                'foo_id',
+                _addresses(23),
+                processes=2,
+                workers=2,
+                chunk_size=4,
+                api_url=url,
+                ))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    eq(len(res), 23)
+    eq(res[0], OrderedDict([
+                ('address', '0 MAIN ST'),
+                ('city', 'GREENBELT'),
+                ('state', 'MD'),
+                ('zip5', '20770'),
+                ('zip4', '1441'),
+                ]))
+    eq([row['address'] for row in res], [
+            '{num} MAIN ST'.format(num=num) for num in range(23)
+            ])
+
+def test_verify_many_processes_records():
+    (server, url) = _start_server()
+    addresses = _addresses(3)
+    # Missing keys are returned as errors in place
+    del addresses[1]['city']
+    try:
+        res = list(multiprocess.verify_many(
+                'foo_id',
+                addresses,
+                processes=1,
+                records=True,
+                api_url=url,
+                ))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert isinstance(res[0], AddressRecord)
+    eq(res[0].address, '0 MAIN ST')
+    assert isinstance(res[1], KeyError)
+    eq(res[2].address, '2 MAIN ST')
+
+def test_verify_many_processes_shared_objects():
+    # Objects with locks are copied to each process
+    (server, url) = _start_server()
+    tmp = tempfile.mkdtemp()
+    cache = SQLiteCache(os.path.join(tmp, 'cache.sqlite'))
+    pool = CredentialPool([
+            Credential('foo_id', rate_limiter=TokenBucket(1000, burst=10)),
+            'bar_id',
+            ])
+    try:
+        for kwargs in [
+            dict(
+                rate_limiter=TokenBucket(1000, burst=10),
+                cache=LRUCache(),
+                inflight=SingleFlight(),
+                hedge=Hedge(),
+                ),
+            dict(cache=cache),
+            ]:
+            res = list(multiprocess.verify_many(
+                    pool,
+                    _addresses(3),
+                    processes=1,
+                    api_url=url,
+                    **kwargs
+                    ))
+            eq([row['address'] for row in res], [
+                    '{num} MAIN ST'.format(num=num) for num in range(3)
+                    ])
+        # The process stored its results in the file
+        eq(cache.get(cache_key(_addresses(1)[0]))['address'], '0 MAIN ST')
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tmp)
@@ -0,0 +1,85 @@
+from collections import OrderedDict
+from nose.tools import eq_ as eq
+
+from pyusps.normalize import normalize, parse_zip
+from pyusps.test.util import assert_raises
+
+def test_normalize():
+    address = OrderedDict([
+            ('address', '  6406  Ivy Lane. '),
+            ('address_extended', 'Apt. 4'),
+            ('city', 'greenbelt'),
+            ('state', 'Maryland'),
+            ('zip_code', '207701441'),
+            ('id', 7),
+            ])
+    res = normalize(address)
+
+    eq(res, OrderedDict([
+                ('address', '6406 IVY LN'),
+                ('address_extended', 'APT 4'),
+                ('city', 'GREENBELT'),
+                ('state', 'MD'),
+                ('zip_code', '20770-1441'),
+                ('id', 7),
+                ]))
+    # The address isn't changed
+    eq(address['city'], 'greenbelt')
+
+def test_normalize_empty_fields():
+    res = normalize(OrderedDict([
+                ('address', 'Lane'),
+                ('address_extended', ' '),
+                ('city', 'Greenbelt'),
+                ('zip_code', '20770'),
+                ]))
+
+    # A street which is only a suffix is left alone
+    eq(res, OrderedDict([
+                ('address', 'LANE'),
+                ('city', 'GREENBELT'),
+                ('zip_code', '20770'),
+                ]))
+
+def test_normalize_missing():
+    msg = assert_raises(
+        ValueError,
+        normalize,
+        dict(address='6406 Ivy Lane', city=' ', state='MD'),
+        )
+
+    eq(str(msg), 'city: required')
+    eq(msg.field, 'city')
+    eq(msg.reason, 'missing')
+
+    msg = assert_raises(
+        ValueError,
+        normalize,
+        dict(address='6406 Ivy Lane', city='Greenbelt'),
+        )
+
+    eq(msg.field, 'state')
+    eq(msg.reason, 'missing')
+
+def test_normalize_invalid_state():
+    msg = assert_raises(
+        ValueError,
+        normalize,
+        dict(address='6406 Ivy Lane', city='Greenbelt', state='Mary Land'),
+        )
+
+    eq(str(msg), "state: 'Mary Land' is not a state")
+    eq(msg.field, 'state')
+    eq(msg.reason, 'invalid')
+
+def test_parse_zip():
+    eq(parse_zip('20770'), ('20770', None))
+    eq(parse_zip('20770-1441'), ('20770', '1441'))
+    eq(parse_zip('20770 1441'), ('20770', '1441'))
+    eq(parse_zip('207701441'), ('20770', '1441'))
+
+    msg = assert_raises(ValueError, parse_zip, '2077-01441')
+
+    eq(str(msg), "zip_code: '2077-01441' is not a ZIP or ZIP+4 code")
+    eq(msg.field, 'zip_code')
+    eq(msg.reason, 'invalid')
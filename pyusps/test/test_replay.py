@@ -0,0 +1,156 @@
+import fudge
+import gzip
+import os
+import shutil
+import socket
+import tempfile
+
+from collections import OrderedDict
+from io import BytesIO
+from nose.tools import eq_ as eq
+
+from pyusps.address_information import USPSClient
+from pyusps.cache import LRUCache
+from pyusps.replay import (
+    RecordingTransport,
+    ReplayTransport,
+    read,
+    warm_cache,
+    )
+from pyusps.test.util import FakeClock, assert_raises, echo_response
+
+_error = b"""<?xml version="1.0"?>
+<Error><Number>80040B19</Number><Description>XML Syntax Error: Please check the XML request to see if it can be parsed.</Description></Error>"""
+
+def _addresses(count):
+    return [
+        OrderedDict([
+                ('address', '{num} Main St'.format(num=num)),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ('zip_code', '20770-1441'),
+                ])
+        for num in range(count)
+        ]
+
+def _echo_transport():
+    def get(url):
+        return echo_response(url)
+    def post(url, body):
+        data = b''.join(body).decode('utf-8')
+        return echo_response('{url}?{data}'.format(url=url, data=data))
+    transport = fudge.Fake('transport').provides('get').calls(get)
+    return transport.provides('post').calls(post)
+
+
+class TestReplay(object):
+
+    def setup(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'traffic.jsonl.gz')
+
+    def teardown(self):
+        shutil.rmtree(self.tmp)
+
+    def _record(self, addresses, **kwargs):
+        recorder = RecordingTransport(self.path, _echo_transport())
+        client = USPSClient('foo_id', transport=recorder, **kwargs)
+        try:
+            return list(client.verify_many(addresses))
+        finally:
+            recorder.close()
+
+    def test_replay(self):
+        addresses = _addresses(7)
+        recorded = self._record(addresses)
+
+        # The batches don't have to be the same
+        client = USPSClient('bar_id', transport=ReplayTransport(self.path))
+        replayed = [client.verify(address) for address in addresses]
+
+        eq(replayed, recorded)
+        eq(replayed[6]['address'], '6 MAIN ST')
+
+    def test_archive(self):
+        addresses = _addresses(3)
+        self._record(addresses + addresses[:1])
+
+        entries = list(read(self.path))
+        eq(len(entries), 3)
+        eq(entries[0], (
+                '<Address><Address1/><Address2>0 Main St</Address2>'
+                '<City>Greenbelt</City><State>MD</State><Zip5>20770</Zip5>'
+                '<Zip4>1441</Zip4></Address>',
+                '<Address><Address2>0 MAIN ST</Address2>'
+                '<City>GREENBELT</City><State>MD</State><Zip5>20770</Zip5>'
+                '<Zip4>1441</Zip4></Address>',
+                ))
+        with gzip.open(self.path, 'rb') as fp:
+            assert b'foo_id' not in fp.read()
+
+    def test_post(self):
+        addresses = _addresses(2)
+        recorded = self._record(addresses, method='POST')
+
+        client = USPSClient(
+            'foo_id',
+            transport=ReplayTransport(self.path),
+            method='POST',
+            )
+
+        eq(list(client.verify_many(addresses)), recorded)
+
+    def test_general_error_not_recorded(self):
+        def get(url):
+            return BytesIO(_error)
+        transport = fudge.Fake('transport').provides('get').calls(get)
+        recorder = RecordingTransport(self.path, transport)
+        client = USPSClient('foo_id', transport=recorder)
+        try:
+            res = list(client.verify_many(_addresses(2)))
+        finally:
+            recorder.close()
+
+        eq(len(res), 2)
+        eq(res[0].number, '80040B19')
+        eq(recorder.recorded, 0)
+        eq(list(read(self.path)), [])
+
+    def test_missing(self):
+        self._record(_addresses(1))
+        client = USPSClient('foo_id', transport=ReplayTransport(self.path))
+
+        address = OrderedDict([
+                ('address', '6406 Ivy Lane'),
+                ('city', 'Greenbelt'),
+                ('state', 'MD'),
+                ])
+        msg = assert_raises(IOError, client.verify, address)
+
+        assert str(msg).startswith('No recorded response for <Address>')
+
+    def test_latency(self):
+        self._record(_addresses(1))
+        clock = FakeClock()
+        transport = ReplayTransport(self.path, latency=0.2, sleep=clock.sleep)
+        client = USPSClient('foo_id', transport=transport)
+
+        client.verify(_addresses(1)[0])
+        eq(clock.sleeps, [0.2])
+
+        client = USPSClient('foo_id', transport=transport, timeout=0.1)
+        assert_raises(socket.timeout, client.verify, _addresses(1)[0])
+        eq(clock.sleeps, [0.2, 0.1])
+
+    def test_warm_cache(self):
+        addresses = _addresses(3)
+        recorded = self._record(addresses)
+        cache = LRUCache()
+
+        eq(warm_cache(cache, self.path), 3)
+
+        # Nothing is requested
+        transport = fudge.Fake('transport')
+        client = USPSClient('foo_id', transport=transport, cache=cache)
+        eq(list(client.verify_many(addresses)), recorded)
+        eq(cache.hits, 3)
@@ -0,0 +1,98 @@
+from nose.tools import eq_ as eq
+
+from pyusps.retry import Hedge, Retry, TokenBucket
+from pyusps.test.util import FakeClock, assert_raises
+
+def test_token_bucket_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(2, clock=clock, sleep=clock.sleep)
+    for _ in range(5):
+        bucket.acquire()
+
+    # The first request uses the initial token
+    eq(clock.sleeps, [0.5, 0.5, 0.5, 0.5])
+    eq(clock.now, 2)
+
+def test_token_bucket_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(1, burst=3, clock=clock, sleep=clock.sleep)
+    for _ in range(3):
+        bucket.acquire()
+
+    eq(clock.sleeps, [])
+
+    clock.now = 10
+    for _ in range(4):
+        bucket.acquire()
+
+    # Idle time only refills up to burst tokens
+    eq(clock.sleeps, [1])
+
+def test_token_bucket_adaptive():
+    clock = FakeClock()
+    bucket = TokenBucket(10, min_rate=2, clock=clock, sleep=clock.sleep)
+    bucket.backoff()
+
+    eq(bucket.rate, 5)
+
+    bucket.backoff()
+    bucket.backoff()
+
+    eq(bucket.rate, 2)
+
+    for _ in range(20):
+        bucket.recover()
+
+    eq(bucket.rate, 10)
+
+def test_token_bucket_invalid_rate():
+    msg = assert_raises(ValueError, TokenBucket, 0)
+
+    eq(str(msg), 'rate must be greater than 0')
+
+def test_retry_delay():
+    clock = FakeClock()
+    retry = Retry(
+        backoff=1,
+        max_backoff=5,
+        sleep=clock.sleep,
+        random=lambda: 0.5,
+        )
+    for attempt in range(4):
+        retry.wait(attempt)
+
+    eq(clock.sleeps, [0.5, 1, 2, 2.5])
+
+def test_hedge_delay():
+    hedge = Hedge(percentile=90, min_samples=5)
+
+    eq(hedge.start(), None)
+
+    for latency in [5, 1, 4, 2, 3, 10, 6, 8, 7, 9]:
+        hedge.observe(latency)
+
+    eq(hedge.start(), 9)
+
+def test_hedge_window():
+    hedge = Hedge(percentile=50, window=3, min_samples=1)
+    for latency in [100, 1, 2, 3]:
+        hedge.observe(latency)
+
+    # Only the last window latencies count
+    eq(hedge.delay(), 2)
+
+def test_hedge_budget():
+    hedge = Hedge(max_rate=0.25, burst=2)
+    allowed = []
+    for _ in range(12):
+        hedge.start()
+        allowed.append(hedge.allow())
+
+    eq(allowed.count(True), 3)
+    eq(hedge.hedges, 3)
+
+    for _ in range(100):
+        hedge.start()
+
+    # The budget stops growing at burst hedges
+    eq([hedge.allow() for _ in range(3)], [True, True, False])
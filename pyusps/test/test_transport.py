@@ -0,0 +1,239 @@
+import socket
+import time
+
+from io import BytesIO
+from nose.tools import eq_ as eq
+
+from pyusps.transport import (
+    PooledTransport,
+    Response,
+    UrllibTransport,
+    )
+from pyusps.test.util import (
+    FakeClock,
+    assert_raises,
+    compress,
+    start_echo_server,
+    )
+
+def test_pooled_transport_reuses_connection():
+    (server, url) = start_echo_server()
+    transport = PooledTransport()
+    try:
+        for num in range(3):
+            res = transport.get('{url}/ShippingAPI.dll?num={num}'.format(
+                    url=url,
+                    num=num,
+                    ))
+            eq(res.read(), '/ShippingAPI.dll?num={num}'.format(
+                    num=num,
+                    ).encode('utf-8'))
+    finally:
+        transport.close()
+        server.shutdown()
+        server.server_close()
+
+    eq(server.connections, 1)
+
+def test_pooled_transport_idle_timeout():
+    (server, url) = start_echo_server()
+    clock = FakeClock()
+    transport = PooledTransport(idle_timeout=10, clock=clock)
+    try:
+        transport.get(url + '/ShippingAPI.dll')
+        clock.now = 5
+        transport.get(url + '/ShippingAPI.dll')
+        clock.now = 16
+        transport.get(url + '/ShippingAPI.dll')
+    finally:
+        transport.close()
+        server.shutdown()
+        server.server_close()
+
+    eq(server.connections, 2)
+
+def test_pooled_transport_http_error():
+    (server, url) = start_echo_server()
+    transport = PooledTransport()
+    try:
+        msg = assert_raises(
+            IOError,
+            transport.get,
+            url + '/missing',
+            )
+    finally:
+        transport.close()
+        server.shutdown()
+        server.server_close()
+
+    eq(str(msg), 'HTTP Error 404: Not Found')
+
+def test_pooled_transport_timeout():
+    (server, url) = start_echo_server()
+    transport = PooledTransport()
+    try:
+        assert_raises(
+            socket.timeout,
+            transport.get,
+            url + '/slow',
+            timeout=0.1,
+            )
+        # The timeout only applies to the request it was passed to
+        res = transport.get(url + '/slow')
+    finally:
+        transport.close()
+        server.shutdown()
+        server.server_close()
+
+    eq(res.read(), b'/slow')
+
+def test_pooled_transport_reused_timeout():
+    (server, url) = start_echo_server()
+    transport = PooledTransport()
+    try:
+        transport.get(url + '/fast')
+        # A timeout on a reused connection isn't sent again
+        start = time.time()
+        assert_raises(
+            socket.timeout,
+            transport.get,
+            url + '/slow',
+            timeout=0.2,
+            )
+        elapsed = time.time() - start
+    finally:
+        transport.close()
+        server.shutdown()
+        server.server_close()
+
+    assert elapsed < 0.4, elapsed
+    eq(server.connections, 1)
+
+def test_pooled_transport_stale_connection():
+    (server, url) = start_echo_server()
+    transport = PooledTransport()
+    try:
+        transport.get(url + '/drop')
+        # Give the server time to close the connection
+        time.sleep(0.05)
+        res = transport.get(url + '/next')
+    finally:
+        transport.close()
+        server.shutdown()
+        server.server_close()
+
+    eq(res.read(), b'/next')
+    eq(server.connections, 2)
+
+def test_pooled_transport_post():
+    (server, url) = start_echo_server()
+    transport = PooledTransport()
+    try:
+        for num in range(2):
+            res = transport.post(
+                url + '/ShippingAPI.dll',
+                [b'API=Verify&XML=', '{num}'.format(num=num).encode('utf-8')],
+                )
+            eq(res.read(), (
+                    '/ShippingAPI.dll application/x-www-form-urlencoded '
+                    'gzip, deflate API=Verify&XML={num}'.format(num=num).encode('utf-8')
+                    ))
+    finally:
+        transport.close()
+        server.shutdown()
+        server.server_close()
+
+    eq(server.connections, 1)
+
+def test_urllib_transport_post():
+    (server, url) = start_echo_server()
+    try:
+        res = UrllibTransport().post(
+            url + '/ShippingAPI.dll',
+            [b'API=Verify&XML=', b'foo'],
+            )
+        eq(res.read(), (
+                b'/ShippingAPI.dll application/x-www-form-urlencoded '
+                b'identity API=Verify&XML=foo'
+                ))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def _get(transport, url):
+    (server, base_url) = start_echo_server()
+    try:
+        res = transport.get(base_url + url)
+        return (res, res.read(), server.counts)
+    finally:
+        transport.close()
+        server.shutdown()
+        server.server_close()
+
+def test_pooled_transport_gzip():
+    (res, body, (received, sent)) = _get(PooledTransport(), '/gzip?a=1')
+
+    eq(body, b'/gzip?a=1')
+    eq(res.encoding, 'gzip')
+    eq(res.bytes_sent, received.count)
+    eq(res.bytes_received, sent.count)
+
+def test_pooled_transport_deflate():
+    for path in ['/deflate', '/rawdeflate']:
+        (res, body, _) = _get(PooledTransport(), path)
+
+        eq(body, path.encode('utf-8'))
+        eq(res.encoding, 'deflate')
+
+def test_pooled_transport_no_compress():
+    (res, body, (received, sent)) = _get(
+        PooledTransport(compress=False),
+        '/gzip',
+        )
+
+    eq(body, b'/gzip')
+    eq(res.encoding, None)
+    eq(res.bytes_sent, received.count)
+    eq(res.bytes_received, sent.count)
+
+def test_urllib_transport_gzip():
+    (server, url) = start_echo_server()
+    try:
+        res = UrllibTransport(compress=True).get(url + '/gzip')
+        body = res.read()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    eq(body, b'/gzip')
+    eq(res.encoding, 'gzip')
+    eq(res.bytes_sent, len(url + '/gzip'))
+    eq(res.bytes_received, len(compress(b'/gzip', 'gzip')))
+
+def test_response_read_size():
+    data = b''.join(
+        '{num} Main St\n'.format(num=num).encode('utf-8')
+        for num in range(20000)
+        )
+    res = Response(BytesIO(compress(data, 'gzip')), encoding='gzip')
+
+    chunks = []
+    while True:
+        chunk = res.read(1000)
+        if not chunk:
+            break
+        eq(len(chunk) <= 1000, True)
+        chunks.append(chunk)
+
+    eq(b''.join(chunks), data)
+    eq(res.bytes_received, len(compress(data, 'gzip')))
+
+def test_response_unsupported_encoding():
+    msg = assert_raises(
+        IOError,
+        Response,
+        BytesIO(b''),
+        encoding='br',
+        )
+
+    eq(str(msg), "Unsupported Content-Encoding 'br'")
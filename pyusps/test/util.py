@@ -1,3 +1,18 @@
+import threading
+import time
+
+from pyusps.transport import _CountingReader
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+try:
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from SocketServer import ThreadingMixIn
+
 def assert_raises(excClass, callableObj, *args, **kwargs):
     """
     Like unittest.TestCase.assertRaises, but returns the exception.
@@ -14,3 +29,163 @@ def assert_raises(excClass, callableObj, *args, **kwargs):
 def assert_errors_equal(error_1, error_2):
     assert type(error_1) == type(error_2)
     assert error_1.args, error_2.args
+
+class FakeClock(object):
+    """
+    A clock which only moves when now is set or when sleep is called.
+    """
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def echo_response(url):
+    """
+    Build a Verify API response for the request in url. Each
+    requested address is returned upper cased with a fixed zip code.
+    """
+    from io import BytesIO
+    from lxml import etree
+
+    from pyusps.urlutil import parse_qs, urlparse
+
+    query = parse_qs(urlparse(url).query)
+    req = etree.fromstring(query['XML'][0].encode('utf-8'))
+    res = etree.Element('AddressValidateResponse')
+    for address in req.findall('Address'):
+        address_el = etree.SubElement(
+            res,
+            'Address',
+            ID=address.get('ID'),
+            )
+        for tag in ['Address2', 'City', 'State']:
+            el = etree.SubElement(address_el, tag)
+            el.text = (address.findtext(tag) or '').upper()
+        etree.SubElement(address_el, 'Zip5').text = '20770'
+        etree.SubElement(address_el, 'Zip4').text = '1441'
+    return BytesIO(etree.tostring(res))
+
+def compress(data, encoding):
+    """
+    Compress data as a gzip, deflate or raw deflate (rawdeflate)
+    Content-Encoding.
+    """
+    import zlib
+
+    wbits = {
+        'gzip': 16 + zlib.MAX_WBITS,
+        'deflate': zlib.MAX_WBITS,
+        'rawdeflate': -zlib.MAX_WBITS,
+        }[encoding]
+    compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+    return compressor.compress(data) + compressor.flush()
+
+
+class EchoServer(ThreadingMixIn, HTTPServer):
+    """
+    A threaded HTTP server for EchoHandler. connections counts the
+    connections it accepted and counts is the pair of byte counters of
+    the last one.
+    """
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients which time out close the connection early
+        pass
+
+
+class _CountingWriter(object):
+
+    def __init__(self, fp):
+        self._fp = fp
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return self._fp.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    """
+    Answers a Verify API request, one with an XML parameter, like
+    echo_response. Any other GET is answered with its path and a POST
+    with its path, headers and body.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+        # Count the bytes on the wire of every request on the connection
+        self.rfile = _CountingReader(self.rfile)
+        self.wfile = _CountingWriter(self.wfile)
+        self.server.counts = (self.rfile, self.wfile)
+
+    def do_GET(self):
+        if self.path.startswith('/slow'):
+            time.sleep(0.5)
+        status = 404 if self.path.startswith('/missing') else 200
+        if 'XML=' in self.path:
+            body = echo_response(self.path).read()
+        else:
+            body = self.path.encode('utf-8')
+        # /gzip, /deflate and /rawdeflate are compressed if the client
+        # accepts it
+        encoding = self.path.strip('/').split('?')[0]
+        accepted = self.headers.get('Accept-Encoding') or ''
+        if encoding in ('gzip', 'deflate', 'rawdeflate'):
+            if encoding.replace('raw', '') in accepted:
+                body = compress(body, encoding)
+            else:
+                encoding = None
+        else:
+            encoding = None
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding.replace('raw', ''))
+        self.end_headers()
+        self.wfile.write(body)
+        # /drop closes the connection without telling the client, like
+        # a server closing an idle keep-alive connection
+        if self.path.startswith('/drop'):
+            self.close_connection = True
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        body = b' '.join([
+                self.path.encode('utf-8'),
+                self.headers['Content-Type'].encode('utf-8'),
+                (self.headers.get('Accept-Encoding') or '-').encode('utf-8'),
+                self.rfile.read(length),
+                ])
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_echo_server():
+    """
+    Start an EchoServer in a thread. Returns the server and its base
+    URL. Stop it with shutdown and server_close.
+    """
+    server = EchoServer(('127.0.0.1', 0), EchoHandler)
+    server.connections = 0
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:{port}'.format(port=server.server_address[1])
+    return (server, url)
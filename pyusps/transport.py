@@ -0,0 +1,354 @@
+# Transports send a request URL to the Verify API and return a
+# file-like object with the response body. get takes an optional
+# timeout in seconds. post also takes a list of byte strings which are
+# sent, in order, as a form-encoded body.
+#
+# Transports which are created with compress=True ask for a gzip or
+# deflate compressed response and return a Response, which decompresses
+# the body as it's read. A Response also counts the bytes of its
+# request and response on the wire.
+
+import errno
+import socket
+import threading
+import time
+import zlib
+
+from io import BytesIO
+
+import pyusps.urlutil
+
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+
+# Errors which might go away if the request is sent again, e.g.,
+# timeouts, dropped connections and HTTP errors
+transient_errors = (IOError, OSError, socket.error, httplib.HTTPException)
+
+# Errors of a request sent on a connection which the server had already
+# closed
+_disconnect_errnos = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+def _is_disconnect(error):
+    # Timeouts are never retried, they would double the time a request
+    # is allowed to take
+    if isinstance(error, socket.timeout):
+        return False
+    # RemoteDisconnected is a BadStatusLine
+    if isinstance(error, httplib.BadStatusLine):
+        return True
+    return getattr(error, 'errno', None) in _disconnect_errnos
+
+_form_headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+_accept_encoding = 'gzip, deflate'
+# Compressed bytes decompressed at a time
+_chunk_size = 16 * 1024
+
+
+class _CountingReader(object):
+    # Counts the bytes read from a file-like object
+
+    def __init__(self, fp):
+        self._fp = fp
+        self.count = 0
+
+    def read(self, *args):
+        data = self._fp.read(*args)
+        self.count += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self._fp.readline(*args)
+        self.count += len(data)
+        return data
+
+    def readinto(self, buf):
+        size = self._fp.readinto(buf)
+        self.count += size or 0
+        return size
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+
+class _Decompressor(object):
+    # Decompresses a gzip or deflate stream a chunk at a time
+
+    def __init__(self, fp, encoding):
+        self._fp = fp
+        self._encoding = encoding
+        if encoding == 'gzip':
+            self._decompress = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._decompress = zlib.decompressobj()
+        self._started = False
+        self._buffer = b''
+        self._eof = False
+
+    def _decompress_chunk(self, chunk):
+        try:
+            data = self._decompress.decompress(chunk)
+        except zlib.error:
+            if self._started or self._encoding != 'deflate':
+                raise
+            # Some servers send deflate without the zlib header
+            self._decompress = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = self._decompress.decompress(chunk)
+        self._started = True
+        return data
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._fp.read(_chunk_size)
+            if not chunk:
+                self._buffer += self._decompress.flush()
+                self._eof = True
+            else:
+                self._buffer += self._decompress_chunk(chunk)
+        if size < 0 or size >= len(self._buffer):
+            (data, self._buffer) = (self._buffer, b'')
+        else:
+            (data, self._buffer) = (self._buffer[:size], self._buffer[size:])
+        return data
+
+
+class Response(object):
+    # A file-like response body. A gzip or deflate encoded body is
+    # decompressed as it's read, so a parser reading it never needs the
+    # whole decompressed body at once. bytes_sent is the size of the
+    # request and bytes_received the size of the response read so far,
+    # both as they were on the wire, i.e., compressed.
+
+    def __init__(self, fp, encoding=None, bytes_sent=0, bytes_received=0):
+        self._reader = _CountingReader(fp)
+        self._received = bytes_received
+        self.encoding = encoding
+        self.bytes_sent = bytes_sent
+        if encoding in ('gzip', 'x-gzip'):
+            self._fp = _Decompressor(self._reader, 'gzip')
+        elif encoding == 'deflate':
+            self._fp = _Decompressor(self._reader, 'deflate')
+        elif encoding in (None, 'identity'):
+            self._fp = self._reader
+        else:
+            raise IOError(
+                'Unsupported Content-Encoding {encoding!r}'.format(
+                    encoding=encoding,
+                    )
+                )
+
+    @property
+    def bytes_received(self):
+        return self._received + self._reader.count
+
+    def read(self, size=-1):
+        return self._fp.read(size)
+
+    def close(self):
+        close = getattr(self._reader, 'close', None)
+        if close is not None:
+            close()
+
+
+class UrllibTransport(object):
+    # Opens a new connection for every request. This is the default.
+    # urllib doesn't expose the headers on the wire, so a Response only
+    # counts the URL and body of the request and the body of the
+    # response.
+
+    def __init__(self, compress=False):
+        self.compress = compress
+
+    def _open(self, url, data, headers, timeout):
+        if self.compress:
+            headers = dict(headers, **{'Accept-Encoding': _accept_encoding})
+        req = url
+        if data is not None or headers:
+            req = pyusps.urlutil.Request(url, data=data, headers=headers)
+        # Look up urlopen on every call so that it can be patched
+        if timeout is None:
+            res = pyusps.urlutil.urlopen(req)
+        else:
+            res = pyusps.urlutil.urlopen(req, timeout=timeout)
+        encoding = None
+        if self.compress:
+            encoding = res.info().get('Content-Encoding')
+        return Response(
+            res,
+            encoding=encoding,
+            bytes_sent=len(url) + len(data or b''),
+            )
+
+    def get(self, url, timeout=None):
+        return self._open(url, None, {}, timeout)
+
+    def post(self, url, body, timeout=None):
+        return self._open(url, b''.join(body), _form_headers, timeout)
+
+
+class _CountingResponse(httplib.HTTPResponse):
+    # Counts the bytes of the status line, headers and body
+
+    def __init__(self, sock, *args, **kwargs):
+        httplib.HTTPResponse.__init__(self, sock, *args, **kwargs)
+        # fp is dropped once the body has been read
+        self.counter = _CountingReader(self.fp)
+        self.fp = self.counter
+
+
+class _HTTPConnection(httplib.HTTPConnection):
+    response_class = _CountingResponse
+    bytes_sent = 0
+
+    def send(self, data):
+        self.bytes_sent += len(data)
+        httplib.HTTPConnection.send(self, data)
+
+
+class _HTTPSConnection(httplib.HTTPSConnection):
+    response_class = _CountingResponse
+    bytes_sent = 0
+
+    def send(self, data):
+        self.bytes_sent += len(data)
+        httplib.HTTPSConnection.send(self, data)
+
+
+class PooledTransport(object):
+    # Keeps up to pool_size idle keep-alive connections per host.
+    # Connections which have been idle for more than idle_timeout
+    # seconds are closed instead of reused. Safe to share between
+    # threads; each connection is only used by one request at a time.
+    # The counts of a Response include the request line and headers.
+
+    def __init__(
+        self,
+        pool_size=10,
+        idle_timeout=60,
+        compress=True,
+        clock=time.time,
+        ):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.compress = compress
+        self._clock = clock
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, key):
+        (scheme, host, port) = key
+        if scheme == 'https':
+            return _HTTPSConnection(host, port)
+        return _HTTPConnection(host, port)
+
+    def _acquire(self, key):
+        now = self._clock()
+        with self._lock:
+            pool = self._pools.get(key, [])
+            while pool:
+                # Reuse the most recently released connection
+                (conn, released) = pool.pop()
+                if now - released <= self.idle_timeout:
+                    return (conn, True)
+                conn.close()
+        return (self._connect(key), False)
+
+    def _release(self, key, conn):
+        with self._lock:
+            pool = self._pools.setdefault(key, [])
+            if len(pool) < self.pool_size:
+                pool.append((conn, self._clock()))
+                return
+        conn.close()
+
+    def _request(self, conn, path, timeout, body):
+        if timeout is None:
+            timeout = socket.getdefaulttimeout()
+        # The timeout of a connection applies to every request sent on it
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        conn.bytes_sent = 0
+        headers = {'Connection': 'keep-alive'}
+        if self.compress:
+            headers['Accept-Encoding'] = _accept_encoding
+        if body is None:
+            conn.request('GET', path, headers=headers)
+        else:
+            # The chunks are written as they are, without joining them
+            headers.update(_form_headers)
+            headers['Content-Length'] = str(sum(len(chunk) for chunk in body))
+            conn.putrequest(
+                'POST',
+                path,
+                skip_accept_encoding='Accept-Encoding' in headers,
+                )
+            for (name, value) in headers.items():
+                conn.putheader(name, value)
+            conn.endheaders()
+            for chunk in body:
+                conn.send(chunk)
+        res = conn.getresponse()
+        return (res, res.read())
+
+    def get(self, url, timeout=None):
+        return self._send(url, timeout, None)
+
+    def post(self, url, body, timeout=None):
+        return self._send(url, timeout, body)
+
+    def _send(self, url, timeout, body):
+        parts = pyusps.urlutil.urlparse(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path = '{path}?{query}'.format(path=path, query=parts.query)
+
+        (conn, reused) = self._acquire(key)
+        try:
+            (res, data) = self._request(conn, path, timeout, body)
+        except (httplib.HTTPException, socket.error) as e:
+            conn.close()
+            if not reused or not _is_disconnect(e):
+                raise
+            # The server might have closed an idle connection. Try
+            # once more on a new one.
+            conn = self._connect(key)
+            try:
+                (res, data) = self._request(conn, path, timeout, body)
+            except:
+                conn.close()
+                raise
+
+        if res.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+
+        if res.status != 200:
+            raise IOError(
+                'HTTP Error {code}: {reason}'.format(
+                    code=res.status,
+                    reason=res.reason,
+                    )
+                )
+        # The body is counted as the Response reads it
+        return Response(
+            BytesIO(data),
+            encoding=res.getheader('Content-Encoding'),
+            bytes_sent=conn.bytes_sent,
+            bytes_received=res.counter.count - len(data),
+            )
+
+    def close(self):
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools = {}
+        for pool in pools:
+            for (conn, released) in pool:
+                conn.close()
+
+
+default_transport = UrllibTransport()
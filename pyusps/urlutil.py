@@ -4,8 +4,10 @@
 # urllib2/urllib functions in order to support both Python 2 and Python 3.
 
 try:
+    from urllib.request import Request as _Request
     from urllib.request import urlopen as _urlopen
 except ImportError:
+    from urllib2 import Request as _Request
     from urllib2 import urlopen as _urlopen
 
 try:
@@ -13,5 +15,15 @@ try:
 except ImportError:
     from urllib import urlencode as _urlencode
 
+try:
+    from urllib.parse import parse_qs as _parse_qs
+    from urllib.parse import urlparse as _urlparse
+except ImportError:
+    from urlparse import parse_qs as _parse_qs
+    from urlparse import urlparse as _urlparse
+
+Request = _Request
 urlopen = _urlopen
 urlencode = _urlencode
+parse_qs = _parse_qs
+urlparse = _urlparse
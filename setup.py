@@ -29,14 +29,20 @@ setup(
     maintainer_email='andres@thelinuxkid.com',
     url='https://github.com/thelinuxkid/pyusps',
     license='MIT',
-    packages = find_packages(),
+    packages = find_packages(exclude=['benchmarks', 'benchmarks.*']),
     namespace_packages = ['pyusps'],
     test_suite='nose.collector',
     install_requires=[
         'setuptools>=0.6c11',
         'lxml>=2.3.3',
+        'futures>=3.0.5; python_version < "3"',
         ],
     extras_require=EXTRAS_REQUIRES,
+    entry_points={
+        'console_scripts': [
+            'pyusps = pyusps.cli:main',
+            ],
+        },
     classifiers=[
         'Development Status :: 4 - Beta',
         'Intended Audience :: Developers',